@@ -20,6 +20,8 @@ setup(
     packages=find_packages(),
     include_package_data=True,
 
+    python_requires='>=3.7', #asyncio.run(), used by servers and the outbox
+
     install_requires=[
       'setuptools',
       'docopt',
@@ -28,14 +30,16 @@ setup(
       'six'
     ],
 
-    namespace_packages=[
-      "the",
-      ],
+    extras_require={
+      'parquet': ['pyarrow'],
+      },
 
     entry_points={
       'console_scripts': [
         'lunch = the.cook.scripts.lunch:main',
         'manage = the.cook.scripts.manage:main',
+        'lunch_loadtest = the.cook.scripts.loadtest:main',
+        'lunch_benchmark = the.cook.scripts.benchmark:main',
         ],
       },
 
@@ -46,6 +50,7 @@ setup(
       'Natural Language :: English',
       'Programming Language :: Python',
       'Programming Language :: Python :: 3',
+      'Programming Language :: Python :: 3 :: Only',
       ],
 
     )
@@ -1,2 +1,2 @@
-#see http://peak.telecommunity.com/DevCenter/setuptools#namespace-packages
-__import__('pkg_resources').declare_namespace(__name__)
+#see https://docs.python.org/3/library/pkgutil.html#pkgutil.extend_path
+__path__ = __import__('pkgutil').extend_path(__path__, __name__)
@@ -3,5 +3,18 @@
 # Andre Anjos <andre.anjos@idiap.ch>
 # Wed 30 Apr 2014 05:21:04 CEST
 
-__version__=__import__('pkg_resources').get_distribution('the.cook').version
 __logging_format__='[%(asctime)-15s::%(name)s] %(message)s'
+
+def __getattr__(name):
+  """Resolves the package version lazily, as that is slow to compute"""
+
+  if name != '__version__':
+    raise AttributeError("module `%s' has no attribute `%s'" % (__name__, name))
+
+  try:
+    from importlib.metadata import version
+  except ImportError: #python < 3.8
+    version = lambda k: __import__('pkg_resources').get_distribution(k).version
+
+  globals()['__version__'] = version('the.cook')
+  return globals()['__version__']
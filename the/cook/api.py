@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sun 18 Oct 2026 14:10:22 CEST
+
+"""A small HTTP server exposing subscriptions and listings as JSON
+
+The server is built on :py:mod:`asyncio` and the standard library only.
+Requests are parsed on the event loop, while database operations run on a
+pool of threads, each with its own session on a shared, pooled, engine.
+
+The server only listens on loopback interfaces. Clients are identified by the
+owner of their end of the connection, as the kernel reports it (see
+:py:func:`peer_user`), and may only subscribe and unsubscribe themselves.
+
+Endpoints:
+
+  ``GET /lunches[?range=<range>][&long=1]``
+    Lunches in the range (by default, from today on), with their totals and,
+    in long mode, their subscriptions
+
+  ``GET /users/<username>[?range=<range>]``
+    Lunches the user subscribed to, in the range (by default, from today on)
+
+  ``POST /subscribe``
+    Subscribes the client, from a JSON object with keys ``date`` (optional,
+    see :py:func:`.schema.validate_date`), ``persons`` (optional) and
+    ``user`` (optional, must be the client)
+
+  ``POST /unsubscribe``
+    Unsubscribes the client, from a JSON object with keys ``date`` and
+    ``user`` (optional, must be the client)
+"""
+
+import re
+import json
+import socket
+import struct
+import logging
+
+import six
+
+from six.moves.urllib.parse import urlsplit, parse_qs, unquote
+
+from .schema import validate_date, validate_range
+
+class HTTPError(Exception):
+  """An error answered to the client, with its HTTP status code"""
+
+  def __init__(self, status, message):
+
+    Exception.__init__(self, message)
+    self.status = status
+
+REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+    }
+
+MAX_BODY = 64*1024 #bytes
+
+def _range(query):
+
+  try:
+    return validate_range(query.get('range', ['today..'])[0])
+  except ValueError as e:
+    raise HTTPError(400, str(e))
+
+def _date(value):
+
+  if value is not None and not isinstance(value, six.string_types):
+    raise HTTPError(400, "`date' should be a string")
+  try:
+    return validate_date(value)
+  except ValueError as e:
+    raise HTTPError(400, str(e))
+
+def _user(body, caller):
+
+  if caller is None:
+    raise HTTPError(403, "Cannot identify the client")
+  user = body.get('user', caller)
+  if not isinstance(user, six.string_types):
+    raise HTTPError(400, "`user' should be a string")
+  if user != caller:
+    raise HTTPError(403, "User `%s' may not act for `%s'" % (caller, user))
+  return user
+
+def _address(host, family):
+  """Encodes an address like the kernel does in ``/proc/net/tcp[6]``"""
+
+  if family == socket.AF_INET:
+    return '%08X' % struct.unpack('=I', socket.inet_aton(host))[0]
+  return ''.join('%08X' % k for k in \
+      struct.unpack('=4I', socket.inet_pton(socket.AF_INET6, host)))
+
+def peer_user(connection):
+  """Returns the name of the user owning the other end of a TCP connection
+  on this host, or ``None`` if that cannot be found
+
+  Works on Linux, where the kernel lists the owners of sockets in
+  ``/proc/net/tcp`` and ``/proc/net/tcp6``.
+  """
+
+  import pwd
+
+  peer, local = connection.getpeername(), connection.getsockname()
+  family = connection.family
+  # seen from the client, the local and remote addresses are swapped
+  wanted = ('%s:%04X' % (_address(peer[0], family), peer[1]),
+      '%s:%04X' % (_address(local[0], family), local[1]))
+  table = '/proc/net/tcp' if family == socket.AF_INET else '/proc/net/tcp6'
+
+  try:
+    with open(table, 'rt') as f:
+      for line in f:
+        fields = line.split()
+        if tuple(fields[1:3]) == wanted:
+          return pwd.getpwuid(int(fields[7])).pw_name
+  except (IOError, OSError, KeyError):
+    pass
+  return None
+
+def is_loopback(host):
+  """Tells if all addresses of ``host`` are on loopback interfaces"""
+
+  import ipaddress
+  addresses = socket.getaddrinfo(host, None)
+  return bool(addresses) and all(ipaddress.ip_address(
+    six.text_type(k[4][0].split('%')[0])).is_loopback for k in addresses)
+
+def _subscription(s):
+
+  return {
+      'user': s.user.name,
+      'fullname': s.user.fullname,
+      'email': s.user.email,
+      'date': s.lunch.date.isoformat(),
+      'persons': s.persons,
+      'subscribed': s.date.isoformat(),
+      }
+
+class Application(object):
+  """The API operations, independent of HTTP
+
+  Each operation takes a session, the parsed query string, the request body
+  and the name of the client (or ``None``, if unknown) and returns the JSON
+  answer, or raises :py:exc:`HTTPError`.
+  """
+
+  ROUTES = [
+      ('GET', re.compile(r'^/lunches/?$'), 'lunches'),
+      ('GET', re.compile(r'^/users/(?P<username>[^/]+)/?$'), 'user'),
+      ('POST', re.compile(r'^/subscribe/?$'), 'subscribe'),
+      ('POST', re.compile(r'^/unsubscribe/?$'), 'unsubscribe'),
+      ]
+
+  def __init__(self, Session):
+
+    self.Session = Session
+
+  def lunches(self, session, query, body, caller):
+
+    from .menu import lunches_with_totals
+
+    start, end = _range(query)
+    long_desc = query.get('long', ['0'])[0] not in ('0', 'false', '')
+    retval = []
+    for lunch, total in lunches_with_totals(session, start, end,
+        'listing' if long_desc else None):
+      retval.append({
+        'date': lunch.date.isoformat(),
+        'menu_french': lunch.menu_french,
+        'menu_english': lunch.menu_english,
+        'total': total,
+        })
+      if long_desc:
+        retval[-1]['subscriptions'] = [_subscription(k) \
+            for k in lunch.subscriptions]
+    return {'lunches': retval}
+
+  def user(self, session, query, body, caller, username):
+
+    from .menu import subscriptions_in_range, subscriber_totals
+
+    start, end = _range(query)
+    totals = dict(subscriber_totals(session, start, end))
+    retval = []
+    for s in subscriptions_in_range(session, username, start, end, 'listing'):
+      retval.append(_subscription(s))
+      retval[-1]['menu_english'] = s.lunch.menu_english
+      retval[-1]['total'] = totals.get(s.lunch_id, 0)
+    return {'user': username, 'subscriptions': retval}
+
+  def subscribe(self, session, query, body, caller):
+
+    from .menu import subscribe
+
+    user = _user(body, caller)
+    persons = body.get('persons', 1)
+    if not isinstance(persons, int) or isinstance(persons, bool) or \
+        persons < 1:
+      raise HTTPError(400, "`persons' should be a positive integer")
+    try:
+      subscription = subscribe(session, _date(body.get('date')), persons,
+          user)
+    except ValueError as e: #unknown user
+      raise HTTPError(400, str(e))
+    if subscription is None:
+      raise HTTPError(404, "Cannot find lunch with open subscription")
+    return {'subscription': _subscription(subscription)}
+
+  def unsubscribe(self, session, query, body, caller):
+
+    from .menu import unsubscribe
+
+    user = _user(body, caller)
+    subscription = unsubscribe(session, _date(body.get('date')), user)
+    if subscription is None:
+      raise HTTPError(404, "User `%s' is not subscribed to that lunch" % user)
+    return {'unsubscribed': {'user': user,
+      'date': subscription.lunch.date.isoformat()}}
+
+  def __call__(self, method, target, body, caller=None):
+    """Answers a request from the client ``caller`` (a user name), returns a
+    tuple with the status and the JSON answer
+
+    This runs on a worker thread, with a session of its own.
+    """
+
+    url = urlsplit(target)
+    path = unquote(url.path)
+    query = parse_qs(url.query)
+
+    session = self.Session()
+    try:
+      allowed = []
+      for route_method, pattern, name in self.ROUTES:
+        match = pattern.match(path)
+        if match is None: continue
+        if route_method != method:
+          allowed.append(route_method)
+          continue
+        if body:
+          try:
+            body = json.loads(body.decode('utf-8'))
+          except ValueError as e:
+            raise HTTPError(400, 'Invalid JSON body: %s' % e)
+          if not isinstance(body, dict):
+            raise HTTPError(400, 'JSON body should be an object')
+        return 200, getattr(self, name)(session, query, body or {}, caller,
+            **match.groupdict())
+      if allowed: raise HTTPError(405, 'Use %s' % ', '.join(allowed))
+      raise HTTPError(404, "No such resource `%s'" % path)
+
+    except HTTPError as e:
+      return e.status, {'error': str(e)}
+
+    except Exception as e:
+      logging.exception("Error answering %s %s" % (method, target))
+      return 500, {'error': '%s: %s' % (type(e).__name__, e)}
+
+    finally:
+      session.close()
+
+class Server(object):
+  """Serves the API over HTTP/1.1, with persistent connections
+
+  Database operations run on ``workers`` threads, sharing an engine with as
+  many pooled connections.
+  """
+
+  def __init__(self, dbfile, workers=4):
+
+    from sqlalchemy.orm import sessionmaker
+    from .models import create
+
+    self.engine = create(dbfile, pool_size=workers)
+    # answers are built from objects after the operations commit: with
+    # expiration, those would be re-loaded and could be gone by then, as
+    # another request may have (un)subscribed in between
+    self.application = Application(sessionmaker(bind=self.engine,
+      expire_on_commit=False))
+    self.workers = workers
+    self.requests = 0
+
+  async def read_request(self, reader):
+    """Reads a request, returns ``(method, target, headers, body)`` or
+    ``None`` if the client closed the connection"""
+
+    line = await reader.readline()
+    if not line.strip(): return None
+    try:
+      method, target, version = line.decode('latin-1').split()
+    except ValueError:
+      raise HTTPError(400, 'Invalid request line')
+
+    headers = {}
+    while True:
+      line = await reader.readline()
+      if line in (b'\r\n', b'\n', b''): break
+      name, _, value = line.decode('latin-1').partition(':')
+      headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get('content-length', 0) or 0)
+    if length > MAX_BODY: raise HTTPError(413, 'Request body too large')
+    body = await reader.readexactly(length) if length else b''
+
+    if version == 'HTTP/1.0':
+      headers.setdefault('connection', 'close')
+    return method.upper(), target, headers, body
+
+  def write_response(self, writer, status, answer, keep_alive):
+
+    data = json.dumps(answer).encode('utf-8')
+    writer.write(('HTTP/1.1 %d %s\r\n'
+      'Content-Type: application/json\r\n'
+      'Content-Length: %d\r\n'
+      'Connection: %s\r\n\r\n' % (status, REASONS[status], len(data),
+        'keep-alive' if keep_alive else 'close')).encode('latin-1') + data)
+
+  async def handle(self, reader, writer):
+    """Answers all requests on a client connection"""
+
+    import asyncio
+    loop = asyncio.get_event_loop()
+
+    caller = peer_user(writer.get_extra_info('socket'))
+
+    try:
+      while True:
+        try:
+          request = await self.read_request(reader)
+        except HTTPError as e:
+          self.write_response(writer, e.status, {'error': str(e)}, False)
+          break
+        if request is None: break
+        method, target, headers, body = request
+        status, answer = await loop.run_in_executor(self.executor,
+            self.application, method, target, body, caller)
+        self.requests += 1
+        logging.debug("%s %s %d" % (method, target, status))
+        keep_alive = headers.get('connection', '').lower() != 'close'
+        self.write_response(writer, status, answer, keep_alive)
+        await writer.drain()
+        if not keep_alive: break
+    except (ConnectionError, asyncio.IncompleteReadError):
+      pass
+    finally:
+      writer.close()
+
+  async def start(self, host='127.0.0.1', port=8080):
+    """Starts listening, returns the :py:class:`asyncio.Server`
+
+    Raises :py:exc:`ValueError` if ``host`` is not a loopback interface.
+    """
+
+    import asyncio
+
+    if not is_loopback(host):
+      raise ValueError("The API server only listens on loopback interfaces " \
+          "(e.g. 127.0.0.1), not on `%s'" % host)
+    from concurrent.futures import ThreadPoolExecutor
+
+    self.executor = ThreadPoolExecutor(self.workers)
+    server = await asyncio.start_server(self.handle, host, port)
+    logging.info("Serving on http://%s:%d with %d worker(s)" % \
+        (host, server.sockets[0].getsockname()[1], self.workers))
+    return server
+
+  def serve(self, host='127.0.0.1', port=8080):
+    """Serves requests forever"""
+
+    import asyncio
+
+    async def main():
+      server = await self.start(host, port)
+      async with server: await server.serve_forever()
+
+    asyncio.run(main())
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sun 18 Oct 2026 16:22:05 CEST
+
+"""A local daemon answering ``lunch`` commands over a Unix socket
+
+The daemon keeps a warm database session and user directory, so the
+``lunch`` utility only has to send the command and print the answer. Users
+are identified by the credentials of the connecting process (``SO_PEERCRED``)
+and not by anything the client says.
+
+The protocol is one JSON object per line: the client sends the ``command``
+(``add``, ``remove``, ``list`` or ``mine``), the ``date`` as typed by the
+user and the number of ``persons``. The daemon answers with the ``output``
+lines to print.
+
+This module is imported by the ``lunch`` utility, so it must stay light: do
+not import SQLAlchemy or other heavy modules at the top.
+"""
+
+import os
+import json
+import time
+import socket
+import logging
+import datetime
+
+from .instrument import record
+
+TIMEOUT = 30 #seconds
+
+def socketfile():
+  """Returns the path to the daemon socket
+
+  This is the value of the environment variable ``THECOOK_SOCKET`` or, if
+  that is not set, a file next to the package bound database.
+  """
+
+  from .data import dbfile
+  return os.environ.get('THECOOK_SOCKET') or \
+      os.path.join(os.path.dirname(dbfile()), 'thecook.sock')
+
+def answer(command, date=None, persons=1, username=None, session=None,
+    connection=None):
+  """Runs a ``lunch`` command, returns the lines to print
+
+  ``add`` and ``remove`` need a ``session``. ``list`` and ``mine`` only read
+  through ``connection`` (e.g. from :py:func:`.models.connect_readonly`) or,
+  if not given, the connection of the ``session``. If neither is given, the
+  database is taken as empty.
+
+  ``username`` is only given by the daemon, from the credentials of the
+  client. Otherwise, commands act for the (real) user running this process,
+  never for one named by the environment (e.g. ``$USER``).
+  """
+
+  from .utils import format_date
+  today = datetime.datetime.today()
+
+  if command == 'add':
+    from .menu import subscribe
+    sub = subscribe(session, date, persons, username)
+    if not sub: return []
+    return ["User `%s' successfully subscribed for lunch `%s' at `%s'" % \
+        (sub.user.name, sub.lunch.menu_english, format_date(sub.lunch.date))]
+
+  elif command == 'remove':
+    from .menu import unsubscribe
+    sub = unsubscribe(session, date, username)
+    if not sub: return []
+    return ["User `%s' successfully unsubscribed from lunch `%s' at `%s'" % \
+        (sub.user.name, sub.lunch.menu_english, format_date(sub.lunch.date))]
+
+  if connection is None and session is not None:
+    connection = session.connection()
+
+  if command == 'list':
+    retval = []
+    if connection is not None:
+      from .menu import lunch_list_readonly
+      retval = lunch_list_readonly(connection, today, datetime.date.max,
+          long_desc=True)
+    return retval or ["No lunches programmed as of this time"]
+
+  elif command == 'mine':
+    if username is None:
+      import pwd
+      username = pwd.getpwuid(os.getuid()).pw_name
+    retval = []
+    if connection is not None:
+      from .menu import user_list_readonly
+      retval = user_list_readonly(connection, username, today,
+          datetime.date.max, long_desc=True)
+    if len(retval) <= 1:
+      return ["User `%s' is not registered to any upcoming lunches" % username]
+    return retval
+
+  raise ValueError("Unknown command `%s'" % command)
+
+def request(command, date=None, persons=1, path=None):
+  """Sends a command to the daemon, returns the lines to print
+
+  Returns ``None`` if no daemon is listening at ``path`` (by default, see
+  :py:func:`socketfile`), in which case the caller should access the database
+  directly.
+  """
+
+  path = path or socketfile()
+  if not os.path.exists(path): return None
+
+  client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  client.settimeout(TIMEOUT)
+  try:
+    client.connect(path)
+  except (IOError, OSError) as e: #stale socket file
+    logging.info("Cannot connect to daemon at `%s' (%s)" % (path, e))
+    client.close()
+    return None
+
+  start = time.time()
+  try:
+    message = {'command': command, 'date': date, 'persons': persons}
+    client.sendall(json.dumps(message).encode('utf-8') + b'\n')
+    data = client.makefile('rb').readline()
+  finally:
+    client.close()
+    record('daemon', command, time.time() - start)
+
+  reply = json.loads(data.decode('utf-8'))
+  if 'error' in reply: raise RuntimeError(reply['error'])
+  for level, message in reply.get('log', []): logging.log(level, message)
+  return reply['output']
+
+def peer_user(connection):
+  """Returns the name of the user running the process on the other end of a
+  Unix socket"""
+
+  import pwd
+  import struct
+
+  credentials = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+      struct.calcsize('3i'))
+  pid, uid, gid = struct.unpack('3i', credentials)
+  return pwd.getpwuid(uid).pw_name
+
+class _Collector(logging.Handler):
+  """Keeps errors logged while answering a command, for the client"""
+
+  def __init__(self):
+
+    logging.Handler.__init__(self, logging.WARNING)
+    self.messages = []
+
+  def emit(self, record):
+
+    self.messages.append((record.levelno, self.format(record)))
+
+class Daemon(object):
+  """Answers ``lunch`` commands on a Unix socket, with a warm session
+
+  Commands run one at a time, on a single thread holding the session.
+  """
+
+  def __init__(self, dbfile, path=None):
+
+    from .models import connect
+    self.session = connect(dbfile)
+    self.path = path or socketfile()
+    self.requests = 0
+
+  def answer(self, message, username):
+    """Answers a decoded request for the user, returns the reply"""
+
+    from .schema import validate_date
+
+    collector = _Collector()
+    logging.getLogger().addHandler(collector)
+    try:
+      date = validate_date(message.get('date'))
+      output = answer(message['command'], date, int(message.get('persons', 1)),
+          username, session=self.session)
+      return {'output': output, 'log': collector.messages}
+    except Exception as e:
+      logging.exception("Error answering `%s' for `%s'" % (message, username))
+      self.session.rollback()
+      return {'error': '%s: %s' % (type(e).__name__, e)}
+    finally:
+      logging.getLogger().removeHandler(collector)
+      self.session.close() #next command sees fresh data
+      self.requests += 1
+
+  async def handle(self, reader, writer):
+
+    import asyncio
+    loop = asyncio.get_event_loop()
+
+    try:
+      username = peer_user(writer.get_extra_info('socket'))
+      line = await reader.readline()
+      try:
+        message = json.loads(line.decode('utf-8'))
+      except ValueError as e:
+        reply = {'error': 'Invalid request: %s' % e}
+      else:
+        reply = await loop.run_in_executor(self.executor, self.answer, message,
+            username)
+      writer.write(json.dumps(reply).encode('utf-8') + b'\n')
+      await writer.drain()
+    except ConnectionError:
+      pass
+    finally:
+      writer.close()
+
+  async def start(self):
+    """Starts listening, returns the :py:class:`asyncio.Server`"""
+
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    self.executor = ThreadPoolExecutor(1)
+    if os.path.exists(self.path): os.unlink(self.path) #stale
+    server = await asyncio.start_unix_server(self.handle, self.path)
+    os.chmod(self.path, 0o666) #any user may connect, see peer_user()
+    logging.info("Listening on `%s'" % self.path)
+    return server
+
+  def serve(self):
+    """Answers commands until interrupted"""
+
+    import asyncio
+
+    async def main():
+      server = await self.start()
+      async with server: await server.serve_forever()
+
+    try:
+      asyncio.run(main())
+    finally:
+      if os.path.exists(self.path): os.unlink(self.path)
@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sat 17 Oct 2026 23:48:55 CEST
+
+"""Package bound data"""
+
+import os
+
+def dbfile():
+  """Returns the path to the default, package bound, database file
+
+  The environment variable ``THECOOK_DBFILE`` may point to another file.
+  """
+
+  return os.environ.get('THECOOK_DBFILE') or \
+      os.path.join(os.path.dirname(os.path.abspath(__file__)), 'thecook.sql3')
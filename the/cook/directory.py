@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sat 17 Oct 2026 22:05:12 CEST
+
+"""Cached lookups of user information on the system directory"""
+
+import os
+import pwd
+import json
+import time
+import logging
+import subprocess
+import six
+
+from .instrument import record
+
+TEL = '/idiap/resource/software/scripts/tel'
+PHONE_PREFIX = '+41277217'
+UNKNOWN_PHONE = PHONE_PREFIX + 'XXX'
+UNKNOWN_FULLNAME = six.u('Joe Doe')
+
+def backquote(cmd):
+  """Runs `cmd` and returns the answer"""
+
+  start = time.time()
+  try:
+    return subprocess.Popen(cmd, stdout=subprocess.PIPE).communicate()[0]
+  finally:
+    record('subprocess', ' '.join(cmd), time.time() - start)
+
+def _parse_phone(output):
+
+  try:
+    data = output.decode('utf-8', 'replace').split('\n')[1]
+  except IndexError:
+    return UNKNOWN_PHONE
+
+  if data.strip():
+    return PHONE_PREFIX + data.split()[-1].strip()
+  else:
+    return UNKNOWN_PHONE
+
+def lookup_phone(name):
+  """Looks up the phone number of a user using the Idiap ``tel`` script"""
+
+  return lookup_phones([name])[name]
+
+def lookup_phones(names):
+  """Looks up the phone numbers of many users, returns a dictionary
+
+  The ``tel`` script takes a single user, so one process is started for each
+  user, all at once, and their answers collected after.
+  """
+
+  retval = dict((k, UNKNOWN_PHONE) for k in names)
+  if not names: return retval
+
+  start = time.time()
+  processes = []
+  try:
+    for name in names:
+      processes.append((name, subprocess.Popen([TEL, name],
+        stdout=subprocess.PIPE)))
+  except OSError as e:
+    logging.error(e)
+  for name, process in processes:
+    retval[name] = _parse_phone(process.communicate()[0])
+  if processes:
+    record('subprocess', '%s (%d user(s))' % (TEL, len(processes)),
+        time.time() - start)
+  return retval
+
+class Directory(object):
+  """Resolves user ids, full names and phone numbers, with caching
+
+  Answers are kept in memory for the lifetime of this object. If a
+  ``cachefile`` is given, answers are also stored there (in JSON format) and
+  re-used by other processes for ``ttl`` seconds.
+  """
+
+  def __init__(self, cachefile=None, ttl=24*60*60):
+
+    self.cachefile = cachefile
+    self.ttl = ttl
+    self.entries = {}
+    self.load()
+
+  def load(self):
+    """Loads non-expired entries from the cache file, if one is set"""
+
+    if not self.cachefile or not os.path.exists(self.cachefile): return
+
+    try:
+      with open(self.cachefile, 'rt') as f: entries = json.load(f)
+    except (IOError, ValueError) as e:
+      logging.warn("Ignoring unreadable user cache at `%s': %s" % \
+          (self.cachefile, e))
+      return
+
+    now = time.time()
+    for name, entry in entries.items():
+      if now - entry.get('time', 0) < self.ttl: self.entries[name] = entry
+
+  def save(self):
+    """Saves the current entries into the cache file, if one is set"""
+
+    if not self.cachefile: return
+
+    tmpfile = '%s.%d' % (self.cachefile, os.getpid())
+    try:
+      with open(tmpfile, 'wt') as f: json.dump(self.entries, f)
+      os.rename(tmpfile, self.cachefile)
+    except (IOError, OSError) as e:
+      logging.warn("Cannot save user cache at `%s': %s" % (self.cachefile, e))
+
+  def fresh(self, name, phone=False):
+    """Tells if we have a non-expired entry for the user (with a phone
+    number, if ``phone`` is set)"""
+
+    entry = self.entries.get(name)
+    if entry is None or time.time() - entry['time'] >= self.ttl: return False
+    return not phone or entry.get('phone') is not None
+
+  def resolve(self, names, phones=True):
+    """Resolves a batch of users at once
+
+    Users that are not cached are looked up together on the password database,
+    in a single pass. Returns a dictionary mapping each user name to its entry,
+    a dictionary with keys ``uid``, ``fullname`` and ``phone``.
+
+    Phone numbers are slow to look up (see :py:func:`lookup_phones`): unless
+    ``phones`` is set, they are left as ``None`` on new entries.
+    """
+
+    missing = sorted(set(k for k in names if not self.fresh(k)))
+    changed = bool(missing)
+
+    if missing:
+      accounts = {}
+      if len(missing) > 1:
+        wanted = set(missing)
+        accounts = dict((k.pw_name, k) for k in pwd.getpwall() \
+            if k.pw_name in wanted)
+
+      now = time.time()
+      for name in missing:
+        account = accounts.get(name)
+        if account is None: #not enumerable or a single user
+          try: account = pwd.getpwnam(name)
+          except KeyError: pass
+        if account is None:
+          logging.error("Cannot find user `%s' on the system directory" % name)
+        self.entries[name] = {
+            'uid': account.pw_uid if account else None,
+            'fullname': account.pw_gecos if account else UNKNOWN_FULLNAME,
+            'phone': None,
+            'time': now,
+            }
+
+    if phones:
+      lacking = sorted(set(k for k in names if not self.fresh(k, phone=True)))
+      for name, phone in lookup_phones(lacking).items():
+        self.entries[name]['phone'] = phone
+      changed = changed or bool(lacking)
+
+    if changed: self.save()
+
+    return dict((k, self.entries[k]) for k in names)
+
+  def lookup(self, name, phone=True):
+    """Resolves a single user, returns its entry"""
+
+    return self.resolve([name], phone)[name]
+
+  def uid(self, name):
+    """Returns the numerical user identifier or ``None``, if unknown"""
+
+    return self.lookup(name, phone=False)['uid']
+
+  def fullname(self, name):
+    """Returns the user full name"""
+
+    return self.lookup(name, phone=False)['fullname']
+
+  def phone(self, name):
+    """Returns the user phone number"""
+
+    return self.lookup(name)['phone']
+
+_directory = None
+
+def configure(cachefile=None, ttl=24*60*60):
+  """Sets up the directory used by :py:class:`the.cook.models.User`"""
+
+  global _directory
+  _directory = Directory(cachefile, ttl)
+  return _directory
+
+def get_directory():
+  """Returns the directory used by :py:class:`the.cook.models.User`
+
+  Unless :py:func:`configure` is called, the directory is kept in memory only
+  or, if the environment variable ``THECOOK_USER_CACHE`` is set, persisted on
+  the file it points to.
+  """
+
+  if _directory is None:
+    configure(os.environ.get('THECOOK_USER_CACHE'))
+  return _directory
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sun 18 Oct 2026 21:05:18 CEST
+
+"""Streams the history of lunches and subscriptions to files
+
+Rows are read with a server-side cursor, in batches, and written as they
+arrive, so memory use does not depend on how many lunches are exported.
+There is one row per subscription, plus one for each lunch without
+subscriptions (with empty subscription fields).
+
+Formats are CSV, JSON Lines and, if :py:mod:`pyarrow` is installed
+(``pip install the.cook[parquet]``), Parquet.
+"""
+
+import csv
+import json
+import datetime
+
+from sqlalchemy import select, and_
+
+from .models import User, Lunch, Subscription
+
+COLUMNS = ('date', 'menu_french', 'menu_english', 'user', 'fullname', 'email',
+    'persons', 'subscribed')
+"""Fields of exported rows, in order"""
+
+BATCH = 1000 #rows
+
+def rows(connection, start=datetime.date.min, end=datetime.date.max,
+    username=None, batch=BATCH):
+  """Yields lunches and subscriptions in the (start, end) range, as tuples
+  with the fields in :py:data:`COLUMNS`
+
+  If ``username`` is given, only yields subscriptions of that user.
+  """
+
+  lunch = Lunch.__table__
+  subscription = Subscription.__table__
+  user = User.__table__
+
+  condition = and_(lunch.c.date >= start, lunch.c.date <= end)
+  if username:
+    source = lunch.join(subscription).join(user)
+    condition = and_(condition, user.c.name == username)
+  else:
+    source = lunch.outerjoin(subscription).outerjoin(user)
+
+  query = select(lunch.c.date, lunch.c.menu_french, lunch.c.menu_english,
+      user.c.name, user.c.fullname, user.c.email, subscription.c.persons,
+      subscription.c.date).select_from(source).where(condition).order_by(
+          lunch.c.date, subscription.c.id)
+
+  result = connection.execution_options(stream_results=True,
+      max_row_buffer=batch).execute(query)
+  for partition in result.partitions(batch):
+    for row in partition: yield tuple(row)
+
+def _text(value):
+
+  if value is None: return ''
+  if isinstance(value, (datetime.date, datetime.datetime)):
+    return value.isoformat()
+  return value
+
+def write_csv(rows, stream):
+  """Writes rows as CSV, with a header, returns how many were written"""
+
+  writer = csv.writer(stream)
+  writer.writerow(COLUMNS)
+  count = 0
+  for row in rows:
+    writer.writerow([_text(k) for k in row])
+    count += 1
+  return count
+
+def write_jsonl(rows, stream):
+  """Writes rows as JSON objects, one per line, returns how many were
+  written"""
+
+  count = 0
+  for row in rows:
+    stream.write(json.dumps(dict(zip(COLUMNS,
+      [None if k is None else _text(k) for k in row])), sort_keys=True))
+    stream.write('\n')
+    count += 1
+  return count
+
+def write_parquet(rows, path, batch=BATCH):
+  """Writes rows to a Parquet file, one row group per batch, returns how many
+  were written
+
+  Needs :py:mod:`pyarrow`.
+  """
+
+  try:
+    import pyarrow
+    import pyarrow.parquet
+  except ImportError:
+    raise ValueError("Exporting to Parquet needs pyarrow, install it with " \
+        "`pip install the.cook[parquet]'")
+
+  schema = pyarrow.schema([
+    ('date', pyarrow.date32()),
+    ('menu_french', pyarrow.string()),
+    ('menu_english', pyarrow.string()),
+    ('user', pyarrow.string()),
+    ('fullname', pyarrow.string()),
+    ('email', pyarrow.string()),
+    ('persons', pyarrow.int32()),
+    ('subscribed', pyarrow.timestamp('us')),
+    ])
+
+  def flush(writer, buffered):
+    columns = list(zip(*buffered))
+    writer.write_table(pyarrow.Table.from_arrays([pyarrow.array(c,
+      type=schema.field(i).type) for i, c in enumerate(columns)],
+      schema=schema))
+
+  count = 0
+  buffered = []
+  with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+    for row in rows:
+      buffered.append(row)
+      if len(buffered) == batch:
+        flush(writer, buffered)
+        count += len(buffered)
+        buffered = []
+    if buffered:
+      flush(writer, buffered)
+      count += len(buffered)
+  return count
+
+FORMATS = {
+    'csv': '.csv',
+    'jsonl': '.jsonl',
+    'parquet': '.parquet',
+    }
+"""Export formats and their file extensions"""
+
+def guess_format(path):
+  """Returns the format of a file, from its extension, or ``None``"""
+
+  for name, extension in FORMATS.items():
+    if path.lower().endswith(extension): return name
+  return None
+
+def export(connection, stream_or_path, format='csv', start=datetime.date.min,
+    end=datetime.date.max, username=None):
+  """Exports lunches and subscriptions, returns how many rows were written
+
+  Text formats are written to a stream or a file path, Parquet only to a
+  file path.
+  """
+
+  if format not in FORMATS:
+    raise ValueError("Unknown export format `%s' (use one of %s)" % \
+        (format, ', '.join(sorted(FORMATS))))
+
+  data = rows(connection, start, end, username)
+
+  if format == 'parquet':
+    if not isinstance(stream_or_path, str):
+      raise ValueError("Parquet exports need an output file")
+    return write_parquet(data, stream_or_path)
+
+  writer = write_csv if format == 'csv' else write_jsonl
+  if isinstance(stream_or_path, str):
+    with open(stream_or_path, 'wt', newline='', encoding='utf-8') as f:
+      return writer(data, f)
+  return writer(data, stream_or_path)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sun 18 Oct 2026 20:14:43 CEST
+
+"""Reads menus for many dates from CSV, JSON or iCalendar files
+
+Readers return a list of ``(where, date, menu_french, menu_english)`` tuples,
+in file order, where ``where`` locates the entry in the file (for messages).
+Menus are written like for ``manage add`` (see
+:py:func:`.schema.validate_menu`), or given in two fields. Dates are written
+like for ``manage add`` (see :py:func:`.schema.validate_date`) or in ISO
+format (``2014-04-28``).
+"""
+
+import io
+import os
+import csv
+import json
+import datetime
+
+import six
+
+from .schema import validate_date, validate_menu
+from .utils import as_unicode
+
+def parse_date(o):
+  """Parses a date in ISO format or as accepted by ``manage add``"""
+
+  o = o.strip()
+  try:
+    return datetime.datetime.strptime(o, '%Y-%m-%d').date()
+  except ValueError:
+    pass
+  retval = validate_date(o)
+  if not isinstance(retval, datetime.date):
+    raise ValueError("Date `%s' does not refer to a specific day" % o)
+  return retval
+
+def parse_entry(where, entry):
+  """Validates a dictionary with keys ``date`` and ``menu`` (or
+  ``menu_french`` and, optionally, ``menu_english``)"""
+
+  try:
+    for key, value in entry.items():
+      if value is not None and not isinstance(value, six.string_types):
+        raise ValueError("`%s' should be a string, not `%s'" % (key, value))
+    if not entry.get('date'): raise ValueError("Missing `date'")
+    date = parse_date(entry['date'])
+    if entry.get('menu'):
+      french, english = validate_menu(entry['menu'])
+    elif entry.get('menu_french'):
+      french = as_unicode(entry['menu_french'].strip())
+      english = as_unicode((entry.get('menu_english') or '').strip())
+    else:
+      raise ValueError("Missing `menu' (or `menu_french')")
+  except ValueError as e:
+    raise ValueError('%s: %s' % (where, e))
+  return where, date, french, english
+
+def read_csv(stream):
+  """Reads menus from CSV, with a header naming the columns ``date`` and
+  ``menu`` (or ``menu_french`` and ``menu_english``)"""
+
+  reader = csv.DictReader(stream)
+  if not reader.fieldnames or 'date' not in reader.fieldnames:
+    raise ValueError("CSV files need a header with a `date' column")
+  return [parse_entry('line %d' % reader.line_num, row) for row in reader]
+
+def read_json(stream):
+  """Reads menus from JSON: a list of objects with the keys ``date`` and
+  ``menu`` (or ``menu_french`` and ``menu_english``), or an object mapping
+  dates to menus"""
+
+  data = json.load(stream)
+  if isinstance(data, dict):
+    data = [{'date': k, 'menu': v} for k, v in sorted(data.items())]
+  if not isinstance(data, list) or \
+      not all(isinstance(k, dict) for k in data):
+    raise ValueError("JSON files should contain a list of objects")
+  return [parse_entry('entry %d' % (i+1), k) for i, k in enumerate(data)]
+
+def _ical_lines(stream):
+  """Yields unfolded iCalendar content lines, with their line numbers"""
+
+  start, current = 0, None
+  for number, line in enumerate(stream, 1):
+    line = line.rstrip('\r\n')
+    if line[:1] in (' ', '\t') and current is not None:
+      current += line[1:]
+      continue
+    if current is not None: yield start, current
+    start, current = number, line
+  if current is not None: yield start, current
+
+def _ical_text(value):
+
+  return value.replace('\\n', ' ').replace('\\N', ' ').replace('\\,', ',') \
+      .replace('\\;', ';').replace('\\\\', '\\').strip()
+
+def read_ical(stream):
+  """Reads menus from iCalendar events: the start date (``DTSTART``) and
+  the menu (``SUMMARY``)"""
+
+  retval = []
+  event = None
+  for number, line in _ical_lines(stream):
+    name, _, value = line.partition(':')
+    name = name.split(';')[0].upper()
+    if name == 'BEGIN' and value.upper() == 'VEVENT':
+      event = {'where': 'event at line %d' % number}
+    elif name == 'END' and value.upper() == 'VEVENT' and event is not None:
+      where = event.pop('where')
+      if 'date' in event:
+        try:
+          event['date'] = datetime.datetime.strptime(event['date'][:8],
+              '%Y%m%d').date().isoformat()
+        except ValueError:
+          raise ValueError("%s: Cannot parse `DTSTART'" % where)
+      retval.append(parse_entry(where, event))
+      event = None
+    elif event is not None and name == 'DTSTART':
+      event['date'] = value.strip()
+    elif event is not None and name == 'SUMMARY':
+      event['menu'] = _ical_text(value)
+  return retval
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+    '.ics': read_ical,
+    '.ical': read_ical,
+    }
+"""Readers by file extension"""
+
+def read(path):
+  """Reads menus from a file, in a format chosen by its extension"""
+
+  extension = os.path.splitext(path)[1].lower()
+  if extension not in READERS:
+    raise ValueError("Cannot import `%s' (use one of %s)" % \
+        (path, ', '.join(sorted(READERS))))
+  with io.open(path, 'rt', encoding='utf-8', newline='') as f:
+    return READERS[extension](f)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sun 18 Oct 2026 19:20:36 CEST
+
+"""Opt-in instrumentation: where do commands spend their time?
+
+Once :py:func:`enable` is called, every SQL statement run through engines
+from :py:mod:`.models` is counted and timed, together with the place in this
+package that issued it. Spawned processes (see
+:py:func:`.directory.backquote`), messages sent to the SMTP server and
+requests to the ``lunch`` daemon are timed as well. :py:func:`summary`
+returns the hottest entries of each kind.
+
+While disabled, recording costs a single test.
+"""
+
+import os
+import sys
+import time
+import threading
+import traceback
+
+_profiler = None
+
+PACKAGE = os.path.dirname(os.path.abspath(__file__))
+MODULE = os.path.abspath(__file__)
+
+class Profiler(object):
+  """Accumulates counts and times, by kind and label"""
+
+  def __init__(self):
+
+    self.entries = {} #kind -> label -> [count, seconds]
+    self.lock = threading.Lock()
+    self.start = time.time()
+
+  def record(self, kind, label, seconds):
+
+    with self.lock:
+      entry = self.entries.setdefault(kind, {}).setdefault(label, [0, 0.0])
+      entry[0] += 1
+      entry[1] += seconds
+
+  def totals(self, kind):
+    """Returns the total count and time of entries of a kind"""
+
+    values = self.entries.get(kind, {}).values()
+    return sum(k[0] for k in values), sum(k[1] for k in values)
+
+  def hottest(self, kind, limit=10):
+    """Returns the ``(label, count, seconds)`` with the longest total times"""
+
+    retval = [(label, count, seconds) for label, (count, seconds) in \
+        self.entries.get(kind, {}).items()]
+    retval.sort(key=lambda k: (-k[2], -k[1], k[0]))
+    return retval[:limit]
+
+def enable():
+  """Starts recording, returns the :py:class:`Profiler`"""
+
+  global _profiler
+  if _profiler is None: _profiler = Profiler()
+  return _profiler
+
+def disable():
+  """Stops recording, returns the :py:class:`Profiler` (or ``None``)"""
+
+  global _profiler
+  retval, _profiler = _profiler, None
+  return retval
+
+def get_profiler():
+  """Returns the current :py:class:`Profiler` or ``None``, if disabled"""
+
+  return _profiler
+
+def record(kind, label, seconds):
+  """Records something that took ``seconds``, if recording is enabled"""
+
+  if _profiler is not None: _profiler.record(kind, label, seconds)
+
+def call_site():
+  """Returns the innermost place in this package (outside this module) that
+  led here, as ``module.py:line (function)``"""
+
+  for filename, line, function, text in reversed(traceback.extract_stack()):
+    if filename.startswith(PACKAGE) and filename != MODULE:
+      return '%s:%d (%s)' % (os.path.relpath(filename, PACKAGE), line,
+          function)
+  return '?'
+
+def _before_execute(conn, cursor, statement, parameters, context,
+    executemany):
+
+  if _profiler is None: return
+  conn.info.setdefault('instrument_start', []).append(time.time())
+
+def _after_execute(conn, cursor, statement, parameters, context,
+    executemany):
+
+  starts = conn.info.get('instrument_start')
+  if _profiler is None or not starts: return
+  elapsed = time.time() - starts.pop()
+  _profiler.record('sql', (' '.join(statement.split()), call_site()), elapsed)
+
+def attach(engine):
+  """Makes the engine report its statements, when recording is enabled
+
+  Attaching twice has no effect.
+  """
+
+  from sqlalchemy import event
+  if event.contains(engine, 'before_cursor_execute', _before_execute): return
+  event.listen(engine, 'before_cursor_execute', _before_execute)
+  event.listen(engine, 'after_cursor_execute', _after_execute)
+
+def count_statements(func, *args, **kwargs):
+  """Calls ``func`` and returns its output and the number of SQL statements
+  it ran, on any engine, whether recording is enabled or not"""
+
+  from sqlalchemy import event
+  from sqlalchemy.engine import Engine
+  statements = []
+  def before_execute(conn, cursor, statement, *args):
+    statements.append(statement)
+  event.listen(Engine, 'before_cursor_execute', before_execute)
+  try:
+    retval = func(*args, **kwargs)
+  finally:
+    event.remove(Engine, 'before_cursor_execute', before_execute)
+  return retval, len(statements)
+
+def _shorten(text, width):
+
+  return text if len(text) <= width else text[:width-3] + '...'
+
+def summary(limit=10):
+  """Returns lines summarizing what was recorded, with the hottest entries"""
+
+  if _profiler is None: return []
+
+  retval = ['Profile after %.3f seconds:' % (time.time() - _profiler.start)]
+
+  count, seconds = _profiler.totals('sql')
+  retval.append('  %d SQL statement(s) in %.3f seconds' % (count, seconds))
+  for (statement, site), count, seconds in _profiler.hottest('sql', limit):
+    retval.append('    %5d %9.3f ms  %s' % (count, 1000*seconds, site))
+    retval.append('                        %s' % _shorten(statement, 56))
+
+  names = {
+      'subprocess': 'process(es) spawned',
+      'smtp': 'SMTP operation(s)',
+      'daemon': 'request(s) to the daemon',
+      }
+  for kind in ('subprocess', 'smtp', 'daemon'):
+    count, seconds = _profiler.totals(kind)
+    if not count: continue
+    retval.append('  %d %s in %.3f seconds' % (count, names[kind], seconds))
+    for label, count, seconds in _profiler.hottest(kind, limit):
+      retval.append('    %5d %9.3f ms  %s' % (count, 1000*seconds,
+        _shorten(label, 48)))
+
+  return retval
+
+def report(stream=None):
+  """Writes the :py:func:`summary` to a stream (by default, ``stderr``)"""
+
+  stream = stream or sys.stderr
+  for k in summary(): stream.write(k + '\n')
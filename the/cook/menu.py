@@ -7,22 +7,116 @@
 
 import os
 import six
-import getpass
+import pwd
 import datetime
 import logging
-from .models import User, Lunch, Subscription, format_date, format_datetime
+from sqlalchemy import func, select, and_, delete
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import joinedload, selectinload
+from .models import User, Lunch, Subscription, format_date, format_datetime, \
+    retry_when_locked
+from .directory import Directory, get_directory
+from .utils import name_and_email
+
+def _listing_profile(entity):
+  """Lunches come with their subscriptions and subscribers, subscriptions
+  with their lunch and user"""
+
+  if entity is Lunch:
+    return [selectinload(Lunch.subscriptions).joinedload(Subscription.user)]
+  return [joinedload(Subscription.lunch), joinedload(Subscription.user)]
+
+PROFILES = {
+    'listing': _listing_profile,
+    }
+
+def with_profile(query, entity, profile):
+  """Applies a named loading profile to a query on the given entity
+
+  Profiles let callers that walk relationships (e.g. ``lunch.subscriptions``
+  and then ``subscription.user``) materialise everything in a fixed number of
+  queries, instead of one lazy load per row. Available profiles are listed in
+  :py:data:`PROFILES`. If ``profile`` is ``None``, the query is returned
+  unchanged and relationships are lazily loaded.
+  """
+
+  if profile is None: return query
+
+  if profile not in PROFILES:
+    raise ValueError("Unknown loading profile `%s' - use one of %s" % \
+        (profile, ', '.join(sorted(PROFILES))))
+
+  return query.options(*PROFILES[profile](entity))
+
+# how long stored user information (full name, phone) is considered valid
+REFRESH_PERIOD = datetime.timedelta(days=7)
+
+def current_user(session, username=None):
+  """Returns the current user, inserting it if needed
+
+  Unlike :py:func:`get_current_user`, nothing is committed, so this can be
+  used within a larger transaction. The user is inserted with ``INSERT ... ON
+  CONFLICT DO NOTHING``, so concurrent insertions of the same user are safe.
+  Returns a tuple with the user and a flag telling if anything was changed.
+
+  If ``username`` is given, that user is returned instead of the one running
+  this process. Raises :py:exc:`ValueError` if the user is not stored and does
+  not exist on the system directory.
+
+  Stored users are returned as they are, even if their information is stale:
+  it is refreshed in the background, by :py:func:`refresh_users` (``manage
+  refresh`` or the ``refresh`` job of the scheduler).
+  """
+
+  if username is None: #the real user, not what the environment says
+    uid = os.getuid()
+    retval = session.query(User).get(uid)
+    if retval is None: username = pwd.getpwuid(uid).pw_name
+  else: #only look up the directory for users not stored yet
+    retval = session.query(User).filter(User.name == username).first()
+    if retval is None:
+      uid = get_directory().uid(username)
+      if uid is None:
+        raise ValueError("Cannot find user `%s' on the system directory" % \
+            username)
+      retval = session.query(User).get(uid)
+
+  if retval is None:
+    user = User(uid, username) #resolves user information
+    values = dict((k.name, getattr(user, k.name)) for k in User.__table__.c)
+    session.execute(insert(User.__table__).values(**values).on_conflict_do_nothing())
+    logging.info("Added `%s'" % user)
+    return session.query(User).get(user.id), True
+
+  return retval, False
+
+def get_current_user(session, username=None):
+
+  retval, changed = current_user(session, username)
+  if changed: session.commit()
+  return retval
+
+def refresh_users(session, force=False):
+  """Refreshes stored information of all users with stale entries
 
-def get_current_user(session):
+  If ``force`` is set, refreshes all users, bypassing any cached directory
+  information. Returns the refreshed users.
+  """
 
-  retval = session.query(User).filter(User.id==os.getuid()).first()
-  if retval: return retval
+  users = session.query(User).order_by(User.name).all()
+  if not force:
+    users = [k for k in users if k.is_stale(REFRESH_PERIOD)]
+    directory = get_directory()
+  else:
+    directory = Directory()
 
-  #otherwise, create it
-  user = User(os.getuid(), getpass.getuser())
-  session.add(user)
+  directory.resolve([k.name for k in users]) #all at once
+  for user in users:
+    user.refresh(directory)
+    logging.info("Refreshed `%s'" % user)
   session.commit()
-  logging.info("Added `%s'" % user)
-  return user
+
+  return users
 
 def add(session, date, menu_french, menu_english):
   """Adds a new lunch menu into the system"""
@@ -40,6 +134,44 @@ def add(session, date, menu_french, menu_english):
   session.commit()
   return lunch
 
+def add_many(session, menus, dry_run=False):
+  """Adds many lunch menus in a single transaction
+
+  ``menus`` is a list of ``(where, date, menu_french, menu_english)`` tuples,
+  such as returned by :py:func:`.importer.read`. Menus for dates that already
+  have a lunch (or appear earlier in the list) are not added.
+
+  Returns the list of added menus and the list of conflicts, as
+  ``(where, date, reason)`` tuples. Nothing is written if ``dry_run`` is set.
+  """
+
+  dates = sorted(set(k[1] for k in menus))
+  existing = {}
+  for k in range(0, len(dates), 500): #bound the number of SQL parameters
+    existing.update(session.query(Lunch.date, Lunch.menu_french).filter( \
+        Lunch.date.in_(dates[k:k+500])))
+
+  added, conflicts, seen = [], [], {}
+  for where, date, french, english in menus:
+    if date in existing:
+      conflicts.append((where, date, "there is already a lunch `%s'" % \
+          existing[date]))
+    elif date in seen:
+      conflicts.append((where, date, "also given at %s" % seen[date]))
+    else:
+      seen[date] = where
+      added.append((where, date, french, english))
+
+  if added and not dry_run:
+    user = get_current_user(session)
+    session.execute(Lunch.__table__.insert(), [{'date': date,
+      'menu_french': french, 'menu_english': english, 'user_id': user.id} \
+          for where, date, french, english in added])
+    session.commit()
+    logging.info("Added %d lunch(es)" % len(added))
+
+  return added, conflicts
+
 def remove(session, date, force=False):
   """Removes the lunch menu from the system"""
 
@@ -63,25 +195,28 @@ def remove(session, date, force=False):
 
   return lunch
 
-def next_lunch(session):
+def next_lunch(session, profile=None):
   """Get next possible lunch.
 
-  Returns a lunch object or None, if no applicable lunch was found.
+  Returns a lunch object or None, if no applicable lunch was found. The lunch
+  is loaded according to the given loading ``profile`` (see
+  :py:func:`with_profile`).
   """
 
   today = datetime.date.today()
-  query = session.query(Lunch).filter(Lunch.date>=today).order_by(Lunch.date)
   now = datetime.datetime.now()
   cutoff = datetime.datetime(today.year, today.month, today.day, 14)
 
-  if query.count() == 0: return None
+  # the next two lunches are enough to decide, in a single query
+  query = session.query(Lunch).filter(Lunch.date>=today).order_by(Lunch.date)
+  candidates = with_profile(query, Lunch, profile).limit(2).all()
 
-  retval = query.first()
-  if retval.date == today and now > cutoff:
-    if query.count() > 1: retval = query[1]
-    else: return None
+  if not candidates: return None
 
-  return retval
+  if candidates[0].date == today and now > cutoff:
+    return candidates[1] if len(candidates) > 1 else None
+
+  return candidates[0]
 
 def next_subscribeable_lunch(session):
   """Get next possible lunch.
@@ -90,22 +225,22 @@ def next_subscribeable_lunch(session):
   """
 
   today = datetime.date.today()
-
-  query = session.query(Lunch).filter(Lunch.date>=today).order_by(Lunch.date)
-
-  if query.count() == 0: return None
-
   tomorrow = datetime.date.today() + datetime.timedelta(days=1)
   now = datetime.datetime.now()
   today_at_18 = datetime.datetime(today.year, today.month, today.day, 18, 5)
 
+  # the next two lunches are enough to decide, in a single query
+  candidates = session.query(Lunch).filter(Lunch.date>=today).order_by(Lunch.date).limit(2).all()
+
+  if not candidates: return None
+
   # special condition: there is a lunch tomorrow, but you cannot subscribe to
   # it any longer because it is more than 18h00 (the list has been sent to the
   # hotel already).
-  retval = query.first()
+  retval = candidates[0]
   if retval.date == today or (retval.date == tomorrow and now > today_at_18):
-    if query.count() > 1: return query[1] #returns the next possible lunch
-    else: return None
+    #returns the next possible lunch
+    return candidates[1] if len(candidates) > 1 else None
 
   return retval
 
@@ -115,109 +250,263 @@ def lunch_at_date(session, date):
   if isinstance(date, six.string_types) and date == 'next':
     return next_subscribeable_lunch(session)
 
-  retval = session.query(Lunch).filter(Lunch.date==date)
-
-  if retval.count() == 0: return None
-  return retval.first()
+  return session.query(Lunch).filter(Lunch.date==date).first()
 
-def lunches_in_range(session, start, end):
+def lunches_in_range(session, start, end, profile=None):
   """Returns all available lunches in the (start, end) range of dates"""
 
-  return session.query(Lunch).filter(Lunch.date >= start, Lunch.date <= end).order_by(Lunch.date)
+  query = session.query(Lunch).filter(Lunch.date >= start, Lunch.date <= end).order_by(Lunch.date)
+  return with_profile(query, Lunch, profile)
+
+def subscriber_totals(session, start, end):
+  """Returns the total number of persons subscribed to each lunch in the
+  (start, end) range of dates.
+
+  The query yields ``(lunch_id, total)`` tuples and is computed with a single
+  ``GROUP BY``, so it can be used to avoid calling
+  :py:meth:`Lunch.total_subscribers` for every lunch.
+  """
 
-def subscriptions_in_range(session, username, start, end):
+  return session.query(
+      Subscription.lunch_id.label('lunch_id'),
+      func.sum(Subscription.persons).label('total'),
+      ).join(Lunch).filter(Lunch.date >= start, Lunch.date <= end).group_by(Subscription.lunch_id)
+
+def lunches_with_totals(session, start, end, profile=None):
+  """Returns all available lunches in the (start, end) range of dates, each
+  paired with its total number of subscribers"""
+
+  totals = subscriber_totals(session, start, end).subquery()
+  query = session.query(Lunch, func.coalesce(totals.c.total, 0)).outerjoin(totals, totals.c.lunch_id == Lunch.id).filter(Lunch.date >= start, Lunch.date <= end).order_by(Lunch.date)
+  return with_profile(query, Lunch, profile)
+
+def subscriptions_in_range(session, username, start, end, profile=None):
   """Returns all available subscriptions in the (start, end) range of dates"""
 
-  return session.query(Subscription).join(Lunch).join((User, User.id == Subscription.user_id)).filter(Lunch.date >= start, Lunch.date <= end, User.name == username).distinct(Subscription.date).order_by(Subscription.date)
+  query = session.query(Subscription).join(Lunch).join((User, User.id == Subscription.user_id)).filter(Lunch.date >= start, Lunch.date <= end, User.name == username).distinct().order_by(Subscription.date)
+  return with_profile(query, Subscription, profile)
 
-def unsubscribe(session, date):
-  """Unsubscribes the person from the lunch"""
+@retry_when_locked()
+def unsubscribe(session, date, username=None):
+  """Unsubscribes the person from the lunch
+
+  If ``username`` is given, that user is unsubscribed instead of the one
+  running this process. The subscription is removed with a single
+  ``DELETE``, so of concurrent unsubscriptions of the same user, only one
+  succeeds. Returns the removed subscription or ``None``.
+  """
 
-  user = get_current_user(session)
   lunch = lunch_at_date(session, date)
 
   if lunch is None:
     logging.error("Cannot find lunch with open unsubscription for the input date (%s)" % format_date(date))
     return None
 
-  #special case, if the date:
-
-  subscribed = session.query(Subscription).filter(
-      Subscription.lunch_id == lunch.id,
-      Subscription.user_id == user.id
-      ).first()
-  if subscribed is None:
-    logging.error("User `%s' is not subscribed for lunch at `%s'" % (user.name, format_date(lunch.date)))
+  query = session.query(Subscription).options(joinedload(Subscription.user),
+      joinedload(Subscription.lunch)).filter(Subscription.lunch_id == lunch.id)
+  if username is None:
+    query = query.filter(Subscription.user_id == os.getuid())
   else:
-    session.delete(subscribed)
-    logging.info("Deleted `%s'..." % subscribed)
+    query = query.join(User).filter(User.name == username)
+
+  subscribed = query.first()
+  deleted = 0
+  if subscribed is not None:
+    table = Subscription.__table__
+    deleted = session.execute(delete(table).where(
+      table.c.lunch_id == subscribed.lunch_id,
+      table.c.user_id == subscribed.user_id)).rowcount
+
+  if not deleted:
     session.commit()
+    logging.error("User `%s' is not subscribed for lunch at `%s'" % (username or pwd.getpwuid(os.getuid()).pw_name, format_date(lunch.date)))
+    return None
+
+  session.expunge(subscribed) #its row is gone, keep what was loaded
+  session.commit()
+  logging.info("Deleted `%s'..." % subscribed)
 
   return subscribed
 
-def subscribe(session, date, persons):
-  """Subscribes a new user into the database, for a given lunch"""
+@retry_when_locked()
+def subscribe(session, date, persons, username=None):
+  """Subscribes a new user into the database, for a given lunch
+
+  The lunch is resolved, the user inserted (if needed) and the subscription
+  inserted in a single transaction. Existing subscriptions are left untouched
+  (``INSERT ... ON CONFLICT DO NOTHING``), so concurrent subscriptions of the
+  same user are safe. If ``username`` is given, that user is subscribed
+  instead of the one running this process (see :py:func:`current_user`).
+  """
 
-  user = get_current_user(session)
   lunch = lunch_at_date(session, date)
 
   if lunch is None:
     logging.error("Cannot find lunch with open subscription for the input date (%s)" % format_date(date))
     return None
 
-  subscribed = session.query(Subscription).filter(
+  user, changed = current_user(session, username)
+
+  inserted = session.execute(insert(Subscription.__table__).values(
+    lunch_id=lunch.id,
+    user_id=user.id,
+    persons=persons,
+    date=datetime.datetime.now(),
+    ).on_conflict_do_nothing(index_elements=['lunch_id', 'user_id'])).rowcount
+
+  subscription = session.query(Subscription).filter(
       Subscription.lunch_id == lunch.id,
       Subscription.user_id == user.id
-      ).first()
-  if subscribed is None:
-    subscription = Subscription(lunch, user, persons)
-    session.add(subscription)
+      ).one()
+
+  if inserted:
     logging.info("Added `%s'" % subscription)
-    session.commit()
-    return subscription
   else:
     logging.warn("User `%s' is already subscribed for lunch at %s" %
         (user.name, format_date(lunch.date)))
-    return subscribed
 
-def lunch_list(session, start, end, long_desc):
-  """List all existing entries in the system, matching a range"""
+  # even if nothing was inserted, the INSERT started a write transaction
+  session.commit()
+
+  return subscription
 
-  lunches = lunches_in_range(session, start, end)
+BATCH = 500 #rows loaded at once when streaming listings
 
-  if not lunches:
+def iter_lunch_list(session, start, end, long_desc, batch=BATCH):
+  """Yields the lines of :py:func:`lunch_list` as lunches are read
+
+  Lunches (and their subscriptions, in long mode) are loaded ``batch`` at a
+  time, so the first lines come right away and memory use does not depend on
+  the size of the range.
+  """
+
+  lunches = lunches_with_totals(session, start, end,
+      'listing' if long_desc else None).yield_per(batch)
+
+  found = False
+  for l, total in lunches:
+    found = True
+    line = "[%s] %s, %d subscriber(s)" % \
+        (format_date(l.date), l.menu_english, total)
+    if not long_desc:
+      yield line
+      continue
+    if len(l.subscriptions): line += ":"
+    yield line
+    for s in l.subscriptions:
+      yield "  - %s: %d person(s), subscribed `%s'" % \
+          (s.user.name_and_email(), s.persons, format_datetime(s.date))
+
+  if not found:
     logging.error("Cannot find lunches in range `%s' until `%s'",
         format_date(start), format_date(end))
-    return
+
+def lunch_list(session, start, end, long_desc):
+  """List all existing entries in the system, matching a range"""
+
+  return list(iter_lunch_list(session, start, end, long_desc))
+
+def iter_user_list(session, username, start, end, long_desc, batch=BATCH):
+  """Yields the lines of :py:func:`user_list` as subscriptions are read
+
+  Subscriptions are loaded ``batch`` at a time, each with the total number
+  of subscribers to its lunch, so memory use does not depend on the size of
+  the range.
+  """
+
+  totals = subscriber_totals(session, start, end).subquery()
+  query = session.query(Subscription, func.coalesce(totals.c.total, 0)).join(Lunch, Lunch.id == Subscription.lunch_id).join(User, User.id == Subscription.user_id).outerjoin(totals, totals.c.lunch_id == Subscription.lunch_id).filter(Lunch.date >= start, Lunch.date <= end, User.name == username).order_by(Subscription.date)
+  subscriptions = with_profile(query, Subscription, 'listing').yield_per(batch)
+
+  yield "User `%s' subscribed to the following lunches:" % username
+
+  found = False
+  for s, total in subscriptions:
+    found = True
+    l = s.lunch
+    if long_desc:
+      yield "  - [%s] %s, %d total subscriber(s)" % \
+          (format_date(l.date), l.menu_english, total)
+    else:
+      yield "  - %s, %d subscriber(s)" % (format_date(l.date), total)
+
+  if not found:
+    logging.error("Cannot find subscribed lunches for user `%s' in range `%s' until `%s'", username, format_date(start), format_date(end))
+
+def user_list(session, username, start, end, long_desc):
+  """List all existing entries in the system for a given user, matching a range"""
+
+  return list(iter_user_list(session, username, start, end, long_desc))
+
+def lunch_list_readonly(connection, start, end, long_desc):
+  """List all existing entries in the system, matching a range
+
+  Same as :py:func:`lunch_list`, but selects plain rows with SQLAlchemy Core
+  on the given connection (e.g. from :py:func:`.models.connect_readonly`),
+  without instantiating any objects. Issues two queries at most.
+  """
+
+  lunch = Lunch.__table__
+  subscription = Subscription.__table__
+  user = User.__table__
+
+  in_range = and_(lunch.c.date >= start, lunch.c.date <= end)
+
+  lunches = connection.execute(select(
+    lunch.c.id, lunch.c.date, lunch.c.menu_english,
+    func.coalesce(func.sum(subscription.c.persons), 0),
+    ).select_from(lunch.outerjoin(subscription)).where(in_range).group_by(lunch.c.id).order_by(lunch.c.date)).fetchall()
+
+  subscribers = {}
+  if long_desc:
+    for row in connection.execute(select(
+      subscription.c.lunch_id, user.c.name, user.c.fullname, user.c.email,
+      subscription.c.persons, subscription.c.date,
+      ).select_from(subscription.join(lunch).join(user)).where(in_range).order_by(subscription.c.id)):
+      subscribers.setdefault(row[0], []).append(row[1:])
 
   retval = []
-  for l in lunches:
+  for id, date, menu_english, total in lunches:
     retval.append("[%s] %s, %d subscriber(s)" % \
-        (format_date(l.date), l.menu_english, l.total_subscribers()))
+        (format_date(date), menu_english, total))
     if long_desc:
-      if len(l.subscriptions): retval[-1] += ":"
-      for s in l.subscriptions:
+      if id in subscribers: retval[-1] += ":"
+      for name, fullname, email, persons, subscribed in subscribers.get(id, []):
         retval.append("  - %s: %d person(s), subscribed `%s'" % \
-            (s.user.name_and_email(), s.persons, format_datetime(s.date)))
+            (name_and_email(name, fullname, email), persons,
+              format_datetime(subscribed)))
 
   return retval
 
-def user_list(session, username, start, end, long_desc):
-  """List all existing entries in the system for a given user, matching a range"""
+def user_list_readonly(connection, username, start, end, long_desc):
+  """List all existing entries in the system for a given user, matching a range
 
-  subscriptions = subscriptions_in_range(session, username, start, end)
+  Same as :py:func:`user_list`, but selects plain rows with SQLAlchemy Core
+  on the given connection (e.g. from :py:func:`.models.connect_readonly`),
+  without instantiating any objects. Issues a single query.
+  """
 
-  if not subscriptions:
-    logging.error("Cannot find subscribed lunches for user `%s' in range `%s' until `%s'", username, format_date(start), format_date(end))
-    return
+  lunch = Lunch.__table__
+  subscription = Subscription.__table__
+  user = User.__table__
+
+  in_range = and_(lunch.c.date >= start, lunch.c.date <= end)
+
+  totals = select(
+      subscription.c.lunch_id,
+      func.sum(subscription.c.persons).label('total'),
+      ).select_from(subscription.join(lunch)).where(in_range).group_by(subscription.c.lunch_id).subquery()
+
+  rows = connection.execute(select(
+    lunch.c.date, lunch.c.menu_english, totals.c.total,
+    ).select_from(subscription.join(lunch).join(user).join(totals, totals.c.lunch_id == lunch.c.id)).where(in_range, user.c.name == username).order_by(subscription.c.date))
 
   retval = ["User `%s' subscribed to the following lunches:" % username]
-  for s in subscriptions:
-    l = s.lunch
+  for date, menu_english, total in rows:
     if long_desc:
       retval.append("  - [%s] %s, %d total subscriber(s)" % \
-          (format_date(l.date), l.menu_english, l.total_subscribers()))
+          (format_date(date), menu_english, total))
     else:
-      retval.append("  - %s, %d subscriber(s)" % (format_date(l.date), l.total_subscribers()))
+      retval.append("  - %s, %d subscriber(s)" % (format_date(date), total))
 
   return retval
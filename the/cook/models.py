@@ -6,32 +6,25 @@
 """Models for database handling"""
 
 import os
+import time
+import random
 import logging
-import subprocess
 import datetime
-import six
+import functools
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text, event
+from sqlalchemy.exc import OperationalError
 from sqlalchemy import Table, Column, Integer, String, ForeignKey, Date, DateTime
+from sqlalchemy import Index, Text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, backref, sessionmaker
 
-Base = declarative_base()
-
-def backquote(cmd):
-  """Runs `cmd` and returns the answer"""
-
-  return subprocess.Popen(cmd, stdout=subprocess.PIPE).communicate()[0]
+from .directory import get_directory
+from .instrument import attach as instrument
+from .utils import format_date, format_datetime, as_unicode, as_str, \
+    name_and_email
 
-def format_date(date):
-  """Standard date formatting"""
-  if isinstance(date, six.string_types): return date
-  return date.strftime("%A, %d/%m/%Y")
-
-def format_datetime(date):
-  """Standard date formatting"""
-  if isinstance(date, six.string_types): return date
-  return date.strftime("%A, %d/%m/%Y at %H:%M")
+Base = declarative_base()
 
 class User(Base):
   """A class that represents a unique user at Idiap"""
@@ -41,55 +34,46 @@ class User(Base):
   id = Column(Integer, primary_key=True)
   name = Column(String(16), unique=True)
 
-  def __init__(self, id, name):
-    """Constructor, simple"""
+  fullname = Column(String(128))
 
-    self.id = int(backquote(['id', '-u', name]))
-    self.name = name
+  phone = Column(String(32))
 
-  def phone(self):
+  email = Column(String(128))
 
-    try:
-      tel = '/idiap/resource/software/scripts/tel'
-      data = backquote([tel, self.name]).split('\n')[1]
-    except OSError as e:
-      logging.error(e)
-      return '+41277217XXX'
+  refreshed = Column(DateTime)
+
+  def __init__(self, id, name):
+    """Constructor, simple"""
 
-    if data:
-      return '+41277217' + data.split()[-1].strip()
-    else:
-      return '+41277217XXX'
+    uid = get_directory().uid(name)
+    self.id = uid if uid is not None else int(id)
+    self.name = name
+    self.refresh()
 
-  def email(self):
+  def refresh(self, directory=None):
+    """Updates the stored full name, phone and e-mail from the directory"""
 
-    return self.name + '@idiap.ch'
+    entry = (directory or get_directory()).lookup(self.name)
+    self.fullname = as_unicode(entry['fullname'])
+    self.phone = entry['phone']
+    self.email = self.name + '@idiap.ch'
+    self.refreshed = datetime.datetime.now()
 
-  def fullname(self):
+  def is_stale(self, max_age):
+    """Tells if the stored information is older than ``max_age``, a
+    :py:class:`datetime.timedelta`"""
 
-    try:
-      data = backquote(['getent', 'passwd', self.name]).split(b':')[4]
-    except OSError as e:
-      logging.error(e)
-      return six.u('Joe Doe')
-    return as_unicode(data)
+    if self.refreshed is None: return True
+    return datetime.datetime.now() - self.refreshed > max_age
 
   def name_and_email(self):
 
-    return '%s <%s>' % (self.fullname(), self.email())
+    return name_and_email(self.name, self.fullname, self.email)
 
   def __repr__(self):
 
     return 'User("%s", %d)' % (self.name, self.id)
 
-def as_unicode(s):
-  if not six.PY3 and isinstance(s, str): return s.decode('utf-8')
-  return s
-
-def as_str(s):
-  if not six.PY3 and not isinstance(s, str): return s.encode('utf-8')
-  return s
-
 class Lunch(Base):
   """A particular lunch with a menu and subscribers"""
 
@@ -127,6 +111,11 @@ class Subscription(Base):
   """A subscription to a particular lunch"""
 
   __tablename__ = 'subscription'
+  __table_args__ = (
+      Index('ix_subscription_lunch_user', 'lunch_id', 'user_id', unique=True),
+      Index('ix_subscription_user', 'user_id'),
+      Index('ix_subscription_date', 'date'),
+      )
 
   id = Column(Integer, primary_key=True)
 
@@ -155,23 +144,350 @@ class Subscription(Base):
     return as_str('Subscription(%s, %s, %d, %s)' % \
         (ulunch, self.user, self.persons, self.date))
 
-def create(dbfile, recreate=False):
-  """Creates or re-creates this database"""
+class Message(Base):
+  """An e-mail in the outbox, waiting to be sent by the worker
+
+  Messages start ``pending`` and become ``sent`` once delivered. Workers
+  claim messages (``sending``) before sending them, for a limited time.
+  Messages that could not be delivered after a number of attempts become
+  ``dead`` and are kept for inspection.
+  """
+
+  __tablename__ = 'message'
+  __table_args__ = (
+      Index('ix_message_status_due', 'status', 'due'),
+      )
+
+  PENDING = 'pending'
+  SENDING = 'sending'
+  SENT = 'sent'
+  DEAD = 'dead'
+
+  id = Column(Integer, primary_key=True)
+
+  created = Column(DateTime)
+
+  sender = Column(String(256))
+
+  recipients = Column(Text) #one per line
+
+  subject = Column(String(256))
+
+  body = Column(Text) #the complete, rendered, message
+
+  status = Column(String(16))
+
+  attempts = Column(Integer)
+
+  due = Column(DateTime) #when to attempt sending next
+
+  sent = Column(DateTime)
+
+  error = Column(Text)
+
+  def __init__(self, sender, recipients, subject, body):
+
+    self.created = datetime.datetime.now()
+    self.sender = as_unicode(sender)
+    self.recipients = as_unicode('\n'.join(recipients))
+    self.subject = as_unicode(subject)
+    self.body = as_unicode(body)
+    self.status = Message.PENDING
+    self.attempts = 0
+    self.due = self.created
+
+  def recipient_list(self):
+
+    return [k for k in self.recipients.split('\n') if k]
+
+  def __repr__(self):
+
+    return as_str('Message(%d, "%s", %s, %d attempt(s))' % \
+        (self.id or 0, self.subject, self.status, self.attempts))
+
+class JobRun(Base):
+  """A run of a job by the scheduler (see :py:mod:`.scheduler`)
+
+  Each job runs at most once per scheduled time (its ``slot``): the slot is
+  claimed by inserting a row here, before the job starts.
+  """
+
+  __tablename__ = 'job_run'
+  __table_args__ = (
+      Index('ix_job_run_job_slot', 'job', 'slot', unique=True),
+      )
+
+  RUNNING = 'running'
+  DONE = 'done'
+  FAILED = 'failed'
+
+  id = Column(Integer, primary_key=True)
+
+  job = Column(String(32))
+
+  slot = Column(DateTime) #the time the job was scheduled for
+
+  started = Column(DateTime)
+
+  finished = Column(DateTime)
+
+  status = Column(String(16))
+
+  error = Column(Text)
+
+  def __init__(self, job, slot):
+
+    self.job = job
+    self.slot = slot
+    self.started = datetime.datetime.now()
+    self.status = JobRun.RUNNING
+
+  def duration(self):
+    """Returns how long the job ran, in seconds, or ``None`` if running"""
+
+    if self.finished is None: return None
+    return (self.finished - self.started).total_seconds()
+
+  def __repr__(self):
+
+    return as_str('JobRun(%s, %s, %s)' % (self.job, format_datetime(self.slot),
+      self.status))
+
+def _migrate_to_1(connection):
+  """Stored user information and subscription indexes"""
+
+  columns = [k[1] for k in connection.execute(text('PRAGMA table_info(user)'))]
+  for name, type in (('fullname', 'VARCHAR(128)'), ('phone', 'VARCHAR(32)'),
+      ('email', 'VARCHAR(128)'), ('refreshed', 'DATETIME')):
+    if name not in columns:
+      connection.execute(text('ALTER TABLE user ADD COLUMN %s %s' % \
+          (name, type)))
+
+  # only the oldest of duplicated subscriptions is kept
+  removed = connection.execute(text('DELETE FROM subscription WHERE id NOT IN (SELECT MIN(id) FROM subscription GROUP BY lunch_id, user_id)')).rowcount
+  if removed:
+    logging.warn("Removed %d duplicated subscription(s)" % removed)
+
+  for index in Subscription.__table__.indexes:
+    index.create(connection, checkfirst=True)
+
+def _migrate_to_2(connection):
+  """Outbox for e-mails"""
+
+  Message.__table__.create(connection, checkfirst=True)
+
+def _migrate_to_3(connection):
+  """Record of scheduled job runs"""
+
+  JobRun.__table__.create(connection, checkfirst=True)
+
+# MIGRATIONS[k] upgrades the database schema from version k to k + 1
+MIGRATIONS = [
+    _migrate_to_1,
+    _migrate_to_2,
+    _migrate_to_3,
+    ]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def schema_version(connection):
+  """Returns the schema version of the database, 0 if not versioned"""
+
+  return connection.execute(text('PRAGMA user_version')).scalar()
+
+def upgrade(engine):
+  """Creates missing tables and migrates the database to the latest schema
+
+  The version recorded in the database is checked first, with a single
+  statement: up-to-date databases are left untouched. Otherwise, tables are
+  created and migrations applied in order, starting from the recorded
+  version, in a single transaction together with the new version: a failed
+  migration leaves the database as it was. Returns the version the database
+  was found at.
+  """
+
+  with engine.connect() as connection:
+    version = schema_version(connection)
+  if version == SCHEMA_VERSION: return version
+
+  # pysqlite would run DDL outside of transactions: it is told not to handle
+  # them, and the transaction is started here
+  with engine.connect() as connection:
+    dbapi_connection = connection.connection.dbapi_connection
+    isolation_level = dbapi_connection.isolation_level
+    dbapi_connection.isolation_level = None
+    try:
+      with connection.begin():
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+        version = schema_version(connection) #may have changed meanwhile
+        fresh = not inspect(connection).get_table_names()
+        Base.metadata.create_all(connection)
+        if not fresh:
+          for k in range(version, SCHEMA_VERSION):
+            logging.info("Migrating database schema to version %d (%s)..." % \
+                (k+1, MIGRATIONS[k].__doc__))
+            MIGRATIONS[k](connection)
+        if version < SCHEMA_VERSION:
+          connection.execute(text('PRAGMA user_version = %d' % \
+              SCHEMA_VERSION))
+    finally:
+      dbapi_connection.isolation_level = isolation_level
+
+  return version
+
+# SQLite settings applied to every new connection, see :py:func:`create`
+PRAGMAS = {
+    'journal_mode': 'WAL', #readers do not block writers and vice-versa
+    'busy_timeout': 10000, #milliseconds to wait on a locked database
+    'synchronous': 'NORMAL', #safe with WAL, avoids a sync per commit
+    'mmap_size': 64*1024*1024, #bytes
+    'cache_size': -8192, #negative values are in KiB
+    }
+
+def _set_pragmas(pragmas):
+  """Returns a connection listener that applies the given pragmas"""
+
+  def inner(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+      cursor.execute('PRAGMA %s = %s' % (name, value))
+    cursor.close()
+
+  return inner
+
+# Engines for database files, see :py:func:`create`
+_engines = {}
+
+def _identity(dbfile):
+  """Identifies the database file, so a replaced file is not mistaken"""
+
+  try:
+    stat = os.stat(dbfile)
+    return (stat.st_dev, stat.st_ino)
+  except OSError:
+    return None
+
+def create(dbfile, recreate=False, pragmas=None, pool_size=None):
+  """Creates, upgrades or re-creates this database
+
+  ``pragmas`` is an optional dictionary with SQLite settings that update the
+  defaults in :py:data:`PRAGMAS`. Settings are applied to every connection
+  the returned engine opens.
+
+  If ``pool_size`` is set, the engine keeps up to that many connections open,
+  to be shared by sessions on different threads (e.g. in a server).
+
+  Engines for database files are kept, so calling this again with the same
+  arguments returns the same engine, without checking the schema again.
+  In-memory databases (``dbfile`` is ``None``) are always new.
+  """
+
+  settings = dict(PRAGMAS)
+  if pragmas: settings.update(pragmas)
+
+  key = None
+  if dbfile:
+    key = (os.path.abspath(dbfile), tuple(sorted(settings.items())),
+        pool_size)
+    cached = _engines.pop(key, None)
+    if cached is not None:
+      engine, identity = cached
+      if not recreate and identity == _identity(dbfile):
+        _engines[key] = cached
+        return engine
+      engine.dispose()
 
   if dbfile and recreate and os.path.exists(dbfile):
     logging.info("Erasing old database at `%s'..." % dbfile)
     os.unlink(dbfile)
 
-  if dbfile: engine = create_engine('sqlite:///' + dbfile)
+  if dbfile and pool_size:
+    from sqlalchemy.pool import QueuePool
+    engine = create_engine('sqlite:///' + dbfile, poolclass=QueuePool,
+        pool_size=pool_size, max_overflow=0,
+        connect_args={'check_same_thread': False})
+  elif dbfile: engine = create_engine('sqlite:///' + dbfile)
   else: engine = create_engine('sqlite://', echo=False) #in-memory
-  Base.metadata.create_all(engine)
+
+  event.listen(engine, 'connect', _set_pragmas(settings))
+  instrument(engine)
+
+  upgrade(engine)
+
+  if key is not None: _engines[key] = (engine, _identity(dbfile))
 
   return engine
 
-def connect(dbfile):
+def connect_readonly(dbfile):
+  """Opens the database file in read-only mode, returns the engine
+
+  Connections from this engine never take write locks and cannot change the
+  database. Databases that do not exist yet or have an older schema (see
+  :py:data:`SCHEMA_VERSION`) cannot be read like this: they are created or
+  upgraded instead, and the returned engine is a read-write one, from
+  :py:func:`create`.
+  """
+
+  if not os.path.exists(dbfile): return create(dbfile)
+
+  from six.moves.urllib.parse import quote
+  engine = create_engine('sqlite:///file:%s?mode=ro&uri=true' % \
+      quote(os.path.abspath(dbfile)))
+
+  settings = dict((k, PRAGMAS[k]) for k in \
+      ('busy_timeout', 'mmap_size', 'cache_size'))
+  event.listen(engine, 'connect', _set_pragmas(settings))
+  instrument(engine)
+
+  with engine.connect() as connection:
+    version = schema_version(connection)
+  if version < SCHEMA_VERSION:
+    engine.dispose()
+    logging.info("Database at `%s' has schema version %d, upgrading..." % \
+        (dbfile, version))
+    return create(dbfile)
+
+  return engine
+
+def connect(dbfile, pragmas=None):
   """Creates a new connection to the database and return it"""
 
-  engine = create(dbfile)
+  engine = create(dbfile, pragmas=pragmas)
   Session = sessionmaker()
   Session.configure(bind=engine)
   return Session()
+
+def is_locked(error):
+  """Tells if an exception was caused by a locked (busy) database"""
+
+  message = str(getattr(error, 'orig', error)).lower()
+  return 'database is locked' in message or 'database is busy' in message
+
+def retry_when_locked(retries=5, backoff=0.1):
+  """Decorator that retries database operations failing on a locked database
+
+  The decorated function must take the session as its first argument. Each
+  time the database is found locked, the session is rolled back and the
+  function called again after an exponentially growing (randomized) pause
+  starting at ``backoff`` seconds. After ``retries`` attempts, the error is
+  raised.
+  """
+
+  def decorator(func):
+
+    @functools.wraps(func)
+    def inner(session, *args, **kwargs):
+      for attempt in range(retries+1):
+        try:
+          return func(session, *args, **kwargs)
+        except OperationalError as e:
+          if attempt == retries or not is_locked(e): raise
+          session.rollback()
+          pause = backoff * (2**attempt) * (1 + random.random())
+          logging.warn("Database is locked, retrying `%s' in %.2f seconds" % \
+              (func.__name__, pause))
+          time.sleep(pause)
+
+    return inner
+
+  return decorator
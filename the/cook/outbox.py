@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sun 18 Oct 2026 01:04:27 CEST
+
+"""Outbox for e-mails, drained asynchronously by a worker
+
+Commands that send e-mails may enqueue them with :py:func:`enqueue` instead,
+returning immediately. The worker (:py:func:`run`) sends pending messages
+concurrently, retrying failures with exponential backoff and moving messages
+that cannot be delivered to the ``dead`` state.
+"""
+
+import datetime
+import logging
+
+from .models import Message
+
+def enqueue(session, sender, recipients, subject, body):
+  """Stores a rendered message in the outbox, returns it"""
+
+  message = Message(sender, recipients, subject, body)
+  session.add(message)
+  session.commit()
+  logging.info("Enqueued `%s'" % message)
+  return message
+
+def due(session, limit=None):
+  """Returns pending messages that are due for sending, oldest first
+
+  Messages claimed by a worker that did not finish sending them before its
+  claim expired are due again.
+  """
+
+  query = session.query(Message).filter(
+      Message.status.in_((Message.PENDING, Message.SENDING)),
+      Message.due <= datetime.datetime.now()).order_by(Message.due, Message.id)
+  if limit: query = query.limit(limit)
+  return query.all()
+
+def claim(session, messages, lease=600):
+  """Claims due messages for sending, returns those that were claimed
+
+  Each message is claimed with a single ``UPDATE``, which only succeeds if
+  no other worker claimed it in the meantime. Claims expire after ``lease``
+  seconds, so messages of workers that died are eventually sent.
+  """
+
+  from sqlalchemy import update
+
+  now = datetime.datetime.now()
+  until = now + datetime.timedelta(seconds=lease)
+  table = Message.__table__
+
+  retval = []
+  for message in messages:
+    result = session.execute(update(table).where(table.c.id == message.id,
+      table.c.status.in_((Message.PENDING, Message.SENDING)),
+      table.c.due <= now).values(status=Message.SENDING, due=until))
+    if result.rowcount == 1: retval.append(message)
+  session.commit()
+  return retval
+
+def retry_dead(session):
+  """Moves dead messages back to the pending state, returns them"""
+
+  messages = session.query(Message).filter(Message.status == Message.DEAD).all()
+  for message in messages:
+    message.status = Message.PENDING
+    message.attempts = 0
+    message.due = datetime.datetime.now()
+  session.commit()
+  return messages
+
+def _delivered(message):
+
+  message.status = Message.SENT
+  message.attempts += 1
+  message.sent = datetime.datetime.now()
+  message.error = None
+  logging.info("Sent `%s'" % message)
+
+def _failed(message, error, attempts, backoff):
+
+  message.attempts += 1
+  message.error = '%s: %s' % (type(error).__name__, error)
+  if message.attempts >= attempts:
+    message.status = Message.DEAD
+    logging.error("Giving up on `%s': %s" % (message, message.error))
+  else:
+    message.status = Message.PENDING
+    pause = backoff * 2**(message.attempts-1)
+    message.due = datetime.datetime.now() + datetime.timedelta(seconds=pause)
+    logging.warn("Failed to send `%s' (%s), retrying in %d seconds" % \
+        (message, message.error, pause))
+
+def drain(session, transport, concurrency=4, attempts=5, backoff=60,
+    lease=600):
+  """Sends all due messages, returns the number of delivery attempts
+
+  Messages are claimed (see :py:func:`claim`) before being sent, so many
+  workers may drain the same outbox. Messages are sent concurrently through
+  up to ``concurrency`` SMTP connections, cloned from ``transport`` (see
+  :py:class:`.sendmail.Transport`). Failed messages are retried after
+  ``backoff`` seconds, doubled at every attempt, and become ``dead`` after
+  ``attempts`` failed attempts.
+  """
+
+  import asyncio
+
+  async def main():
+
+    pool = asyncio.Queue()
+    for k in range(concurrency): pool.put_nowait(transport.clone())
+    loop = asyncio.get_event_loop()
+
+    async def send(message):
+      connection = await pool.get()
+      try:
+        await loop.run_in_executor(None, connection.send, message.sender,
+            message.recipient_list(), message.body.encode('utf-8'))
+        _delivered(message)
+      except Exception as e:
+        _failed(message, e, attempts, backoff)
+      finally:
+        pool.put_nowait(connection)
+
+    handled = 0
+    try:
+      while True:
+        messages = due(session, limit=10*concurrency)
+        if not messages: break
+        messages = claim(session, messages, lease)
+        if not messages: continue #others were faster, look again
+        await asyncio.gather(*[send(k) for k in messages])
+        session.commit() #database changes only happen on this thread
+        handled += len(messages)
+    finally:
+      while not pool.empty(): pool.get_nowait().close()
+
+    return handled
+
+  return asyncio.run(main())
+
+def run(session, transport, concurrency=4, attempts=5, backoff=60, once=False,
+    poll=10):
+  """Drains the outbox, then keeps polling for new messages every ``poll``
+  seconds, unless ``once`` is set. See :py:func:`drain` for other parameters.
+  """
+
+  import time
+
+  while True:
+    handled = drain(session, transport, concurrency, attempts, backoff)
+    if handled: logging.info("Made %d delivery attempt(s)" % handled)
+    if once: return handled
+    time.sleep(poll)
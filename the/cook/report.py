@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sun 18 Oct 2026 10:41:55 CEST
+
+"""PDF and CSV reports with the subscribers of a lunch
+
+Reports are rendered from plain data (see :py:func:`collect`), without any
+third-party dependency. Rendered documents are cached by a hash of their
+contents, in memory and, optionally, on disk, so that sending the same report
+again does not render it again.
+"""
+
+import os
+import io
+import csv
+import json
+import hashlib
+import logging
+import six
+
+from .directory import UNKNOWN_PHONE
+from .utils import format_date
+
+PRICE = 10 #CHF, per person
+
+COLUMNS = [
+    (six.u('Nom'), 40, 32),
+    (six.u('Téléphone'), 210, 16),
+    (six.u('E-mail'), 290, 36),
+    (six.u('Pers.'), 465, 5),
+    (six.u('CHF'), 500, 6),
+    (six.u('Payé'), 540, 5),
+    ]
+"""Report columns, as ``(title, horizontal position, maximum width)``"""
+
+def collect(session, lunch):
+  """Returns the data for the report on a lunch, with a single query
+
+  The returned dictionary contains the date and menus of the lunch and a list
+  of subscribers, each a dictionary with keys ``name``, ``fullname``,
+  ``phone``, ``email`` and ``persons``, in subscription order.
+  """
+
+  from sqlalchemy import select
+  from .models import User, Subscription
+
+  subscription = Subscription.__table__
+  user = User.__table__
+
+  rows = session.execute(select(
+    user.c.name, user.c.fullname, user.c.phone, user.c.email,
+    subscription.c.persons,
+    ).select_from(subscription.join(user)).where(subscription.c.lunch_id == lunch.id).order_by(subscription.c.date, subscription.c.id))
+
+  return {
+      'date': lunch.date,
+      'menu_french': lunch.menu_french,
+      'menu_english': lunch.menu_english,
+      'subscribers': [{
+        'name': name,
+        'fullname': fullname or name,
+        'phone': phone or UNKNOWN_PHONE,
+        'email': email or name + '@idiap.ch',
+        'persons': persons,
+        } for name, fullname, phone, email, persons in rows],
+      }
+
+def digest(data):
+  """Returns a hash of the report data, which identifies rendered documents"""
+
+  text = json.dumps(data, sort_keys=True, default=str)
+  return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def total(data):
+  """Returns the total number of persons in the report"""
+
+  return sum(k['persons'] for k in data['subscribers'])
+
+def to_csv(data):
+  """Renders the report as CSV, returns bytes"""
+
+  output = io.StringIO()
+  writer = csv.writer(output)
+  writer.writerow([k[0] for k in COLUMNS])
+  for k in data['subscribers']:
+    writer.writerow([k['fullname'], k['phone'], k['email'], k['persons'],
+      PRICE*k['persons'], ''])
+  writer.writerow(['Total', '', '', total(data), PRICE*total(data), ''])
+  return output.getvalue().encode('utf-8')
+
+def _pdf_string(text):
+  """Encodes text as a PDF literal string, using the WinAnsi encoding"""
+
+  text = six.text_type(text).encode('cp1252', 'replace')
+  for special in (b'\\', b'(', b')'):
+    text = text.replace(special, b'\\' + special)
+  return b'(' + text + b')'
+
+def _truncate(text, width):
+
+  text = six.text_type(text)
+  if len(text) <= width: return text
+  return text[:width-1] + six.u('…')
+
+def pdf(pages, title=''):
+  """Writes a PDF document, returns bytes
+
+  Each page is a list of text items ``(font, size, x, y, text)``, where font
+  is either ``F1`` (Helvetica) or ``F2`` (Helvetica Bold) and coordinates are
+  in points from the bottom left corner of an A4 page.
+  """
+
+  objects = []
+
+  def add(body):
+    objects.append(body)
+    return len(objects)
+
+  regular = add(b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica '
+      b'/Encoding /WinAnsiEncoding >>')
+  bold = add(b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold '
+      b'/Encoding /WinAnsiEncoding >>')
+  parent = add(None) #filled in once all pages are known
+
+  kids = []
+  for items in pages:
+    stream = b''.join([b'BT /%s %d Tf %d %d Td %s Tj ET\n' % \
+        (font.encode('ascii'), size, x, y, _pdf_string(text)) \
+        for font, size, x, y, text in items])
+    contents = add(b'<< /Length %d >>\nstream\n' % len(stream) + stream + \
+        b'endstream')
+    kids.append(add(b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] '
+      b'/Contents %d 0 R /Resources << /Font << /F1 %d 0 R /F2 %d 0 R >> >> '
+      b'>>' % (parent, contents, regular, bold)))
+
+  objects[parent-1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % \
+      (b' '.join([b'%d 0 R' % k for k in kids]), len(kids))
+  catalog = add(b'<< /Type /Catalog /Pages %d 0 R >>' % parent)
+  info = add(b'<< /Title %s /Producer (the.cook) >>' % _pdf_string(title))
+
+  output = [b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n']
+  offsets = []
+  position = len(output[0])
+  for number, body in enumerate(objects, 1):
+    offsets.append(position)
+    output.append(b'%d 0 obj\n' % number + body + b'\nendobj\n')
+    position += len(output[-1])
+
+  output.append(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects)+1))
+  output += [b'%010d 00000 n \n' % k for k in offsets]
+  output.append(b'trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\n' \
+      b'startxref\n%d\n%%%%EOF\n' % (len(objects)+1, catalog, info, position))
+
+  return b''.join(output)
+
+def to_pdf(data):
+  """Renders the report as a PDF table, returns bytes"""
+
+  title = six.u('Repas Idiap du %s') % format_date(data['date'], 'fr')
+  top, bottom, step = 790, 50, 14
+
+  pages = [[
+    ('F2', 16, 40, top, title),
+    ('F1', 11, 40, top - 2*step, six.u('Menu: %s') % data['menu_french']),
+    ('F1', 11, 40, top - 3*step, six.u('%d personne(s) inscrite(s)') % \
+        total(data)),
+    ]]
+  y = top - 5*step
+
+  def header(y):
+    return [('F2', 9, x, y, name) for name, x, width in COLUMNS]
+
+  rows = [[k['fullname'], k['phone'], k['email'], k['persons'],
+    '%d.-' % (PRICE*k['persons']), '[ ]'] for k in data['subscribers']]
+  rows.append(['Total', '', '', total(data), '%d.-' % (PRICE*total(data)),
+    ''])
+
+  pages[-1] += header(y)
+  for row in rows:
+    y -= step
+    if y < bottom:
+      y = top
+      pages.append(header(y))
+      y -= step
+    pages[-1] += [('F1', 9, x, y, _truncate(value, width)) \
+        for value, (name, x, width) in zip(row, COLUMNS) if value != '']
+
+  return pdf(pages, title)
+
+RENDERERS = {
+    'pdf': to_pdf,
+    'csv': to_csv,
+    }
+
+class Cache(object):
+  """Keeps rendered reports, indexed by the hash of their data
+
+  Documents are kept in memory for the lifetime of this object. If a
+  ``cachedir`` is given, documents are also stored there and re-used by other
+  processes.
+  """
+
+  def __init__(self, cachedir=None):
+
+    self.cachedir = cachedir
+    self.documents = {}
+    self.rendered = 0
+
+  def path(self, key, kind):
+
+    return os.path.join(self.cachedir, '%s.%s' % (key, kind))
+
+  def get(self, data, kind):
+    """Returns the report in the given format (``pdf`` or ``csv``)"""
+
+    key = (digest(data), kind)
+
+    if key not in self.documents and self.cachedir:
+      try:
+        with open(self.path(*key), 'rb') as f: self.documents[key] = f.read()
+      except IOError:
+        pass
+
+    if key not in self.documents:
+      document = RENDERERS[kind](data)
+      self.rendered += 1
+      self.documents[key] = document
+      if self.cachedir:
+        tmpfile = '%s.%d' % (self.path(*key), os.getpid())
+        try:
+          if not os.path.exists(self.cachedir): os.makedirs(self.cachedir)
+          with open(tmpfile, 'wb') as f: f.write(document)
+          os.rename(tmpfile, self.path(*key))
+        except (IOError, OSError) as e:
+          logging.warn("Cannot save report at `%s': %s" % (self.path(*key), e))
+
+    return self.documents[key]
+
+  def attachments(self, data):
+    """Returns the PDF and CSV reports as e-mail attachments, i.e. tuples
+    ``(filename, mime type, contents)``"""
+
+    basename = 'repas-%s' % data['date'].strftime('%Y-%m-%d')
+    return [
+        (basename + '.pdf', 'application/pdf', self.get(data, 'pdf')),
+        (basename + '.csv', 'text/csv', self.get(data, 'csv')),
+        ]
+
+_cache = None
+
+def configure(cachedir=None):
+  """Sets up the cache used for rendered reports"""
+
+  global _cache
+  _cache = Cache(cachedir)
+  return _cache
+
+def get_cache(dbfile=None):
+  """Returns the cache used for rendered reports
+
+  Unless :py:func:`configure` is called, reports are stored in the directory
+  the environment variable ``THECOOK_REPORT_CACHE`` points to or, if it is not
+  set, in a directory next to the database file ``dbfile`` (named like it,
+  with ``.reports`` appended). This way, separate runs of ``manage report``
+  re-use unchanged reports. Without either, reports are kept in memory only.
+  """
+
+  if _cache is None:
+    cachedir = os.environ.get('THECOOK_REPORT_CACHE')
+    if not cachedir and dbfile: cachedir = dbfile + '.reports'
+    configure(cachedir)
+  return _cache
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sun 18 Oct 2026 12:03:31 CEST
+
+"""A scheduler that runs the e-mail jobs from a long-running process
+
+Instead of starting a new process for every job (e.g. from cron), the
+scheduler keeps one database connection and the user directory warm and fires
+jobs at their scheduled times. Every run is recorded in the database (see
+:py:class:`.models.JobRun`) before it starts, so a job never runs twice for
+the same scheduled time, even across restarts.
+"""
+
+import json
+import time
+import logging
+import datetime
+
+WEEKDAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+class Schedule(object):
+  """When a job runs: at a time of the day, on some days of the week
+
+  Schedules are written like ``11:30`` (every day), ``mon-fri 18:05`` or
+  ``mon,thu 10:00``.
+  """
+
+  def __init__(self, spec):
+
+    self.spec = spec
+    fields = spec.split()
+    if len(fields) == 1: fields.insert(0, 'mon-sun')
+    if len(fields) != 2:
+      raise ValueError("Cannot parse schedule `%s'" % spec)
+    days, at = fields
+
+    try:
+      hour, minute = [int(k) for k in at.split(':')]
+      self.time = datetime.time(hour, minute)
+    except ValueError:
+      raise ValueError("Cannot parse time of the day in schedule `%s'" % spec)
+
+    self.weekdays = set()
+    for part in days.lower().split(','):
+      try:
+        if '-' in part:
+          start, end = [WEEKDAYS.index(k) for k in part.split('-')]
+          self.weekdays.update(range(start, end+1))
+        else:
+          self.weekdays.add(WEEKDAYS.index(part))
+      except ValueError:
+        raise ValueError("Cannot parse days of the week in schedule `%s' " \
+            "(use %s)" % (spec, ', '.join(WEEKDAYS)))
+
+  def previous(self, now):
+    """Returns the last time the job was due, up to ``now``"""
+
+    for k in range(8):
+      day = now.date() - datetime.timedelta(days=k)
+      slot = datetime.datetime.combine(day, self.time)
+      if day.weekday() in self.weekdays and slot <= now: return slot
+
+  def next(self, now):
+    """Returns the next time the job is due, after ``now``"""
+
+    for k in range(8):
+      day = now.date() + datetime.timedelta(days=k)
+      slot = datetime.datetime.combine(day, self.time)
+      if day.weekday() in self.weekdays and slot > now: return slot
+
+  def __repr__(self):
+
+    return 'Schedule(%s)' % self.spec
+
+def _call(session, to=None, cc=None, queue=False):
+
+  from .sendmail import call
+  return call(session, to, cc=cc, queue=queue)
+
+def _report(session, to=None, cc=None, queue=False, force=False):
+
+  from .sendmail import report
+  return report(session, to, force, cc, queue=queue)
+
+def _remind(session, cc=None, queue=False, force=False, personal=False,
+    concurrency=4):
+
+  from .sendmail import remind
+  return remind(session, False, force, cc, queue=queue, personal=personal,
+      workers=concurrency)
+
+def _ask_menu(session, to=None, cc=None, queue=False):
+
+  from .sendmail import ask_menu
+  return ask_menu(session, to, False, cc, queue=queue)
+
+def _refresh(session, force=False):
+
+  from .menu import refresh_users
+  return refresh_users(session, force)
+
+JOBS = {
+    'call': _call,
+    'report': _report,
+    'remind': _remind,
+    'askmenu': _ask_menu,
+    'refresh': _refresh,
+    }
+"""Jobs the scheduler can run, called with a session and the job options"""
+
+def options(job):
+  """Returns the names of the options a job takes, or ``None`` if it takes
+  any"""
+
+  import inspect
+  parameters = list(inspect.signature(JOBS[job]).parameters.values())[1:]
+  if any(k.kind == k.VAR_KEYWORD for k in parameters): return None
+  return set(k.name for k in parameters)
+
+def check_config(config):
+  """Checks jobs in the configuration have a schedule and known options
+
+  Raises :py:exc:`ValueError` otherwise, so mistyped options are not
+  silently ignored.
+  """
+
+  for name, settings in config['jobs'].items():
+    if name not in JOBS:
+      raise ValueError("Unknown job `%s' (choose from %s)" % \
+          (name, ', '.join(sorted(JOBS))))
+    if 'at' not in settings:
+      raise ValueError("Job `%s' has no schedule (`at')" % name)
+    known = options(name)
+    if known is None: continue
+    unknown = sorted(set(settings) - known - set(['at']))
+    if unknown:
+      raise ValueError("Unknown option(s) %s for job `%s' (choose from %s)" % \
+          (', '.join(unknown), name, ', '.join(sorted(known | set(['at'])))))
+
+DEFAULT_CONFIG = {
+    'grace': 900,
+    'jobs': {
+      'remind': {'at': 'mon-fri 11:30'},
+      'refresh': {'at': 'mon-fri 06:00'},
+      },
+    }
+"""Used when no configuration is given. Other jobs need e-mail addresses"""
+
+def load_config(path=None):
+  """Loads the scheduler configuration from a JSON file
+
+  The file contains a dictionary with the (optional) ``grace`` period, in
+  seconds, and the ``jobs`` to run. Each job is named after an entry in
+  :py:data:`JOBS` and has a schedule (``at``, see :py:class:`Schedule`) and
+  options, such as ``to``, ``cc`` or ``queue`` (see :py:func:`check_config`).
+  For example::
+
+    {
+      "jobs": {
+        "report": {"at": "mon-fri 18:05", "to": ["vatel@example.com"]},
+        "remind": {"at": "mon-fri 11:30", "queue": true},
+        "askmenu": {"at": "thu 10:00", "to": ["vatel@example.com"]}
+      }
+    }
+  """
+
+  if path is None: return DEFAULT_CONFIG
+  with open(path, 'rt') as f: config = json.load(f)
+  check_config(config)
+  return config
+
+class Scheduler(object):
+  """Runs jobs at their scheduled times, recording each run
+
+  ``config`` is a dictionary like the one returned by :py:func:`load_config`.
+  Jobs that were due while the scheduler was not running are still run if
+  they are late by less than ``grace`` seconds.
+  """
+
+  def __init__(self, session, config=DEFAULT_CONFIG):
+
+    self.session = session
+    self.grace = datetime.timedelta(seconds=config.get('grace', 900))
+    self.jobs = {}
+    check_config(config)
+    for name, settings in config['jobs'].items():
+      settings = dict(settings)
+      self.jobs[name] = (Schedule(settings.pop('at')), settings)
+    self.seen = set() #(job, slot) already handled by this process
+
+  def claim(self, job, slot):
+    """Records the job run for the slot, returns it
+
+    Returns ``None`` if the job already ran (or is running) for that slot.
+    """
+
+    from sqlalchemy.exc import IntegrityError
+    from .models import JobRun
+
+    run = JobRun(job, slot)
+    self.session.add(run)
+    try:
+      self.session.commit()
+    except IntegrityError:
+      self.session.rollback()
+      return None
+    return run
+
+  def execute(self, job, slot):
+    """Runs the job for the slot, unless it already ran, returns the run"""
+
+    from .models import JobRun
+
+    run = self.claim(job, slot)
+    if run is None:
+      logging.info("Job `%s' already ran for `%s', skipping" % (job, slot))
+      return None
+
+    schedule, options = self.jobs[job]
+    start = time.time()
+    try:
+      JOBS[job](self.session, **options)
+      run.status = JobRun.DONE
+    except Exception as e:
+      self.session.rollback()
+      run.status = JobRun.FAILED
+      run.error = '%s: %s' % (type(e).__name__, e)
+      logging.exception("Job `%s' failed" % job)
+    run.finished = datetime.datetime.now()
+    self.session.commit()
+    logging.info("Job `%s' for `%s' is %s after %.3f seconds" % \
+        (job, slot, run.status, time.time() - start))
+    return run
+
+  def due(self, now):
+    """Returns the ``(job, slot)`` pairs due at ``now``, not yet handled"""
+
+    retval = []
+    for job, (schedule, options) in sorted(self.jobs.items()):
+      slot = schedule.previous(now)
+      if slot is None or (job, slot) in self.seen: continue
+      if now - slot <= self.grace: retval.append((job, slot))
+      else: self.seen.add((job, slot)) #missed for good
+    return retval
+
+  def run_pending(self, now=None):
+    """Runs all due jobs, returns the runs that happened"""
+
+    now = now or datetime.datetime.now()
+    retval = []
+    for job, slot in self.due(now):
+      run = self.execute(job, slot)
+      self.seen.add((job, slot))
+      if run is not None: retval.append(run)
+    return retval
+
+  def next(self, now=None):
+    """Returns the next time a job is due, or ``None``, if there are no
+    jobs"""
+
+    now = now or datetime.datetime.now()
+    if not self.jobs: return None
+    return min(k[0].next(now) for k in self.jobs.values())
+
+  def serve(self, tick=60):
+    """Runs jobs forever, checking for due jobs at least every ``tick``
+    seconds"""
+
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    def step():
+      self.run_pending()
+      self.session.close() #do not keep stale objects between jobs
+
+    async def main():
+
+      # jobs use the session, so they all run on the same thread
+      executor = ThreadPoolExecutor(1)
+      loop = asyncio.get_event_loop()
+      for job, (schedule, options) in sorted(self.jobs.items()):
+        logging.info("Job `%s' is scheduled for `%s', next at `%s'" % \
+            (job, schedule.spec, schedule.next(datetime.datetime.now())))
+
+      while True:
+        await loop.run_in_executor(executor, step)
+        wait = tick
+        upcoming = self.next()
+        if upcoming is not None: #otherwise, idles
+          now = datetime.datetime.now()
+          wait = min(wait, (upcoming - now).total_seconds())
+        await asyncio.sleep(max(0, wait))
+
+    asyncio.run(main())
+
+def runs(session, job=None, limit=20):
+  """Returns the last runs of jobs, most recent first"""
+
+  from .models import JobRun
+
+  query = session.query(JobRun)
+  if job: query = query.filter(JobRun.job == job)
+  return query.order_by(JobRun.slot.desc(), JobRun.id.desc()).limit(limit).all()
@@ -6,7 +6,7 @@
 """Validation routines"""
 
 from datetime import date, datetime, timedelta
-from .models import as_unicode
+from .utils import as_unicode
 
 weekdays = [
     'monday',
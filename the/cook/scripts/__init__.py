@@ -0,0 +1,14 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sat 17 Oct 2026 23:50:31 CEST
+
+"""Command line utilities"""
+
+class LazyVersion(object):
+  """The package version, only resolved when printed with ``--version``"""
+
+  def __str__(self):
+
+    from .. import __version__
+    return __version__
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sun 18 Oct 2026 18:11:47 CEST
+
+"""Benchmarks listings, subscriptions, reminders and the command line utilities
+
+Usage:
+  %(prog)s [-v ...] [--years=<n>] [--users=<n>] [--subscriptions=<n>]
+           [--repeat=<n>] [--workers=<n>] [--output=<file>]
+           [--compare=<file>] [--tolerance=<x>]
+  %(prog)s (-h | --help)
+
+
+Options:
+  -h --help               Shows this screen.
+  -y --years=<n>          Years of lunches (one per week day) in the temporary
+                          database [default: 3]
+  -u --users=<n>          How many users [default: 2000]
+  -s --subscriptions=<n>  How many subscriptions [default: 30000]
+  -r --repeat=<n>         How many times each benchmark runs. The report has
+                          the minimum, median and maximum times [default: 5]
+  -w --workers=<n>        How many SMTP connections send personal reminders
+                          in parallel, compared with a single one
+                          [default: 8]
+  -o --output=<file>      Writes the JSON report to this file, instead of the
+                          standard output
+  -c --compare=<file>     Compares the results with a previous report. Exits
+                          with an error if any benchmark got slower (see
+                          --tolerance) or issues more SQL statements
+  -t --tolerance=<x>      How much slower (as a fraction of the previous median
+                          time) benchmarks may get [default: 0.5]
+  -v --verbose            Increases the verbosity level for this application.
+"""
+
+import logging
+from .. import __logging_format__
+logging.basicConfig(format=__logging_format__)
+
+import os
+import sys
+import json
+import time
+import random
+import docopt
+import datetime
+
+from ..instrument import count_statements
+
+def seed(dbfile, years=3, users=2000, subscriptions=30000, seed=0):
+  """Fills the database with synthetic lunches, users and subscriptions
+
+  There is a lunch on each week day, from ``years`` ago until 4 weeks from
+  today. Returns a dictionary with the number of rows of each kind.
+  """
+
+  from ..models import connect, User, Lunch, Subscription
+
+  rng = random.Random(seed)
+  today = datetime.date.today()
+  days = [today + datetime.timedelta(days=k) \
+      for k in range(-365*years, 28)]
+  days = [k for k in days if k.weekday() < 5]
+
+  session = connect(dbfile)
+  session.execute(User.__table__.insert(), [{
+    'id': 100000 + k,
+    'name': 'user%d' % k,
+    'fullname': 'User %d' % k,
+    'phone': '+41277217%03d' % (k % 1000),
+    'email': 'user%d@example.com' % k,
+    'refreshed': datetime.datetime.now(),
+    } for k in range(users)])
+  session.execute(Lunch.__table__.insert(), [{
+    'id': 1 + k,
+    'date': day,
+    'menu_french': 'Menu %d' % k,
+    'menu_english': 'Menu %d' % k,
+    } for k, day in enumerate(days)])
+
+  pairs = set()
+  subscriptions = min(subscriptions, users * len(days))
+  while len(pairs) < subscriptions:
+    pairs.add((rng.randrange(len(days)), rng.randrange(users)))
+  session.execute(Subscription.__table__.insert(), [{
+    'lunch_id': 1 + lunch,
+    'user_id': 100000 + user,
+    'persons': 1 + rng.randrange(3),
+    'date': datetime.datetime.combine(days[lunch], datetime.time(9)) - \
+        datetime.timedelta(days=1 + rng.randrange(7)),
+    } for lunch, user in sorted(pairs)])
+  session.commit()
+  session.close()
+
+  return {'lunches': len(days), 'users': users, 'subscriptions': len(pairs)}
+
+def measure(func, repeat, setup=None):
+  """Runs ``func`` ``repeat`` times, returns the timings and statements
+
+  ``setup`` is called before each run, and is not measured.
+  """
+
+  timings = []
+  statements = None
+  for k in range(repeat):
+    if setup: setup()
+    start = time.time()
+    retval, count = count_statements(func)
+    timings.append(time.time() - start)
+    statements = count if statements is None else max(statements, count)
+
+  timings.sort()
+  return {
+      'seconds': {
+        'min': timings[0],
+        'median': timings[len(timings)//2],
+        'max': timings[-1],
+        },
+      'statements': statements,
+      'repeat': repeat,
+      }
+
+def run_script(module, args, env=None):
+  """Runs a command line utility in a new process"""
+
+  import subprocess
+  code = 'import sys; from the.cook.scripts.%s import main; ' \
+      'sys.exit(main(sys.argv[1:]))' % module
+  environment = dict(os.environ)
+  environment.update(env or {})
+  with open(os.devnull, 'wb') as devnull:
+    subprocess.check_call([sys.executable, '-c', code] + list(args),
+        env=environment, stdout=devnull, stderr=devnull)
+
+SMTP_DELAY = 0.005 #seconds the local SMTP server takes for each message
+
+def run(dbfile, repeat=5, workers=8):
+  """Runs all benchmarks on a seeded database, returns their results
+
+  Personal reminders are sent to a local SMTP server (see
+  :py:class:`..smtpsink.SMTPSink`) through 1 and ``workers`` connections.
+  Their results also have the number of messages sent per second.
+  """
+
+  from ..models import connect
+  from ..menu import lunch_list, user_list, subscribe, unsubscribe, \
+      next_subscribeable_lunch
+  from ..smtpsink import SMTPSink
+  from .. import sendmail
+
+  session = connect(dbfile)
+  today = datetime.date.today()
+  last_year = today - datetime.timedelta(days=365)
+  everything = (datetime.date.min, datetime.date.max)
+  in2weeks = today + datetime.timedelta(days=14)
+  while in2weeks.weekday() >= 5: in2weeks += datetime.timedelta(days=1)
+
+  def fresh(func, *args):
+    def inner():
+      session.expunge_all()
+      return func(*args)
+    return inner
+
+  benchmarks = {
+      'lunch_list': (fresh(lunch_list, session, last_year, today, False),
+        None),
+      'lunch_list_long': (fresh(lunch_list, session, last_year, today, True),
+        None),
+      'lunch_list_all_long': (fresh(lunch_list, session, everything[0],
+        everything[1], True), None),
+      'user_list': (fresh(user_list, session, 'user7', everything[0],
+        everything[1], True), None),
+      'next_subscribeable_lunch': (fresh(next_subscribeable_lunch, session),
+        None),
+      'subscribe': (fresh(subscribe, session, in2weeks, 1),
+        lambda: unsubscribe(session, in2weeks)),
+      'remind_personal_1': (fresh(sendmail.remind, session, False, True,
+        None, False, True, 1), None),
+      'remind_personal_%d' % workers: (fresh(sendmail.remind, session, False,
+        True, None, False, True, workers), None),
+      'manage_list': (lambda: run_script('manage', ['--dbfile=%s' % dbfile,
+        'list', '--long', '%s..' % last_year.strftime('%d.%m.%y')]), None),
+      'lunch_list_script': (lambda: run_script('lunch', ['list'],
+        {'THECOOK_DBFILE': dbfile, 'THECOOK_SOCKET': dbfile + '.nosock'}),
+        None),
+      'lunch_version_script': (lambda: run_script('lunch', ['--version']),
+        None), #start-up time, mostly imports
+      }
+
+  # warms up caches (user directory, engine, imports), the subscription is
+  # removed before each run
+  subscribe(session, in2weeks, 1)
+
+  retval = {}
+  with SMTPSink(delay=SMTP_DELAY) as sink:
+    sendmail.configure(sink.transport())
+    try:
+      for name, (func, setup) in sorted(benchmarks.items()):
+        logging.info("Running `%s'..." % name)
+        sent = len(sink.messages)
+        retval[name] = measure(func, repeat, setup)
+        if name.endswith('_script') or name.startswith('manage_'):
+          retval[name]['statements'] = None #in another process
+        if name.startswith('remind_'):
+          retval[name]['messages_per_second'] = \
+              (len(sink.messages) - sent) / float(repeat) / \
+              retval[name]['seconds']['median']
+    finally:
+      sendmail.configure(None)
+
+  session.close()
+  return retval
+
+def compare(results, baseline, tolerance=0.5):
+  """Compares benchmark results with a baseline, returns the regressions"""
+
+  retval = []
+  for name, result in sorted(results.items()):
+    if name not in baseline: continue
+    before = baseline[name]
+    slowest = before['seconds']['median'] * (1 + tolerance)
+    if result['seconds']['median'] > slowest:
+      retval.append("`%s' got slower: %.4f s, was %.4f s" % (name,
+        result['seconds']['median'], before['seconds']['median']))
+    if before.get('statements') is not None and \
+        result['statements'] is not None and \
+        result['statements'] > before['statements']:
+      retval.append("`%s' issues more SQL statements: %d, was %d" % (name,
+        result['statements'], before['statements']))
+  return retval
+
+def main(argv=None):
+
+  prog = sys.argv[0]
+  arguments = docopt.docopt(__doc__ % {'prog': prog}, argv=argv)
+
+  if arguments['--verbose'] == 1: logging.getLogger().setLevel(logging.INFO)
+  if arguments['--verbose'] >  1: logging.getLogger().setLevel(logging.DEBUG)
+
+  import shutil
+  import tempfile
+  import platform
+  import sqlalchemy
+
+  tmpdir = tempfile.mkdtemp()
+  try:
+    dbfile = os.path.join(tmpdir, 'benchmark.sql3')
+    start = time.time()
+    sizes = seed(dbfile, int(arguments['--years']), int(arguments['--users']),
+        int(arguments['--subscriptions']))
+    sizes['seconds'] = time.time() - start
+    results = run(dbfile, int(arguments['--repeat']),
+        int(arguments['--workers']))
+  finally:
+    shutil.rmtree(tmpdir)
+
+  report = {
+      'date': datetime.datetime.now().isoformat(),
+      'python': platform.python_version(),
+      'sqlalchemy': sqlalchemy.__version__,
+      'database': sizes,
+      'benchmarks': results,
+      }
+
+  data = json.dumps(report, indent=2, sort_keys=True)
+  if arguments['--output']:
+    with open(arguments['--output'], 'wt') as f: f.write(data + '\n')
+  else:
+    print(data)
+
+  if arguments['--compare']:
+    with open(arguments['--compare'], 'rt') as f: baseline = json.load(f)
+    regressions = compare(results, baseline['benchmarks'],
+        float(arguments['--tolerance']))
+    for k in regressions: logging.error(k)
+    if regressions: return 1
+
+  return 0
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sun 18 Oct 2026 15:02:48 CEST
+
+"""Load tests the JSON API server (see ``manage api``)
+
+Usage:
+  %(prog)s [-v ...] [--url=<url>] [--clients=<n>] [--duration=<s>]
+           [--workers=<n>]
+  %(prog)s (-h | --help)
+
+
+Options:
+  -h --help          Shows this screen.
+  -u --url=<url>     Loads a running server at this URL (e.g.
+                     http://127.0.0.1:8080), instead of starting one on a
+                     temporary database
+  -c --clients=<n>   How many clients send requests concurrently, each on its
+                     own persistent connection [default: 16]
+  -d --duration=<s>  For how many seconds to send requests [default: 10]
+  -w --workers=<n>   How many requests the started server answers in
+                     parallel [default: 4]
+  -v --verbose       Increases the verbosity level for this application.
+
+
+Each client sends a mix of requests: 60%% listings of lunches, 20%%
+subscriptions and 20%% unsubscriptions, all for the user running this program
+(the server refuses to act for anyone else). At the end, the number of requests
+per second and the latency percentiles are printed.
+"""
+
+import logging
+from .. import __logging_format__
+logging.basicConfig(format=__logging_format__)
+
+import sys
+import json
+import time
+import random
+import docopt
+
+async def request(reader, writer, method, path, body=None):
+  """Sends a request on a persistent connection, returns the status and the
+  decoded JSON answer"""
+
+  data = json.dumps(body).encode('utf-8') if body is not None else b''
+  writer.write(('%s %s HTTP/1.1\r\nHost: localhost\r\n'
+    'Content-Type: application/json\r\nContent-Length: %d\r\n\r\n' % \
+        (method, path, len(data))).encode('latin-1') + data)
+  await writer.drain()
+
+  status = int((await reader.readline()).split()[1])
+  length = 0
+  while True:
+    line = await reader.readline()
+    if line in (b'\r\n', b''): break
+    name, _, value = line.decode('latin-1').partition(':')
+    if name.strip().lower() == 'content-length': length = int(value)
+  return status, json.loads((await reader.readexactly(length)).decode('utf-8'))
+
+def load(host, port, dates, clients=16, duration=10):
+  """Sends requests from concurrent clients for ``duration`` seconds
+
+  Returns a dictionary with the number of ``requests``, ``errors`` (answers
+  with status 500 or more), the rate of ``requests_per_second`` and the
+  request ``latencies`` (in seconds, sorted).
+  """
+
+  import asyncio
+
+  latencies = []
+  errors = [0]
+
+  async def client():
+
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+      while time.time() < deadline:
+        choice = random.random()
+        if choice < 0.6:
+          method, path, body = 'GET', '/lunches', None
+        else:
+          method = 'POST'
+          path = '/subscribe' if choice < 0.8 else '/unsubscribe'
+          body = {'date': random.choice(dates)} #for this user
+        start = time.time()
+        status, answer = await request(reader, writer, method, path, body)
+        latencies.append(time.time() - start)
+        if status >= 500:
+          errors[0] += 1
+          logging.critical("%s %s: %s" % (method, path, answer))
+    finally:
+      writer.close()
+
+  async def main():
+    await asyncio.gather(*[client() for k in range(clients)])
+
+  start = time.time()
+  deadline = start + duration
+  asyncio.run(main())
+  elapsed = time.time() - start
+
+  latencies.sort()
+  return {
+      'requests': len(latencies),
+      'errors': errors[0],
+      'requests_per_second': len(latencies) / elapsed,
+      'latencies': latencies,
+      }
+
+def start_server(dbfile, workers):
+  """Starts the API server on a background thread, returns its port"""
+
+  import asyncio
+  import threading
+  from ..api import Server
+
+  server = Server(dbfile, workers)
+  started = threading.Event()
+  port = []
+
+  def run():
+    async def main():
+      listener = await server.start('127.0.0.1', 0)
+      port.append(listener.sockets[0].getsockname()[1])
+      started.set()
+      await listener.serve_forever()
+    asyncio.run(main())
+
+  thread = threading.Thread(target=run)
+  thread.daemon = True
+  thread.start()
+  started.wait()
+  return port[0]
+
+def setup_database(dbfile, days=5):
+  """Creates lunches for the next days, returns their dates, as strings"""
+
+  import datetime
+  from ..models import connect
+  from ..menu import add
+
+  session = connect(dbfile)
+  dates = []
+  for k in range(days):
+    date = datetime.date.today() + datetime.timedelta(days=2+k)
+    add(session, date, 'Menu %d' % k, 'Menu %d' % k)
+    dates.append(date.strftime('%d.%m.%y'))
+  session.close()
+  return dates
+
+def main(argv=None):
+
+  prog = sys.argv[0]
+  arguments = docopt.docopt(__doc__ % {'prog': prog}, argv=argv)
+
+  # the server logs rejected requests (e.g. unsubscribing twice) as errors
+  if arguments['--verbose'] == 0: logging.getLogger().setLevel(logging.CRITICAL)
+  if arguments['--verbose'] == 1: logging.getLogger().setLevel(logging.INFO)
+  if arguments['--verbose'] >  1: logging.getLogger().setLevel(logging.DEBUG)
+
+  import os
+  import shutil
+  import tempfile
+
+  tmpdir = None
+  if arguments['--url']:
+    from six.moves.urllib.parse import urlsplit
+    url = urlsplit(arguments['--url'])
+    host, port = url.hostname, url.port or 80
+    dates = ['next', 'tomorrow']
+  else:
+    tmpdir = tempfile.mkdtemp()
+    dbfile = os.path.join(tmpdir, 'loadtest.sql3')
+    dates = setup_database(dbfile)
+    host, port = '127.0.0.1', start_server(dbfile, int(arguments['--workers']))
+
+  try:
+    result = load(host, port, dates, int(arguments['--clients']),
+        float(arguments['--duration']))
+  finally:
+    if tmpdir: shutil.rmtree(tmpdir)
+
+  latencies = result['latencies']
+  def percentile(p):
+    return 1000 * latencies[min(len(latencies)-1, int(p * len(latencies)))]
+
+  print("%d request(s), %d error(s), %.0f requests/s" % (result['requests'],
+    result['errors'], result['requests_per_second']))
+  if latencies:
+    print("Latency: p50 %.1f ms, p95 %.1f ms, p99 %.1f ms, max %.1f ms" % \
+        (percentile(0.5), percentile(0.95), percentile(0.99),
+          1000 * latencies[-1]))
+
+  return 0 if not result['errors'] else 1
@@ -6,10 +6,10 @@
 """Subscribe, unsubscribe and list menu options
 
 Usage:
-  %(prog)s add [<date>] [--persons=<n>]
-  %(prog)s remove [<date>]
-  %(prog)s mine
-  %(prog)s list
+  %(prog)s [--profile] add [<date>] [--persons=<n>]
+  %(prog)s [--profile] remove [<date>]
+  %(prog)s [--profile] mine
+  %(prog)s [--profile] list
   %(prog)s (-h | --help)
   %(prog)s (-V | --version)
 
@@ -34,6 +34,9 @@ Options:
                     responsible for paying for those persons at the Vatel
                     Restaurant as only your name will figure on the final list
                     [default: 1].
+  --profile         At exit, prints how many SQL statements were run and the
+                    slowest ones, as well as the time spent talking to the
+                    daemon or running other programs
 
 
 Commands:
@@ -77,14 +80,13 @@ Examples:
 """
 
 import logging
-from .. import __logging_format__, __version__
+from .. import __logging_format__
 logging.basicConfig(format=__logging_format__)
 
 import os
 import sys
 import docopt
-import schema
-import datetime
+from . import LazyVersion
 
 from ..schema import validate_date
 
@@ -94,10 +96,11 @@ def main(argv=None):
   arguments = docopt.docopt(
       __doc__ % {'prog': prog},
       argv=argv,
-      version=__version__
+      version=LazyVersion(),
       )
 
   # validate arguments
+  import schema
   s = schema.Schema({
     'add': object, #ignore
     'remove': object, #ignore
@@ -106,48 +109,39 @@ def main(argv=None):
     '<date>': schema.Use(validate_date),
     '--help'    : object, #ignore
     '--version' : object, #ignore
+    '--profile' : object, #ignore
     '--persons': schema.And(schema.Use(int), lambda n: n > 0),
     })
 
+  date = arguments['<date>'] #as typed, for the daemon
   arguments = s.validate(arguments)
 
-  from pkg_resources import resource_filename
-  from .. import data
-  dbfile = resource_filename(data.__name__, 'thecook.sql3')
-
-  today = datetime.datetime.today()
-
-  from ..models import connect
-  from ..menu import lunch_list, user_list, subscribe, unsubscribe, get_current_user, format_date
-
-  if arguments['add']:
-    session = connect(dbfile)
-    sub = subscribe(session, arguments['<date>'], arguments['--persons'])
-    if sub:
-      print("User `%s' successfully subscribed for lunch `%s' at `%s'" % \
-          (sub.user.name, sub.lunch.menu_english, format_date(sub.lunch.date)))
-  elif arguments['remove']:
-    session = connect(dbfile)
-    sub = unsubscribe(session, arguments['<date>'])
-    if sub:
-      print("User `%s' successfully unsubscribed from lunch `%s' at `%s'" % \
-          (sub.user.name, sub.lunch.menu_english, format_date(sub.lunch.date)))
-  elif arguments['list']:
-    session = connect(dbfile)
-    to_print = lunch_list(session, today, datetime.date.max, long_desc=True)
-    if not to_print:
-      print("No lunches programmed as of this time")
+  if arguments['--profile']:
+    import atexit
+    from ..instrument import enable, report
+    enable()
+    atexit.register(report)
+
+  command = [k for k in ('add', 'remove', 'list', 'mine') if arguments[k]][0]
+
+  from ..daemon import request, answer
+  to_print = request(command, date, arguments['--persons'])
+
+  if to_print is None: #no daemon, access the database directly
+    from ..data import dbfile
+    dbfile = dbfile()
+
+    if command in ('add', 'remove'):
+      from ..models import connect
+      to_print = answer(command, arguments['<date>'], arguments['--persons'],
+          session=connect(dbfile))
+    elif os.path.exists(dbfile):
+      from ..models import connect_readonly
+      with connect_readonly(dbfile).connect() as connection:
+        to_print = answer(command, connection=connection)
     else:
-      for k in to_print: print(k)
-  elif arguments['mine']:
-    session = connect(dbfile)
-    user = get_current_user(session)
-    to_print = user_list(session, user.name, today, datetime.date.max, long_desc=True)
-    if len(to_print) == 1:
-      print("User `%s' is not registered to any upcoming lunches" % user.name)
-    else:
-      for k in to_print: print(k)
-  else:
-    raise NotImplementedError("unknown command")
+      to_print = answer(command)
+
+  for k in to_print: print(k)
 
   return 0
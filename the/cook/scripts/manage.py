@@ -9,16 +9,29 @@ Usage:
   %(prog)s [--dbfile=<s>] [-v ...] init [--recreate]
   %(prog)s [--dbfile=<s>] [-v ...] add <date> <menu>
   %(prog)s [--dbfile=<s>] [-v ...] remove [--force] <date>
+  %(prog)s [--dbfile=<s>] [-v ...] import [--dry-run] <file>
   %(prog)s [--dbfile=<s>] [-v ...] list [--long] [<range>]
   %(prog)s [--dbfile=<s>] [-v ...] userlist [--long] [<range>] [<username>]
+  %(prog)s [--dbfile=<s>] [-v ...] export [--format=<f>] [--output=<file>]
+           [<range>] [<username>]
   %(prog)s [--dbfile=<s>] [-v ...] subscribe [<date>] [--persons=<n>]
   %(prog)s [--dbfile=<s>] [-v ...] unsubscribe [<date>]
-  %(prog)s [--dbfile=<s>] [-v ...] call [--date=<date>] [<email>]...
-  %(prog)s [--dbfile=<s>] [-v ...] report [--force] [--cc=<addr> ...]
+  %(prog)s [--dbfile=<s>] [-v ...] call [--queue] [--date=<date>] [<email>]...
+  %(prog)s [--dbfile=<s>] [-v ...] report [--queue] [--force] [--cc=<addr> ...]
            [<email>]...
-  %(prog)s [--dbfile=<s>] [-v ...] askmenu [--dry-run] [--cc=<addr> ...]
-           [<email>]...
-  %(prog)s [--dbfile=<s>] [-v ...] remind [--force] [--dry-run]
+  %(prog)s [--dbfile=<s>] [-v ...] askmenu [--queue] [--dry-run]
+           [--cc=<addr> ...] [<email>]...
+  %(prog)s [--dbfile=<s>] [-v ...] remind [--queue] [--force] [--dry-run]
+           [--personal] [--concurrency=<n>]
+  %(prog)s [--dbfile=<s>] [-v ...] refresh [--force]
+  %(prog)s [--dbfile=<s>] [-v ...] worker [--once] [--concurrency=<n>]
+           [--attempts=<n>] [--backoff=<s>] [--poll=<s>]
+  %(prog)s [--dbfile=<s>] [-v ...] outbox [--retry]
+  %(prog)s [--dbfile=<s>] [-v ...] serve [--config=<file>]
+  %(prog)s [--dbfile=<s>] [-v ...] jobs
+  %(prog)s [--dbfile=<s>] [-v ...] api [--host=<h>] [--port=<n>]
+           [--concurrency=<n>]
+  %(prog)s [--dbfile=<s>] [-v ...] daemon [--socket=<path>]
   %(prog)s (-h | --help)
   %(prog)s (-V | --version)
 
@@ -44,6 +57,12 @@ Arguments:
               is just printed to the screen.
   <username>  Refers to the login name of the user at the Idiap system. For
               example 'ksmith' or 'jdoe'.
+  <file>      A file with menus to import: CSV (with a header naming the
+              columns 'date' and 'menu'), JSON (a list of objects with keys
+              'date' and 'menu') or iCalendar (events with a start date and
+              the menu as summary). Files are recognized by their extension,
+              '.csv', '.json' or '.ics'. Dates are written like for <date> or
+              like 2014-04-28, menus like for <menu>.
 
 
 Options:
@@ -64,23 +83,74 @@ Options:
                     Restaurant as only your name will figure on the final list
                     [default: 1].
   -n --dry-run      In reminder mode, instead of sending the messages, just
-                    simulates what it would send.
-  -f --force        Force the action, even if it has nasty consequences
-  -v --verbose      Increases the verbosity level for this application.
+                    simulates what it would send. When importing, only checks
+                    the file and reports conflicts, without adding lunches.
+  -f --force        Force the action, even if it has nasty consequences. When
+                    refreshing, refreshes all users and not only stale ones
+  -q --queue        Instead of sending e-mails right away, store them in the
+                    outbox, to be sent by the worker
+  --once            Makes the worker exit once the outbox is drained, instead
+                    of waiting for new messages
+  --concurrency=<n> How many messages the worker, or personal reminders, send
+                    in parallel, or how many requests the API server answers
+                    in parallel [default: 4]
+  --personal        Sends individual reminders to each subscriber, with their
+                    own headcount and amount owed
+  --attempts=<n>    How many times the worker tries to send a message before
+                    giving up on it [default: 5]
+  --backoff=<s>     Seconds the worker waits before retrying a failed message.
+                    This is doubled at each new attempt [default: 60]
+  --poll=<s>        Seconds the worker waits between checks for new messages
+                    [default: 10]
+  --retry           When showing the outbox, re-schedules messages the worker
+                    gave up on
+  --config=<file>   A JSON file with the jobs the scheduler runs and their
+                    schedules. If not set, only sends reminders, on week days
+                    at 11:30
+  --format=<f>      The format of exports: csv, jsonl (JSON Lines) or parquet
+                    (needs pyarrow). If not set, it is guessed from the
+                    extension of the output file or, else, csv
+  --output=<file>   The file exports are written to. If not set, exports are
+                    printed (not possible with parquet)
+  --host=<h>        The interface the API server listens on. Only loopback
+                    interfaces are allowed: clients are identified by the
+                    local user owning their connection and may only
+                    (un)subscribe themselves [default: 127.0.0.1]
+  --port=<n>        The port the API server listens on [default: 8080]
+  --socket=<path>   The Unix socket the daemon listens on. If not set, uses
+                    the environment variable THECOOK_SOCKET or a file next to
+                    the package bound database
+  -v --verbose      Increases the verbosity level for this application. With
+                    -vvv, also prints at exit how many SQL statements were run
+                    and the slowest ones, as well as the time spent sending
+                    e-mails or running other programs
 
 
 Commands:
-  init         Initializes the current repository for menus and subscribers
+  init         Initializes the current repository for menus and subscribers,
+               or upgrades an existing one to the latest schema
   add          Adds a new menu for a specific date, sends a call e-mail
   remove       Removes the menu entry for that date
+  import       Adds menus for many dates, from a file, at once
   list         Lists past and future menus, with subscribers
   userlist     Lists user subscriptions, within a certain date range
+  export       Writes all lunches and subscriptions, within a certain date
+               range and (optionally) of a user, to a CSV, JSON Lines or
+               Parquet file
   subscribe    Subscribes the user to one of the next lunches
   unsubscribe  Unsubscribes the user from one of the next lunches
   call         Calls idiapers for lunch subscription, with the menu
   report       Sends a PDF report to the Vatel Restaurant
   remind       Sends a reminder for subscribes of the day lunch
   askmenu      Sends and e-mail to ask for the menus for next week
+  refresh      Refreshes stored user names and phones from the system
+  worker       Sends e-mails stored in the outbox
+  outbox       Shows e-mails stored in the outbox, that were not sent yet
+  serve        Runs jobs (call, report, remind, askmenu, refresh) on a
+               schedule
+  jobs         Shows the last runs of scheduled jobs, with timings
+  api          Serves subscriptions and listings as JSON over HTTP
+  daemon       Answers commands of the `lunch' utility over a Unix socket
 
 
 Examples:
@@ -89,6 +159,10 @@ Examples:
 
     $ %(prog)s add 28.04.14 "Risotto au champignon (Mushroom risotto)"
 
+  To add the menus for a whole week, from a CSV file:
+
+    $ %(prog)s import week.csv
+
   To remove a menu:
 
     $ %(prog)s remove 28.04.14
@@ -103,13 +177,13 @@ Examples:
 """
 
 import logging
-from .. import __logging_format__, __version__
+from .. import __logging_format__
 logging.basicConfig(format=__logging_format__)
 
 import os
 import sys
 import docopt
-import schema
+from . import LazyVersion
 
 from ..schema import validate_date, validate_range, validate_menu
 
@@ -119,15 +193,23 @@ def main(argv=None):
   arguments = docopt.docopt(
       __doc__ % {'prog': prog},
       argv=argv,
-      version=__version__
+      version=LazyVersion(),
       )
 
   # validate arguments
+  import schema
   s = schema.Schema({
     'init': object, #ignore
     'add': object, #ignore
     'remove': object, #ignore
+    'import': object, #ignore
+    '<file>': schema.Or(None, schema.And(os.path.exists,
+      error='File to import does not exist')),
     'list': object, #ignore
+    'export': object, #ignore
+    '--format': schema.Or(None, 'csv', 'jsonl', 'parquet',
+      error='Export format should be csv, jsonl or parquet'),
+    '--output': object, #ignore
     'userlist': object, #ignore
     'subscribe': object, #ignore
     'unsubscribe': object, #ignore
@@ -135,6 +217,14 @@ def main(argv=None):
     'report': object, #ignore
     'askmenu': object, #ignore
     'call': object, #ignore
+    'refresh': object, #ignore
+    'worker': object, #ignore
+    'outbox': object, #ignore
+    'serve': object, #ignore
+    'jobs': object, #ignore
+    'api': object, #ignore
+    'daemon': object, #ignore
+    '--socket': object, #ignore
     '<date>': schema.Use(validate_date),
     '<range>': schema.Use(validate_range),
     '<menu>': schema.Or(None, schema.Use(validate_menu)),
@@ -151,21 +241,37 @@ def main(argv=None):
     '--dry-run': object, #ignore
     '--force': object, #ignore
     '--verbose': object, #ignore
+    '--queue': object, #ignore
+    '--once': object, #ignore
+    '--concurrency': schema.And(schema.Use(int), lambda n: n > 0),
+    '--attempts': schema.And(schema.Use(int), lambda n: n > 0),
+    '--backoff': schema.And(schema.Use(float), lambda n: n >= 0),
+    '--poll': schema.And(schema.Use(float), lambda n: n > 0),
+    '--retry': object, #ignore
+    '--personal': object, #ignore
+    '--host': object, #ignore
+    '--port': schema.And(schema.Use(int), lambda n: 0 <= n < 65536),
+    '--config': schema.Or(None, schema.And(os.path.exists,
+      error='Configuration file does not exist')),
     })
 
   if arguments['--verbose'] == 1: logging.getLogger().setLevel(logging.INFO)
   if arguments['--verbose'] >  1: logging.getLogger().setLevel(logging.DEBUG)
+  if arguments['--verbose'] >  2: #profiles, see the.cook.instrument
+    import atexit
+    from ..instrument import enable, report
+    enable()
+    atexit.register(report)
 
   arguments = s.validate(arguments)
 
   if arguments['--dbfile'] is None:
-    from pkg_resources import resource_filename
-    from .. import data
-    arguments['--dbfile'] = resource_filename(data.__name__, 'thecook.sql3')
+    from ..data import dbfile
+    arguments['--dbfile'] = dbfile()
 
-  from ..models import create, connect
-  from ..menu import add, remove, lunch_list, user_list, \
-      subscribe, unsubscribe, get_current_user
+  from ..models import create, connect, format_datetime
+  from ..menu import add, remove, iter_lunch_list, iter_user_list, \
+      subscribe, unsubscribe, get_current_user, refresh_users
   from ..sendmail import remind, report, call, ask_menu
 
   if arguments['init']:
@@ -189,17 +295,49 @@ def main(argv=None):
       print("Removed lunch `%s (%s)' from `%s'" % \
           (lunch.menu_french, lunch.menu_english,
             lunch.date.strftime("%A, %d.%m.%y")))
+  elif arguments['import']:
+    from ..importer import read
+    from ..menu import add_many
+    try:
+      menus = read(arguments['<file>'])
+    except ValueError as e:
+      logging.error("Cannot import `%s': %s" % (arguments['<file>'], e))
+      return 1
+    session = connect(arguments['--dbfile'])
+    added, conflicts = add_many(session, menus, arguments['--dry-run'])
+    for where, date, reason in conflicts:
+      logging.error("Not importing lunch at `%s' (%s): %s" % \
+          (date.strftime('%d.%m.%y'), where, reason))
+    print("%s %d lunch(es), %d conflict(s)" % \
+        ('Would import' if arguments['--dry-run'] else 'Imported', len(added),
+          len(conflicts)))
+    if conflicts: return 1
   elif arguments['list']:
     session = connect(arguments['--dbfile'])
-    to_print = lunch_list(session,
+    to_print = iter_lunch_list(session,
         arguments['<range>'][0], arguments['<range>'][1], arguments['--long'])
     for k in to_print: print(k)
+  elif arguments['export']:
+    from ..models import connect_readonly
+    from ..export import export, guess_format
+    output = arguments['--output']
+    format = arguments['--format'] or \
+        (output and guess_format(output)) or 'csv'
+    try:
+      with connect_readonly(arguments['--dbfile']).connect() as connection:
+        count = export(connection, output or sys.stdout, format,
+            arguments['<range>'][0], arguments['<range>'][1],
+            arguments['<username>'])
+    except ValueError as e:
+      logging.error("Cannot export: %s" % e)
+      return 1
+    logging.info("Exported %d row(s)" % count)
   elif arguments['userlist']:
     session = connect(arguments['--dbfile'])
     if not arguments['<username>']:
       user = get_current_user(session)
       arguments['<username>'] = user.name
-    to_print = user_list(session, arguments['<username>'],
+    to_print = iter_user_list(session, arguments['<username>'],
         arguments['<range>'][0], arguments['<range>'][1], arguments['--long'])
     for k in to_print: print(k)
   elif arguments['subscribe']:
@@ -210,18 +348,61 @@ def main(argv=None):
     unsubscribe(session, arguments['<date>'])
   elif arguments['call']:
     session = connect(arguments['--dbfile'])
-    call(session, arguments['<email>'], arguments['--date'])
+    call(session, arguments['<email>'], arguments['--date'],
+        queue=arguments['--queue'])
   elif arguments['report']:
     session = connect(arguments['--dbfile'])
     report(session, arguments['<email>'], arguments['--force'],
-        arguments['--cc'])
+        arguments['--cc'], queue=arguments['--queue'])
   elif arguments['remind']:
     session = connect(arguments['--dbfile'])
-    remind(session, arguments['--dry-run'], arguments['--force'])
+    remind(session, arguments['--dry-run'], arguments['--force'],
+        queue=arguments['--queue'], personal=arguments['--personal'],
+        workers=arguments['--concurrency'])
   elif arguments['askmenu']:
     session = connect(arguments['--dbfile'])
     ask_menu(session, arguments['<email>'], arguments['--dry-run'],
-        arguments['--cc'])
+        arguments['--cc'], queue=arguments['--queue'])
+  elif arguments['refresh']:
+    session = connect(arguments['--dbfile'])
+    users = refresh_users(session, arguments['--force'])
+    print("Refreshed %d user(s)" % len(users))
+  elif arguments['worker']:
+    from ..outbox import run
+    from ..sendmail import get_transport
+    session = connect(arguments['--dbfile'])
+    run(session, get_transport(), arguments['--concurrency'],
+        arguments['--attempts'], arguments['--backoff'], arguments['--once'],
+        arguments['--poll'])
+  elif arguments['outbox']:
+    from ..outbox import retry_dead
+    from ..models import Message
+    session = connect(arguments['--dbfile'])
+    if arguments['--retry']:
+      print("Re-scheduled %d message(s)" % len(retry_dead(session)))
+    messages = session.query(Message).filter(Message.status != Message.SENT).order_by(Message.id)
+    for k in messages:
+      print("[%d] %s, %s, %d attempt(s), due `%s': %s" % (k.id, k.status,
+        k.subject, k.attempts, format_datetime(k.due), k.error or 'no errors'))
+  elif arguments['serve']:
+    from ..scheduler import Scheduler, load_config
+    session = connect(arguments['--dbfile'])
+    Scheduler(session, load_config(arguments['--config'])).serve()
+  elif arguments['jobs']:
+    from ..scheduler import runs
+    session = connect(arguments['--dbfile'])
+    for k in runs(session):
+      duration = k.duration()
+      print("[%s] %s, %s%s%s" % (format_datetime(k.slot), k.job, k.status,
+        '' if duration is None else ' in %.3f seconds' % duration,
+        ': %s' % k.error if k.error else ''))
+  elif arguments['api']:
+    from ..api import Server
+    Server(arguments['--dbfile'], arguments['--concurrency']).serve(
+        arguments['--host'], arguments['--port'])
+  elif arguments['daemon']:
+    from ..daemon import Daemon
+    Daemon(arguments['--dbfile'], arguments['--socket']).serve()
   else:
     raise NotImplementedError("unknown command")
 
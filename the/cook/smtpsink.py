@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sun 18 Oct 2026 23:12:05 CEST
+
+"""A local SMTP server keeping messages in memory, for tests and benchmarks"""
+
+import time
+import threading
+from six.moves import socketserver
+
+from .sendmail import Transport
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+  """A local SMTP server that accepts and keeps all messages
+
+  If ``drop_after`` is set, connections are dropped after that many messages.
+  If ``delay`` is set, each message is only accepted after that many seconds,
+  like on a busy server. Recipients named ``nobody`` are refused.
+  """
+
+  allow_reuse_address = True
+  daemon_threads = True
+
+  def __init__(self, drop_after=None, delay=0):
+
+    socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0),
+        SMTPHandler)
+    self.drop_after = drop_after
+    self.delay = delay
+    self.messages = []
+    self.connections = 0
+    self.lock = threading.Lock()
+    self.thread = threading.Thread(target=self.serve_forever)
+    self.thread.daemon = True
+
+  @property
+  def port(self):
+
+    return self.server_address[1]
+
+  def transport(self, **kwargs):
+
+    return Transport('127.0.0.1', self.port, 'plain', **kwargs)
+
+  def __enter__(self):
+
+    self.thread.start()
+    return self
+
+  def __exit__(self, *exc):
+
+    self.shutdown()
+    self.server_close()
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+
+  def reply(self, line):
+
+    self.wfile.write(line.encode('ascii') + b'\r\n')
+
+  def handle(self):
+
+    with self.server.lock: self.server.connections += 1
+    received = 0
+    sender, recipients = None, []
+
+    self.reply('220 localhost SMTP sink')
+    while True:
+      line = self.rfile.readline()
+      if not line: return
+      command = line.decode('ascii', 'replace').strip()
+      verb = command.split(' ', 1)[0].upper()
+
+      if verb in ('EHLO', 'HELO'):
+        self.reply('250 localhost')
+      elif verb == 'MAIL':
+        sender, recipients = command[10:], []
+        self.reply('250 OK')
+      elif verb == 'RCPT':
+        if command[8:].startswith('<nobody@'):
+          self.reply('550 No such user')
+          continue
+        recipients.append(command[8:])
+        self.reply('250 OK')
+      elif verb == 'DATA':
+        self.reply('354 End data with <CR><LF>.<CR><LF>')
+        data = []
+        while True:
+          line = self.rfile.readline()
+          if not line or line in (b'.\r\n', b'.\n'): break
+          data.append(line)
+        if self.server.delay: time.sleep(self.server.delay)
+        with self.server.lock:
+          self.server.messages.append((sender, recipients, b''.join(data)))
+        self.reply('250 OK')
+        received += 1
+        if self.server.drop_after and received >= self.server.drop_after:
+          return
+      elif verb == 'QUIT':
+        self.reply('221 Bye')
+        return
+      else: #RSET, NOOP and others
+        self.reply('250 OK')
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sun 18 Oct 2026 09:12:40 CEST
+
+"""Templates for the e-mails sent by the cook
+
+Templates are text files named ``<name>.<language>.txt`` in this directory,
+using the :py:class:`string.Template` syntax (``$variable`` or
+``${variable}``). Each template is read and compiled only once, on first use.
+"""
+
+import os
+import io
+import string
+import six
+
+LANGUAGES = ('en', 'fr')
+
+_compiled = {}
+
+def path(name, language='en'):
+  """Returns the path to a template file"""
+
+  return os.path.join(os.path.dirname(os.path.abspath(__file__)),
+      '%s.%s.txt' % (name, language))
+
+def compile_template(text):
+  """Compiles the template text into a function rendering a context dict
+
+  The text is parsed once, into literal chunks and variable names, so that
+  rendering only consists of joining strings.
+  """
+
+  parts = []
+  position = 0
+  for match in string.Template.pattern.finditer(text):
+    literal = text[position:match.start()]
+    variable = match.group('named') or match.group('braced')
+    if match.group('escaped') is not None:
+      parts.append((literal + '$', None))
+    elif variable is not None:
+      parts.append((literal, variable))
+    else:
+      raise ValueError("Invalid placeholder at position %d of template" % \
+          match.start())
+    position = match.end()
+  tail = text[position:]
+
+  def render(context):
+    output = []
+    for literal, variable in parts:
+      output.append(literal)
+      if variable is not None: output.append(six.text_type(context[variable]))
+    output.append(tail)
+    return ''.join(output)
+
+  return render
+
+def get(name, language='en'):
+  """Returns the compiled template, loading it if required"""
+
+  key = (name, language)
+  if key not in _compiled:
+    if language not in LANGUAGES:
+      raise ValueError("Unsupported template language `%s' (choose from %s)" % \
+          (language, ', '.join(LANGUAGES)))
+    with io.open(path(name, language), 'rt', encoding='utf-8') as f:
+      text = f.read()
+    if text.endswith('\n'): text = text[:-1]
+    _compiled[key] = compile_template(text)
+  return _compiled[key]
+
+def render(name, language='en', context={}, **kwargs):
+  """Renders a template, returns a list of lines w/o newlines
+
+  Variables are taken from ``context`` and from the keyword arguments.
+  """
+
+  if kwargs:
+    context = dict(context)
+    context.update(kwargs)
+  return get(name, language)(context).split('\n')
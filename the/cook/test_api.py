@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sun 18 Oct 2026 15:40:13 CEST
+
+import os
+import json
+import shutil
+import tempfile
+import nose.tools
+
+from .api import Server
+from .scripts.loadtest import setup_database, start_server, load
+
+tmpdir = None
+server = None
+dates = None
+
+def setup_server():
+
+  global tmpdir, server, dates
+  tmpdir = tempfile.mkdtemp()
+  dbfile = os.path.join(tmpdir, 'api.sql3')
+  dates = setup_database(dbfile)
+  server = Server(dbfile, 2)
+
+def teardown_server():
+
+  server.engine.dispose()
+  shutil.rmtree(tmpdir)
+
+def me():
+
+  import pwd
+  return pwd.getpwuid(os.getuid()).pw_name
+
+def call(method, path, body=None, caller=None):
+
+  return server.application(method, path,
+      json.dumps(body).encode('utf-8') if body is not None else b'',
+      caller or me())
+
+@nose.tools.with_setup(setup_server, teardown_server)
+def test_subscribe():
+
+  user = me()
+  status, answer = call('POST', '/subscribe',
+      {'user': user, 'date': dates[0], 'persons': 2})
+  nose.tools.eq_(status, 200)
+  nose.tools.eq_(answer['subscription']['persons'], 2)
+
+  status, answer = call('GET', '/lunches?long=1')
+  nose.tools.eq_(status, 200)
+  nose.tools.eq_(len(answer['lunches']), len(dates))
+  nose.tools.eq_(answer['lunches'][0]['total'], 2)
+  nose.tools.eq_(answer['lunches'][0]['subscriptions'][0]['user'], user)
+
+  status, answer = call('GET', '/users/%s' % user)
+  nose.tools.eq_(status, 200)
+  nose.tools.eq_(len(answer['subscriptions']), 1)
+
+  status, answer = call('POST', '/unsubscribe', {'user': user,
+    'date': dates[0]})
+  nose.tools.eq_(status, 200)
+  status, answer = call('POST', '/unsubscribe', {'user': user,
+    'date': dates[0]})
+  nose.tools.eq_(status, 404)
+
+@nose.tools.with_setup(setup_server, teardown_server)
+def test_errors():
+
+  nose.tools.eq_(call('POST', '/subscribe', {'user': 'unexisting-user'},
+    'unexisting-user')[0], 400)
+  nose.tools.eq_(call('POST', '/subscribe', {'date': '01.01.70'})[0], 404)
+  nose.tools.eq_(call('POST', '/subscribe', {'date': 20141028})[0], 400)
+  nose.tools.eq_(call('POST', '/subscribe', {'date': ['next']})[0], 400)
+  nose.tools.eq_(call('POST', '/subscribe', {'user': 3})[0], 400)
+  nose.tools.eq_(call('POST', '/subscribe', {'persons': True})[0], 400)
+  nose.tools.eq_(call('POST', '/unsubscribe', {'date': {}})[0], 400)
+  nose.tools.eq_(call('GET', '/subscribe')[0], 405)
+  nose.tools.eq_(call('GET', '/menus')[0], 404)
+  nose.tools.eq_(call('GET', '/lunches?range=tomorrow')[0], 400)
+  nose.tools.eq_(server.application('POST', '/subscribe', b'{', me())[0],
+      400)
+
+@nose.tools.with_setup(setup_server, teardown_server)
+def test_other_users():
+
+  # clients may only act for themselves
+  nose.tools.eq_(call('POST', '/subscribe', {'user': 'someone-else',
+    'date': dates[0]})[0], 403)
+  nose.tools.eq_(call('POST', '/unsubscribe', {'user': 'someone-else',
+    'date': dates[0]})[0], 403)
+  nose.tools.eq_(server.application('POST', '/subscribe',
+    json.dumps({'date': dates[0]}).encode('utf-8'))[0], 403) #unknown client
+
+  # listings are open to all
+  nose.tools.eq_(call('GET', '/lunches', caller='someone-else')[0], 200)
+
+def test_loopback_only():
+
+  import asyncio
+  from .api import is_loopback
+  assert is_loopback('127.0.0.1')
+  assert is_loopback('localhost')
+  assert not is_loopback('0.0.0.0')
+
+  tmpdir = tempfile.mkdtemp()
+  try:
+    server = Server(os.path.join(tmpdir, 'api.sql3'))
+    nose.tools.assert_raises(ValueError, asyncio.run,
+        server.start('0.0.0.0', 0))
+    server.engine.dispose()
+  finally:
+    shutil.rmtree(tmpdir)
+
+def test_load():
+
+  tmpdir = tempfile.mkdtemp()
+  try:
+    dbfile = os.path.join(tmpdir, 'load.sql3')
+    dates = setup_database(dbfile)
+    port = start_server(dbfile, 4)
+    result = load('127.0.0.1', port, dates, clients=8, duration=1)
+    nose.tools.eq_(result['errors'], 0)
+    assert result['requests'] >= 8, result['requests'] #all clients answered
+    nose.tools.eq_(len(result['latencies']), result['requests'])
+
+    # clients are identified by the owner of their connection
+    import asyncio
+    from .scripts.loadtest import request
+    async def subscribe(body):
+      reader, writer = await asyncio.open_connection('127.0.0.1', port)
+      try:
+        return await request(reader, writer, 'POST', '/subscribe', body)
+      finally:
+        writer.close()
+    status, answer = asyncio.run(subscribe({'date': dates[-1]}))
+    nose.tools.eq_(status, 200)
+    nose.tools.eq_(answer['subscription']['user'], me())
+    status, answer = asyncio.run(subscribe({'date': dates[-1],
+      'user': 'someone-else'}))
+    nose.tools.eq_(status, 403)
+  finally:
+    shutil.rmtree(tmpdir)
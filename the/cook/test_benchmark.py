@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sun 18 Oct 2026 18:48:21 CEST
+
+import os
+import shutil
+import tempfile
+import nose.tools
+
+from .scripts.benchmark import seed, run, compare
+from .instrument import count_statements
+
+def test_run():
+
+  tmpdir = tempfile.mkdtemp()
+  try:
+    dbfile = os.path.join(tmpdir, 'benchmark.sql3')
+    sizes = seed(dbfile, years=1, users=20, subscriptions=200)
+    nose.tools.eq_(sizes['users'], 20)
+    nose.tools.eq_(sizes['subscriptions'], 200)
+
+    from .models import connect
+    from .menu import lunch_list
+    import datetime
+    session = connect(dbfile)
+    retval, count = count_statements(lunch_list, session, datetime.date.min,
+        datetime.date.max, True)
+    assert count <= 3, count
+    nose.tools.eq_(len(retval), sizes['lunches'] + 200)
+    session.close()
+
+    results = run(dbfile, repeat=1)
+    assert 'lunch_list_script' in results
+    assert 'lunch_version_script' in results
+    nose.tools.eq_(sorted(k for k in results if k.startswith('remind_')),
+        ['remind_personal_1', 'remind_personal_8'])
+    assert results['remind_personal_8']['messages_per_second'] > 0
+    nose.tools.eq_(results['subscribe']['repeat'], 1)
+    nose.tools.eq_(results['lunch_list']['statements'], 1)
+    nose.tools.eq_(compare(results, results), [])
+  finally:
+    shutil.rmtree(tmpdir)
+
+def test_compare():
+
+  def result(seconds, statements):
+    return {'seconds': {'median': seconds}, 'statements': statements}
+
+  baseline = {'a': result(1.0, 2), 'b': result(1.0, None), 'c': result(1, 1)}
+  nose.tools.eq_(compare({'a': result(1.4, 2), 'd': result(10, 10)},
+    baseline), [])
+  regressions = compare({'a': result(1.6, 3), 'b': result(1.0, 5)}, baseline)
+  nose.tools.eq_(len(regressions), 2)
+  assert 'slower' in regressions[0]
+  assert 'more SQL statements' in regressions[1]
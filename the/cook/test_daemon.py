@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sun 18 Oct 2026 16:58:30 CEST
+
+import os
+import shutil
+import getpass
+import datetime
+import tempfile
+import threading
+import nose.tools
+
+from .daemon import Daemon, request, answer
+from .models import connect
+from .menu import add
+
+tmpdir = None
+dbfile = None
+path = None
+in3days = datetime.date.today() + datetime.timedelta(days=3)
+
+def setup_daemon():
+
+  global tmpdir, dbfile, path
+  tmpdir = tempfile.mkdtemp()
+  dbfile = os.path.join(tmpdir, 'daemon.sql3')
+  path = os.path.join(tmpdir, 'daemon.sock')
+  add(connect(dbfile), in3days, 'Risotto aux champignons', 'Mushroom risotto')
+
+  import asyncio
+  daemon = Daemon(dbfile, path)
+  started = threading.Event()
+
+  def run():
+    async def main():
+      server = await daemon.start()
+      started.set()
+      await server.serve_forever()
+    asyncio.run(main())
+
+  thread = threading.Thread(target=run)
+  thread.daemon = True
+  thread.start()
+  started.wait()
+
+def teardown_daemon():
+
+  shutil.rmtree(tmpdir)
+
+@nose.tools.with_setup(setup_daemon, teardown_daemon)
+def test_commands():
+
+  date = in3days.strftime('%d.%m.%y')
+  user = getpass.getuser()
+
+  output = request('add', date, 2, path=path)
+  nose.tools.eq_(len(output), 1)
+  assert output[0].startswith("User `%s' successfully subscribed" % user)
+
+  # answers are the same as when accessing the database directly
+  session = connect(dbfile)
+  for command in ('list', 'mine'):
+    nose.tools.eq_(request(command, path=path),
+        answer(command, session=session))
+  session.close()
+  assert '2 person(s)' in request('list', path=path)[1]
+
+  output = request('remove', date, path=path)
+  assert output[0].startswith("User `%s' successfully unsubscribed" % user)
+  nose.tools.eq_(request('remove', date, path=path), [])
+  nose.tools.eq_(request('mine', path=path),
+      ["User `%s' is not registered to any upcoming lunches" % user])
+
+@nose.tools.with_setup(setup_daemon, teardown_daemon)
+def test_lunch_script():
+
+  from .scripts.lunch import main
+
+  os.environ['THECOOK_SOCKET'] = path
+  try:
+    nose.tools.eq_(main(['add', in3days.strftime('%d.%m.%y')]), 0)
+    nose.tools.eq_(main(['list']), 0)
+  finally:
+    del os.environ['THECOOK_SOCKET']
+
+  session = connect(dbfile)
+  assert answer('mine', session=session)[1].startswith('  - [')
+
+@nose.tools.with_setup(setup_daemon, teardown_daemon)
+def test_environment_user():
+
+  # without the daemon, commands act for the real user, whatever $USER says
+  import pwd
+  real = pwd.getpwuid(os.getuid()).pw_name
+  saved = os.environ.get('USER')
+  os.environ['USER'] = 'nobody' if real != 'nobody' else 'root'
+  try:
+    session = connect(dbfile)
+    output = answer('add', in3days, 1, session=session)
+    assert output[0].startswith("User `%s' successfully" % real), output
+    nose.tools.eq_(answer('mine', session=session)[0],
+        "User `%s' subscribed to the following lunches:" % real)
+    session.close()
+  finally:
+    if saved is None: del os.environ['USER']
+    else: os.environ['USER'] = saved
+
+def test_no_daemon():
+
+  tmpdir = tempfile.mkdtemp()
+  try:
+    path = os.path.join(tmpdir, 'daemon.sock')
+    nose.tools.eq_(request('list', path=path), None)
+
+    # a left-over socket file, with no daemon behind
+    open(path, 'w').close()
+    nose.tools.eq_(request('list', path=path), None)
+  finally:
+    shutil.rmtree(tmpdir)
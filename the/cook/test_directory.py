@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sat 17 Oct 2026 22:31:40 CEST
+
+import os
+import pwd
+import time
+import getpass
+import tempfile
+import nose.tools
+
+from .directory import Directory, UNKNOWN_FULLNAME
+
+def test_lookup():
+
+  directory = Directory()
+  user = getpass.getuser()
+  nose.tools.eq_(directory.uid(user), os.getuid())
+  nose.tools.eq_(directory.fullname(user), pwd.getpwuid(os.getuid()).pw_gecos)
+  assert directory.phone(user)
+
+def test_unknown():
+
+  directory = Directory()
+  nose.tools.eq_(directory.uid('unexisting-user'), None)
+  nose.tools.eq_(directory.fullname('unexisting-user'), UNKNOWN_FULLNAME)
+
+def test_batch():
+
+  names = [k.pw_name for k in pwd.getpwall()][:5] + ['unexisting-user']
+  directory = Directory()
+  entries = directory.resolve(names)
+  nose.tools.eq_(sorted(entries), sorted(names))
+  for name in names[:-1]:
+    nose.tools.eq_(entries[name]['uid'], pwd.getpwnam(name).pw_uid)
+
+  # second time around, everything comes from the cache
+  before = dict((k, v['time']) for k, v in directory.entries.items())
+  directory.resolve(names)
+  after = dict((k, v['time']) for k, v in directory.entries.items())
+  nose.tools.eq_(before, after)
+
+def test_persistent():
+
+  tmpdir = tempfile.mkdtemp()
+  cachefile = os.path.join(tmpdir, 'users.json')
+  user = getpass.getuser()
+
+  try:
+    directory = Directory(cachefile)
+    entry = directory.lookup(user)
+    assert os.path.exists(cachefile)
+
+    # another process would re-use the entries
+    directory = Directory(cachefile)
+    assert directory.fresh(user)
+    nose.tools.eq_(directory.lookup(user), entry)
+
+    # unless they have expired
+    directory = Directory(cachefile, ttl=0)
+    assert not directory.fresh(user)
+    time.sleep(0.01)
+    assert directory.lookup(user)['time'] > entry['time']
+
+  finally:
+    if os.path.exists(cachefile): os.unlink(cachefile)
+    os.rmdir(tmpdir)
+
+def test_phones():
+
+  from . import directory as module
+  from .instrument import enable, disable
+
+  tmpdir = tempfile.mkdtemp()
+  tel = os.path.join(tmpdir, 'tel')
+  with open(tel, 'wt') as f:
+    f.write('#!/bin/sh\nprintf "Name Office Phone\\n%s 1 %d\\n" "$1" ${#1}\n')
+  os.chmod(tel, 0o755)
+
+  names = [k.pw_name for k in pwd.getpwall()][:3]
+  original, module.TEL = module.TEL, tel
+  profiler = enable()
+  try:
+    directory = Directory()
+
+    # identifiers and full names do not need the phone directory
+    nose.tools.eq_(directory.uid(names[0]), pwd.getpwnam(names[0]).pw_uid)
+    directory.fullname(names[1])
+    nose.tools.eq_(profiler.totals('subprocess')[0], 0)
+
+    # phone numbers of a batch are looked up together, then cached
+    entries = directory.resolve(names)
+    for name in names:
+      nose.tools.eq_(entries[name]['phone'],
+          module.PHONE_PREFIX + str(len(name)))
+    nose.tools.eq_(profiler.totals('subprocess')[0], 1)
+    directory.phone(names[2])
+    nose.tools.eq_(profiler.totals('subprocess')[0], 1)
+
+  finally:
+    disable()
+    module.TEL = original
+    os.unlink(tel)
+    os.rmdir(tmpdir)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sun 18 Oct 2026 21:32:50 CEST
+
+import json
+import datetime
+import nose.tools
+from six import StringIO
+
+from .models import connect, User, Lunch, Subscription
+from .export import rows, export, guess_format, COLUMNS
+
+def setup_database():
+
+  session = connect(None)
+  session.execute(User.__table__.insert(), [
+    {'id': 1, 'name': 'jdoe', 'fullname': 'John Doe',
+      'email': 'jdoe@example.com'},
+    {'id': 2, 'name': 'ksmith', 'fullname': 'Kate Smith',
+      'email': 'ksmith@example.com'},
+    ])
+  session.execute(Lunch.__table__.insert(), [
+    {'id': 1, 'date': datetime.date(2014, 4, 28), 'menu_french': 'Risotto',
+      'menu_english': 'Risotto', 'user_id': 1},
+    {'id': 2, 'date': datetime.date(2014, 4, 29), 'menu_french': 'Poulet',
+      'menu_english': 'Chicken', 'user_id': 1},
+    ])
+  session.execute(Subscription.__table__.insert(), [
+    {'lunch_id': 1, 'user_id': 1, 'persons': 2,
+      'date': datetime.datetime(2014, 4, 27, 10)},
+    {'lunch_id': 1, 'user_id': 2, 'persons': 1,
+      'date': datetime.datetime(2014, 4, 27, 11)},
+    ])
+  session.commit()
+  return session
+
+def test_rows():
+
+  session = setup_database()
+  data = list(rows(session.connection(), batch=1))
+  nose.tools.eq_(len(data), 3)
+  nose.tools.eq_(data[0], (datetime.date(2014, 4, 28), 'Risotto', 'Risotto',
+    'jdoe', 'John Doe', 'jdoe@example.com', 2,
+    datetime.datetime(2014, 4, 27, 10)))
+  nose.tools.eq_(data[2][:3], (datetime.date(2014, 4, 29), 'Poulet',
+    'Chicken'))
+  nose.tools.eq_(data[2][3:], (None,) * 5) #no subscriptions
+
+  data = list(rows(session.connection(), username='ksmith'))
+  nose.tools.eq_([k[3] for k in data], ['ksmith'])
+
+  data = list(rows(session.connection(), datetime.date(2014, 4, 29)))
+  nose.tools.eq_(len(data), 1)
+
+def test_formats():
+
+  session = setup_database()
+
+  stream = StringIO()
+  nose.tools.eq_(export(session.connection(), stream, 'csv'), 3)
+  lines = stream.getvalue().splitlines()
+  nose.tools.eq_(lines[0], ','.join(COLUMNS))
+  nose.tools.eq_(lines[3], '2014-04-29,Poulet,Chicken,,,,,')
+
+  stream = StringIO()
+  nose.tools.eq_(export(session.connection(), stream, 'jsonl'), 3)
+  entries = [json.loads(k) for k in stream.getvalue().splitlines()]
+  nose.tools.eq_(entries[1]['subscribed'], '2014-04-27T11:00:00')
+  nose.tools.eq_(entries[2]['persons'], None)
+
+  nose.tools.eq_(guess_format('history.JSONL'), 'jsonl')
+  nose.tools.eq_(guess_format('history.txt'), None)
+
+@nose.tools.raises(ValueError)
+def test_parquet_needs_file():
+
+  export(setup_database().connection(), StringIO(), 'parquet')
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sun 18 Oct 2026 20:41:27 CEST
+
+import datetime
+import nose.tools
+from six import StringIO
+
+from .importer import read_csv, read_json, read_ical
+from .models import connect, Lunch
+from .menu import add_many
+
+ICAL = """BEGIN:VCALENDAR
+VERSION:2.0
+BEGIN:VEVENT
+DTSTART;VALUE=DATE:20141027
+SUMMARY:Risotto au champignon\\, parmesan (Mushroom risotto
+ \\, parmesan)
+END:VEVENT
+BEGIN:VEVENT
+DTSTART:20141028T120000
+SUMMARY:Poulet rôti
+END:VEVENT
+END:VCALENDAR
+"""
+
+def test_formats():
+
+  entries = read_csv(StringIO('date,menu_french,menu_english\n'
+    '2014-10-27,Risotto,Mushroom risotto\n28.10.14,Poulet rôti,\n'))
+  nose.tools.eq_(entries, [
+    ('line 2', datetime.date(2014, 10, 27), 'Risotto', 'Mushroom risotto'),
+    ('line 3', datetime.date(2014, 10, 28), 'Poulet rôti', ''),
+    ])
+
+  entries = read_json(StringIO('{"27.10.14": "Risotto (Mushroom risotto)"}'))
+  nose.tools.eq_(entries, [
+    ('entry 1', datetime.date(2014, 10, 27), 'Risotto', 'Mushroom risotto'),
+    ])
+
+  entries = read_ical(StringIO(ICAL))
+  nose.tools.eq_(entries, [
+    ('event at line 3', datetime.date(2014, 10, 27),
+      'Risotto au champignon, parmesan', 'Mushroom risotto, parmesan'),
+    ('event at line 8', datetime.date(2014, 10, 28), 'Poulet rôti', ''),
+    ])
+
+@nose.tools.raises(ValueError)
+def test_invalid_date():
+
+  read_json(StringIO('[{"date": "next", "menu": "Risotto"}]'))
+
+@nose.tools.raises(ValueError)
+def test_missing_menu():
+
+  read_csv(StringIO('date,menu\n27.10.14,\n'))
+
+def test_add_many():
+
+  session = connect(None)
+  menus = read_csv(StringIO('date,menu\n27.10.14,Risotto\n'
+    '28.10.14,Poulet\n27.10.14,Pizza\n'))
+  added, conflicts = add_many(session, menus, dry_run=True)
+  nose.tools.eq_(len(added), 2)
+  nose.tools.eq_(session.query(Lunch).count(), 0)
+
+  added, conflicts = add_many(session, menus)
+  nose.tools.eq_([k[0] for k in added], ['line 2', 'line 3'])
+  nose.tools.eq_(conflicts, [('line 4', datetime.date(2014, 10, 27),
+    'also given at line 2')])
+  nose.tools.eq_(session.query(Lunch).count(), 2)
+
+  added, conflicts = add_many(session, menus[1:])
+  nose.tools.eq_(added, [])
+  nose.tools.eq_([k[2] for k in conflicts], ["there is already a lunch " \
+      "`Poulet'", "there is already a lunch `Risotto'"])
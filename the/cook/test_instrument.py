@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sun 18 Oct 2026 19:52:09 CEST
+
+import nose.tools
+from six import StringIO
+
+from . import instrument
+from .models import connect, Lunch
+from .directory import backquote
+
+def teardown_profiler():
+
+  instrument.disable()
+
+@nose.tools.with_setup(teardown=teardown_profiler)
+def test_profile():
+
+  session = connect(None)
+
+  profiler = instrument.enable()
+  for k in range(2): session.query(Lunch).all()
+  backquote(['true'])
+
+  count, seconds = profiler.totals('sql')
+  nose.tools.eq_(count, 2)
+  (statement, site), count, seconds = profiler.hottest('sql')[0]
+  assert statement.startswith('SELECT lunch.id'), statement
+  assert site.startswith('test_instrument.py:'), site
+  nose.tools.eq_(count, 2)
+  nose.tools.eq_(profiler.totals('subprocess')[0], 1)
+
+  stream = StringIO()
+  instrument.report(stream)
+  lines = stream.getvalue().split('\n')
+  assert '2 SQL statement(s)' in lines[1], lines[1]
+  assert '1 process(es) spawned' in stream.getvalue()
+
+  instrument.disable()
+  session.query(Lunch).all()
+  nose.tools.eq_(instrument.summary(), [])
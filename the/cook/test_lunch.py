@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sun 18 Oct 2026 00:02:44 CEST
+
+import sys
+import subprocess
+import nose.tools
+
+# modules that should not be loaded unless a subcommand needs them
+HEAVY = ('sqlalchemy', 'pkg_resources')
+
+def importtime(code):
+  """Runs ``code`` with ``python -X importtime``, returns imported modules
+
+  Returns a dictionary mapping module names to their cumulative import time,
+  in microseconds.
+  """
+
+  output = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', code],
+      stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()[1]
+
+  retval = {}
+  for line in output.decode('utf-8').split('\n'):
+    if not line.startswith('import time:') or 'cumulative' in line: continue
+    self_time, cumulative, name = line[len('import time:'):].split('|')
+    retval[name.strip()] = int(cumulative)
+  return retval
+
+def check_light(code):
+
+  modules = importtime(code)
+  assert 'the.cook.scripts.lunch' in modules, modules
+  heavy = [k for k in modules if k.split('.')[0] in HEAVY]
+  nose.tools.eq_(heavy, [])
+  return modules
+
+def test_import():
+
+  # with SQLAlchemy and pkg_resources, this used to take about half a second,
+  # see the lunch_version_script benchmark for timings
+  check_light('import the.cook.scripts.lunch')
+
+def test_help():
+
+  check_light('from the.cook.scripts.lunch import main\n'
+      'try: main(["--help"])\n'
+      'except SystemExit: pass')
+
+def test_version():
+
+  check_light('from the.cook.scripts.lunch import main\n'
+      'try: main(["--version"])\n'
+      'except SystemExit: pass')
+
+def test_validate():
+
+  # parsing dates should not require the database layer
+  check_light('from the.cook.scripts.lunch import main\n'
+      'import the.cook.schema\n'
+      'the.cook.schema.validate_date("tomorrow")')
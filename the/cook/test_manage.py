@@ -12,6 +12,11 @@ today = str(datetime.date.today().day)
 tomorrow = (datetime.date.today() + datetime.timedelta(days=1)).strftime('%d.%m.%y')
 in3days = (datetime.date.today() + datetime.timedelta(days=3)).strftime('%d.%m.%y')
 
+def teardown_module():
+
+  import shutil
+  shutil.rmtree(dbfile.name + '.reports', ignore_errors=True) #see report.py
+
 def test_init():
 
   cmdline = (
@@ -99,6 +104,25 @@ def test_call():
       )
   assert main(cmdline) == 0
 
+def test_call_queued():
+
+  cmdline = (
+      '--dbfile=%s' % dbfile.name,
+      'call',
+      '--queue',
+      'misc@example.com',
+      )
+  assert main(cmdline) == 0
+
+def test_outbox():
+
+  cmdline = (
+      '--dbfile=%s' % dbfile.name,
+      'outbox',
+      '--retry',
+      )
+  assert main(cmdline) == 0
+
 def test_report():
 
   cmdline = (
@@ -116,6 +140,17 @@ def test_remind():
       )
   assert main(cmdline) == 0
 
+def test_remind_personal():
+
+  cmdline = (
+      '--dbfile=%s' % dbfile.name,
+      'remind',
+      '--dry-run',
+      '--force',
+      '--personal',
+      )
+  assert main(cmdline) == 0
+
 def test_remove():
 
   cmdline = (
@@ -160,6 +195,15 @@ def test_userlist():
       )
   assert main(cmdline) == 0
 
+def test_refresh():
+
+  cmdline = (
+      '--dbfile=%s' % dbfile.name,
+      'refresh',
+      '--force',
+      )
+  assert main(cmdline) == 0
+
 def test_remind_fails():
 
   cmdline = (
@@ -184,3 +228,65 @@ def test_remove_in3days():
       in3days,
       )
   assert main(cmdline) == 0
+
+def test_jobs():
+
+  cmdline = (
+      '--dbfile=%s' % dbfile.name,
+      'jobs',
+      )
+  assert main(cmdline) == 0
+
+def test_import():
+
+  week = [datetime.date.today() + datetime.timedelta(days=40+k) \
+      for k in range(5)]
+  tmpfile = tempfile.NamedTemporaryFile(suffix='.csv', mode='wt')
+  tmpfile.write('date,menu\n')
+  for k in week:
+    tmpfile.write('%s,Risotto au champignon (Mushroom risotto)\n' % \
+        k.strftime('%d.%m.%y'))
+  tmpfile.flush()
+
+  cmdline = (
+      '--dbfile=%s' % dbfile.name,
+      'import',
+      tmpfile.name,
+      )
+  assert main(cmdline) == 0
+  assert main(cmdline) == 1 #all conflicts, now
+
+def test_import_invalid():
+
+  tmpfile = tempfile.NamedTemporaryFile(suffix='.csv', mode='wt')
+  tmpfile.write('date,menu\n')
+  tmpfile.write('someday,Risotto au champignon (Mushroom risotto)\n')
+  tmpfile.flush()
+
+  cmdline = (
+      '--dbfile=%s' % dbfile.name,
+      'import',
+      tmpfile.name,
+      )
+  assert main(cmdline) == 1
+
+def test_export():
+
+  tmpfile = tempfile.NamedTemporaryFile(suffix='.jsonl')
+  cmdline = (
+      '--dbfile=%s' % dbfile.name,
+      'export',
+      '--output=%s' % tmpfile.name,
+      )
+  assert main(cmdline) == 0
+  assert open(tmpfile.name).read().count('\n') >= 5 #at least the import
+
+def test_export_invalid():
+
+  # Parquet needs an output file
+  cmdline = (
+      '--dbfile=%s' % dbfile.name,
+      'export',
+      '--format=parquet',
+      )
+  assert main(cmdline) == 1
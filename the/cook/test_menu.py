@@ -3,6 +3,7 @@
 # Andre Anjos <andre.anjos@idiap.ch>
 # Wed 30 Apr 2014 06:22:14 CEST
 
+import os
 import datetime
 import nose.tools
 from sqlalchemy import create_engine
@@ -10,8 +11,12 @@ from sqlalchemy.orm import sessionmaker
 import six
 
 from .menu import add, remove, lunches_in_range, subscribe, unsubscribe, \
-    get_current_user, lunch_at_date, subscriptions_in_range
-from .models import connect, Base, User, Lunch, Subscription
+    get_current_user, current_user, lunch_at_date, subscriptions_in_range, \
+    lunches_with_totals, lunch_list, user_list, with_profile, next_lunch, \
+    refresh_users, next_subscribeable_lunch, lunch_list_readonly, \
+    user_list_readonly, iter_lunch_list, iter_user_list
+from .models import connect, connect_readonly, Base, User, Lunch, Subscription
+from .instrument import count_statements
 
 today = datetime.date.today()
 fivedaysago = datetime.date.today() - datetime.timedelta(days=5)
@@ -61,6 +66,44 @@ def teardown_database():
   global engine
   engine = None
 
+@nose.tools.with_setup(setup_database, teardown_database)
+def test_stored_user():
+
+  from . import instrument, directory
+
+  user = get_current_user(session)
+  directory.configure() #forgets cached answers
+  profiler = instrument.enable()
+  try:
+    # stored users are found without asking the system directory
+    nose.tools.eq_(current_user(session, user.name), (user, False))
+    nose.tools.eq_(profiler.totals('subprocess')[0], 0)
+  finally:
+    instrument.disable()
+
+@nose.tools.with_setup(setup_database, teardown_database)
+def test_stale_user():
+
+  from . import instrument, directory
+
+  user = get_current_user(session)
+  user.refreshed = datetime.datetime(2014, 4, 28)
+  user.fullname = six.u('Old Name')
+  session.commit()
+  directory.configure() #forgets cached answers
+  profiler = instrument.enable()
+  try:
+    # stale information is served as is, refreshed in the background
+    nose.tools.eq_(current_user(session, user.name), (user, False))
+    nose.tools.eq_(current_user(session), (user, False))
+    nose.tools.eq_(user.fullname, six.u('Old Name'))
+    nose.tools.eq_(profiler.totals('subprocess')[0], 0)
+  finally:
+    instrument.disable()
+
+  nose.tools.eq_(refresh_users(session), [user])
+  assert not user.is_stale(datetime.timedelta(days=1))
+
 @nose.tools.with_setup(setup_database, teardown_database)
 def test_add():
 
@@ -174,6 +217,32 @@ def test_list():
   assert lunches[1].date >= in3days
   assert lunches[1].date <= in7days
 
+@nose.tools.with_setup(setup_lunches_and_subs)
+def test_list_totals():
+
+  lunches = lunches_with_totals(session, yesterday, datetime.date.max).all()
+  nose.tools.eq_(len(lunches), 4)
+  for lunch, total in lunches:
+    nose.tools.eq_(total, lunch.total_subscribers())
+  nose.tools.eq_([k[1] for k in lunches], [0, 1, 5, 0])
+
+  # totals are restricted to the range, but still complete for each lunch
+  lunches = lunches_with_totals(session, in3days, in3days).all()
+  nose.tools.eq_(len(lunches), 1)
+  nose.tools.eq_(lunches[0][1], 5)
+
+  listing = lunch_list(session, today, datetime.date.max, False)
+  nose.tools.eq_(len(listing), 3)
+  assert listing[0].endswith(', 1 subscriber(s)')
+  assert listing[1].endswith(', 5 subscriber(s)')
+  assert listing[2].endswith(', 0 subscriber(s)')
+
+  user = get_current_user(session)
+  listing = user_list(session, user.name, today, datetime.date.max, False)
+  nose.tools.eq_(len(listing), 3)
+  assert listing[1].endswith(', 1 subscriber(s)')
+  assert listing[2].endswith(', 5 subscriber(s)')
+
 @nose.tools.with_setup(setup_lunches_and_subs)
 def test_remove():
 
@@ -193,9 +262,14 @@ def test_remove():
 @nose.tools.with_setup(setup_lunches_and_subs)
 def test_user_list():
 
+  import warnings
+
   user = get_current_user(session)
-  subs = subscriptions_in_range(session, user.name, today, datetime.date.max)
-  nose.tools.eq_(subs.count(), 2)
+  with warnings.catch_warnings():
+    warnings.simplefilter('error') #e.g. DISTINCT ON, unsupported on SQLite
+    subs = subscriptions_in_range(session, user.name, today,
+        datetime.date.max).all()
+  nose.tools.eq_(len(subs), 2)
   assert subs[0].lunch.date >= today
   assert subs[1].lunch.date >= today
 
@@ -212,3 +286,240 @@ def test_user_list():
 
   subs = subscriptions_in_range(session, 'bla', today, datetime.date.max)
   nose.tools.eq_(subs.count(), 0)
+
+def setup_many_subs():
+
+  setup_lunches()
+
+  # users are inserted directly, re-using existing system accounts
+  import pwd
+  global accounts
+  accounts = [k for k in pwd.getpwall() if k.pw_uid != os.getuid()][:5]
+  session.execute(User.__table__.insert(), [
+    {'id': k.pw_uid, 'name': k.pw_name} for k in accounts])
+  for lunch in lunches_in_range(session, today, datetime.date.max):
+    for k in accounts:
+      session.add(Subscription(lunch, session.query(User).get(k.pw_uid), 1))
+  session.commit()
+
+@nose.tools.with_setup(setup_many_subs)
+def test_listing_profile():
+
+  session.expire_all()
+  listing, statements = count_statements(lunch_list, session, today,
+      datetime.date.max, True)
+  nose.tools.eq_(len(listing), 3 + 3*len(accounts))
+  assert statements <= 3, statements
+
+  session.expire_all()
+  def walk():
+    lunch = next_lunch(session, 'listing')
+    return [s.user.name for s in lunch.subscriptions]
+  names, statements = count_statements(walk)
+  nose.tools.eq_(names, [k.pw_name for k in accounts])
+  assert statements <= 2, statements
+
+@nose.tools.with_setup(setup_many_subs)
+def test_streaming_listing():
+
+  # the same lines, whatever the batch size
+  session.expire_all()
+  listing = lunch_list(session, today, datetime.date.max, True)
+  lines = iter_lunch_list(session, today, datetime.date.max, True, batch=1)
+  nose.tools.eq_(next(lines), listing[0]) #before everything is read
+  nose.tools.eq_([listing[0]] + list(lines), listing)
+
+  username = accounts[0].pw_name
+  listing = user_list(session, username, today, datetime.date.max, True)
+  nose.tools.eq_(len(listing), 4)
+  nose.tools.eq_(list(iter_user_list(session, username, today,
+    datetime.date.max, True, batch=1)), listing)
+
+@nose.tools.raises(ValueError)
+@nose.tools.with_setup(setup_database, teardown_database)
+def test_unknown_profile():
+
+  with_profile(session.query(Lunch), Lunch, 'unknown')
+
+@nose.tools.with_setup(setup_many_subs)
+def test_refresh_users():
+
+  # users inserted directly have no stored information
+  users = refresh_users(session)
+  nose.tools.eq_(sorted(k.name for k in users),
+      sorted(k.pw_name for k in accounts))
+  for k in accounts:
+    user = session.query(User).get(k.pw_uid)
+    nose.tools.eq_(user.fullname, k.pw_gecos)
+    nose.tools.eq_(user.email, k.pw_name + '@idiap.ch')
+    assert user.phone
+    assert not user.is_stale(datetime.timedelta(days=1))
+
+  # now, all is fresh
+  nose.tools.eq_(refresh_users(session), [])
+  nose.tools.eq_(len(refresh_users(session, force=True)), len(accounts) + 1)
+
+def test_concurrent_subscribe():
+
+  import tempfile
+  import threading
+
+  tmpfile = tempfile.NamedTemporaryFile()
+  setup = connect(tmpfile.name)
+  add(setup, in3days, menu_french2, menu_english2)
+  setup.close()
+
+  results = []
+  def worker():
+    local = connect(tmpfile.name)
+    sub = subscribe(local, in3days, 2)
+    results.append((sub.lunch.date, sub.persons))
+    local.close()
+
+  threads = [threading.Thread(target=worker) for k in range(8)]
+  for t in threads: t.start()
+  for t in threads: t.join()
+
+  nose.tools.eq_(results, [(in3days, 2)] * 8)
+  check = connect(tmpfile.name)
+  nose.tools.eq_(check.query(Subscription).count(), 1)
+  nose.tools.eq_(check.query(User).count(), 1)
+  check.close()
+
+def test_concurrent_unsubscribe():
+
+  import tempfile
+  import threading
+  import warnings
+
+  tmpfile = tempfile.NamedTemporaryFile()
+  setup = connect(tmpfile.name)
+  add(setup, in3days, menu_french2, menu_english2)
+  subscribe(setup, in3days, 2)
+  setup.close()
+
+  results = []
+  def worker():
+    local = connect(tmpfile.name)
+    sub = unsubscribe(local, in3days)
+    results.append(sub and (sub.lunch.date, sub.persons))
+    local.close()
+
+  with warnings.catch_warnings(record=True) as caught:
+    warnings.simplefilter('always')
+    threads = [threading.Thread(target=worker) for k in range(8)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+  # only one of them removes the subscription
+  nose.tools.eq_(sorted(results, key=bool), [None] * 7 + [(in3days, 2)])
+  nose.tools.eq_([str(k.message) for k in caught \
+      if 'DELETE statement' in str(k.message)], [])
+  check = connect(tmpfile.name)
+  nose.tools.eq_(check.query(Subscription).count(), 0)
+  check.close()
+
+def test_duplicate_subscribe_releases_lock():
+
+  import sqlite3
+  import tempfile
+
+  tmpfile = tempfile.NamedTemporaryFile()
+  local = connect(tmpfile.name)
+  add(local, in3days, menu_french2, menu_english2)
+  subscribe(local, in3days, 1)
+  subscribe(local, in3days, 1) #inserts nothing
+
+  # another writer must not find the database locked
+  other = sqlite3.connect(tmpfile.name, timeout=0, isolation_level=None)
+  try:
+    other.execute('BEGIN IMMEDIATE')
+    other.execute('ROLLBACK')
+  finally:
+    other.close()
+  local.close()
+
+def seed_history(dbfile, days):
+  """Seeds the database with a past lunch every day, for the number of days"""
+
+  local = connect(dbfile)
+  user = get_current_user(local)
+  local.execute(Lunch.__table__.insert(), [
+    {'date': today - datetime.timedelta(days=k), 'menu_french': menu_french0,
+      'menu_english': menu_english0, 'user_id': user.id}
+    for k in range(1, days+1)])
+  add(local, tomorrow, menu_french1, menu_english1)
+  add(local, in3days, menu_french2, menu_english2)
+  local.commit()
+  local.close()
+
+def test_query_count_scaling():
+
+  import tempfile
+  from .scripts.manage import main
+
+  counts = []
+  for days in (10, 20000):
+    tmpfile = tempfile.NamedTemporaryFile()
+    seed_history(tmpfile.name, days)
+    local = connect(tmpfile.name)
+
+    lookups = [
+        count_statements(next_lunch, local)[1],
+        count_statements(next_subscribeable_lunch, local)[1],
+        count_statements(lunch_at_date, local, 'next')[1],
+        count_statements(lunch_at_date, local, in3days)[1],
+        ]
+    nose.tools.eq_(lookups, [1, 1, 1, 1])
+    local.close()
+
+    # statements issued by full command line invocations
+    counts.append([count_statements(main, ['--dbfile=%s' % tmpfile.name] + \
+      list(cmdline))[1] for cmdline in (
+        ('subscribe', in3days.strftime('%d.%m.%y')),
+        ('unsubscribe', in3days.strftime('%d.%m.%y')),
+        ('remind', '--dry-run', '--force'),
+        )])
+
+  nose.tools.eq_(counts[0], counts[1])
+
+def test_readonly_listing():
+
+  import tempfile
+  import sqlite3
+  import sqlalchemy.exc
+
+  tmpfile = tempfile.NamedTemporaryFile()
+  local = connect(tmpfile.name)
+  add(local, yesterday, menu_french0, menu_english0)
+  add(local, tomorrow, menu_french1, menu_english1)
+  add(local, in3days, menu_french2, menu_english2)
+  add(local, in7days, menu_french3, menu_english3)
+  subscribe(local, tomorrow, 1)
+  subscribe(local, in7days, 3)
+  username = get_current_user(local).name
+
+  # a subscriber holds the write lock while we list
+  blocker = sqlite3.connect(tmpfile.name, isolation_level=None)
+  blocker.execute('BEGIN IMMEDIATE')
+
+  try:
+    with connect_readonly(tmpfile.name).connect() as connection:
+      for start, end in ((today, datetime.date.max), (in3days, in7days),
+          (fivedaysago, twodaysago)):
+        for long_desc in (True, False):
+          nose.tools.eq_(
+              lunch_list_readonly(connection, start, end, long_desc),
+              lunch_list(local, start, end, long_desc))
+          nose.tools.eq_(
+              user_list_readonly(connection, username, start, end, long_desc),
+              user_list(local, username, start, end, long_desc))
+
+      # writing is not possible
+      nose.tools.assert_raises(sqlalchemy.exc.OperationalError,
+          connection.execute, Lunch.__table__.delete())
+
+  finally:
+    blocker.execute('ROLLBACK')
+    blocker.close()
+    local.close()
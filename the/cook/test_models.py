@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sat 17 Oct 2026 23:02:18 CEST
+
+import os
+import sqlite3
+import getpass
+import datetime
+import tempfile
+import nose.tools
+import sqlalchemy.exc
+
+from .models import connect, create, schema_version, SCHEMA_VERSION, \
+    User, Lunch, Subscription, retry_when_locked, connect_readonly
+
+# the schema of databases created before versioning was introduced
+LEGACY_SCHEMA = """
+CREATE TABLE user (id INTEGER NOT NULL, name VARCHAR(16), PRIMARY KEY (id), UNIQUE (name));
+CREATE TABLE lunch (id INTEGER NOT NULL, date DATE, menu_french VARCHAR(128), menu_english VARCHAR(128), user_id INTEGER, PRIMARY KEY (id), UNIQUE (date), FOREIGN KEY(user_id) REFERENCES user (id));
+CREATE TABLE subscription (id INTEGER NOT NULL, persons INTEGER, date DATETIME, lunch_id INTEGER, user_id INTEGER, PRIMARY KEY (id), FOREIGN KEY(lunch_id) REFERENCES lunch (id), FOREIGN KEY(user_id) REFERENCES user (id));
+INSERT INTO user VALUES (%(uid)d, '%(name)s');
+INSERT INTO lunch VALUES (1, '2014-04-28', 'Risotto', 'Risotto', %(uid)d);
+INSERT INTO subscription VALUES (1, 1, '2014-04-27 10:00:00.000000', 1, %(uid)d);
+INSERT INTO subscription VALUES (2, 3, '2014-04-27 11:00:00.000000', 1, %(uid)d);
+"""
+
+def test_upgrade():
+
+  tmpfile = tempfile.NamedTemporaryFile()
+  legacy = sqlite3.connect(tmpfile.name)
+  legacy.executescript(LEGACY_SCHEMA % {'uid': os.getuid(),
+    'name': getpass.getuser()})
+  legacy.close()
+
+  session = connect(tmpfile.name)
+  nose.tools.eq_(schema_version(session.connection()), SCHEMA_VERSION)
+
+  # existing information is preserved, duplicates are removed
+  user = session.query(User).one()
+  nose.tools.eq_(user.fullname, None)
+  lunch = session.query(Lunch).one()
+  nose.tools.eq_(len(lunch.subscriptions), 1)
+  nose.tools.eq_(lunch.subscriptions[0].id, 1)
+
+  # new columns can be used
+  user.refresh()
+  session.commit()
+  assert user.fullname is not None
+  session.close()
+
+  # upgrading is idempotent
+  session = connect(tmpfile.name)
+  nose.tools.eq_(session.query(User).one().fullname, user.fullname)
+  session.close()
+
+def test_failed_upgrade():
+
+  from . import models
+
+  tmpfile = tempfile.NamedTemporaryFile()
+  legacy = sqlite3.connect(tmpfile.name)
+  legacy.executescript(LEGACY_SCHEMA % {'uid': os.getuid(),
+    'name': getpass.getuser()})
+  legacy.close()
+
+  def broken(connection): raise RuntimeError('broken migration')
+  original, models.MIGRATIONS[1] = models.MIGRATIONS[1], broken
+  try:
+    nose.tools.assert_raises(RuntimeError, create, tmpfile.name)
+  finally:
+    models.MIGRATIONS[1] = original
+
+  # the first migration and the new tables were rolled back as well
+  check = sqlite3.connect(tmpfile.name)
+  nose.tools.eq_(check.execute('PRAGMA user_version').fetchone()[0], 0)
+  columns = [k[1] for k in check.execute('PRAGMA table_info(user)')]
+  nose.tools.eq_(columns, ['id', 'name'])
+  tables = [k[0] for k in check.execute('SELECT name FROM sqlite_master ' \
+      "WHERE type='table'")]
+  nose.tools.eq_(sorted(tables), ['lunch', 'subscription', 'user'])
+  nose.tools.eq_(check.execute('SELECT COUNT(*) FROM subscription').fetchone(),
+      (2,))
+  check.close()
+
+  # once fixed, upgrading works
+  session = connect(tmpfile.name)
+  nose.tools.eq_(schema_version(session.connection()), SCHEMA_VERSION)
+  session.close()
+
+def test_readonly_upgrade():
+
+  from .menu import lunch_list_readonly
+
+  tmpfile = tempfile.NamedTemporaryFile()
+  legacy = sqlite3.connect(tmpfile.name)
+  legacy.executescript(LEGACY_SCHEMA % {'uid': os.getuid(),
+    'name': getpass.getuser()})
+  legacy.close()
+
+  # old databases are upgraded before they can be read
+  engine = connect_readonly(tmpfile.name)
+  with engine.connect() as connection:
+    nose.tools.eq_(schema_version(connection), SCHEMA_VERSION)
+    lunches = lunch_list_readonly(connection, datetime.date(2014, 1, 1),
+        datetime.date(2014, 12, 31), True)
+  assert lunches
+
+  # up-to-date databases are opened read-only
+  engine = connect_readonly(tmpfile.name)
+  with engine.connect() as connection:
+    nose.tools.assert_raises(sqlalchemy.exc.OperationalError,
+        connection.execute, 'DELETE FROM lunch')
+  engine.dispose()
+
+def test_fresh():
+
+  engine = create(None)
+  with engine.connect() as connection:
+    nose.tools.eq_(schema_version(connection), SCHEMA_VERSION)
+
+@nose.tools.raises(sqlalchemy.exc.IntegrityError)
+def test_unique_subscription():
+
+  session = connect(None)
+  user = User(os.getuid(), getpass.getuser())
+  lunch = Lunch(datetime.date.today(), 'Risotto', 'Risotto', user)
+  session.add(user)
+  session.add(lunch)
+  session.add(Subscription(lunch, user, 1))
+  session.add(Subscription(lunch, user, 2))
+  session.commit()
+
+def test_pragmas():
+
+  tmpfile = tempfile.NamedTemporaryFile()
+  engine = create(tmpfile.name, pragmas={'busy_timeout': 1234})
+  with engine.connect() as connection:
+    pragma = lambda k: connection.execute('PRAGMA %s' % k).scalar()
+    nose.tools.eq_(pragma('journal_mode'), 'wal')
+    nose.tools.eq_(pragma('busy_timeout'), 1234)
+    nose.tools.eq_(pragma('synchronous'), 1) #NORMAL
+  engine.dispose()
+
+class FakeSession(object):
+
+  def __init__(self): self.rollbacks = 0
+  def rollback(self): self.rollbacks += 1
+
+def test_retry():
+
+  calls = []
+
+  @retry_when_locked(retries=3, backoff=0.001)
+  def locked_twice(session):
+    calls.append(session)
+    if len(calls) <= 2:
+      raise sqlalchemy.exc.OperationalError('INSERT',
+          {}, sqlite3.OperationalError('database is locked'))
+    return 42
+
+  session = FakeSession()
+  nose.tools.eq_(locked_twice(session), 42)
+  nose.tools.eq_(len(calls), 3)
+  nose.tools.eq_(session.rollbacks, 2)
+
+@nose.tools.raises(sqlalchemy.exc.OperationalError)
+def test_retry_gives_up():
+
+  @retry_when_locked(retries=2, backoff=0.001)
+  def always_locked(session):
+    raise sqlalchemy.exc.OperationalError('INSERT',
+        {}, sqlite3.OperationalError('database is locked'))
+
+  always_locked(FakeSession())
+
+def test_retry_concurrent():
+
+  import threading
+  from .menu import add, subscribe
+
+  tmpfile = tempfile.NamedTemporaryFile()
+  session = connect(tmpfile.name, pragmas={'busy_timeout': 0})
+  add(session, datetime.date.today() + datetime.timedelta(days=3),
+      'Risotto', 'Risotto')
+
+  # another process holds the write lock for a while
+  blocker = sqlite3.connect(tmpfile.name, isolation_level=None,
+      check_same_thread=False)
+  blocker.execute('BEGIN IMMEDIATE')
+  release = threading.Timer(0.3, lambda: blocker.execute('COMMIT'))
+  release.start()
+
+  try:
+    sub = subscribe(session,
+        datetime.date.today() + datetime.timedelta(days=3), 2)
+    assert isinstance(sub, Subscription)
+    nose.tools.eq_(sub.persons, 2)
+  finally:
+    release.join()
+    blocker.close()
+    session.close()
+
+def test_cached_engine():
+
+  from .instrument import count_statements
+  from . import models
+
+  tmpfile = tempfile.NamedTemporaryFile(suffix='.sql3')
+  engine = create(tmpfile.name)
+
+  # the same process re-uses the engine, with no statements at all
+  same, statements = count_statements(create, tmpfile.name)
+  assert same is engine
+  nose.tools.eq_(statements, 0)
+
+  # another process only checks the schema version
+  models._engines.clear()
+  other, statements = count_statements(create, tmpfile.name)
+  assert other is not engine
+  nose.tools.eq_(statements, 1)
+
+  # different settings get different engines
+  assert create(tmpfile.name, pragmas={'cache_size': -1024}) is not other
+
+  # re-created databases are new
+  recreated = create(tmpfile.name, recreate=True)
+  assert recreated is not other
+  nose.tools.eq_(len(connect(tmpfile.name).query(User).all()), 0)
+
+def test_replaced_file():
+
+  tmpdir = tempfile.mkdtemp()
+  dbfile = os.path.join(tmpdir, 'test.sql3')
+  try:
+    session = connect(dbfile)
+    session.add(User(os.getuid(), getpass.getuser()))
+    session.commit()
+    session.close()
+
+    # the file is replaced behind our back, the schema is created again
+    os.unlink(dbfile)
+    nose.tools.eq_(connect(dbfile).query(User).all(), [])
+  finally:
+    import shutil
+    shutil.rmtree(tmpdir)
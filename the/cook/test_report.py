@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sun 18 Oct 2026 11:20:07 CEST
+
+import os
+import shutil
+import datetime
+import tempfile
+import nose.tools
+import six
+
+from .report import Cache, to_pdf, to_csv, total
+
+def make_data(subscribers=3):
+
+  return {
+      'date': datetime.date(2026, 10, 19),
+      'menu_french': six.u('Risotto aux champignons (végétarien)'),
+      'menu_english': 'Mushroom risotto',
+      'subscribers': [{
+        'name': 'user%d' % k,
+        'fullname': 'User %d' % k,
+        'phone': '+41277217%03d' % k,
+        'email': 'user%d@example.com' % k,
+        'persons': 1 + k % 3,
+        } for k in range(subscribers)],
+      }
+
+def check_pdf(document):
+  """Checks the PDF cross-reference table points to the right objects"""
+
+  assert document.startswith(b'%PDF-1.4')
+  assert document.endswith(b'%%EOF\n')
+  startxref = int(document.rsplit(b'startxref\n', 1)[1].split()[0])
+  assert document[startxref:].startswith(b'xref\n')
+  size = int(document[startxref:].split(b'\n')[1].split()[1])
+  entries = document[startxref:].split(b'\n')[3:size+2]
+  for number, entry in enumerate(entries, 1):
+    offset = int(entry.split()[0])
+    assert document[offset:].startswith(b'%d 0 obj' % number), number
+
+def test_pdf():
+
+  document = to_pdf(make_data())
+  check_pdf(document)
+  nose.tools.eq_(document.count(b'/Type /Page '), 1)
+  assert b'(User 2)' in document
+  assert six.u('végétarien').encode('cp1252') in document
+
+def test_pdf_pages():
+
+  document = to_pdf(make_data(200))
+  check_pdf(document)
+  nose.tools.eq_(document.count(b'/Type /Page '), 4)
+
+def test_csv():
+
+  data = make_data()
+  rows = to_csv(data).decode('utf-8').splitlines()
+  nose.tools.eq_(len(rows), 5)
+  nose.tools.eq_(rows[1], 'User 0,+41277217000,user0@example.com,1,10,')
+  nose.tools.eq_(rows[-1], 'Total,,,%d,%d,' % (total(data), 10*total(data)))
+
+def test_cache():
+
+  cache = Cache()
+  data = make_data()
+  first = cache.get(data, 'pdf')
+  nose.tools.eq_(cache.get(make_data(), 'pdf'), first)
+  nose.tools.eq_(cache.rendered, 1)
+
+  # changes to subscriptions produce a new document
+  data['subscribers'][0]['persons'] = 3
+  assert cache.get(data, 'pdf') != first
+  nose.tools.eq_(cache.rendered, 2)
+
+def test_persistent_cache():
+
+  cachedir = tempfile.mkdtemp()
+  try:
+    attachments = Cache(cachedir).attachments(make_data())
+    nose.tools.eq_([k[0] for k in attachments],
+        ['repas-2026-10-19.pdf', 'repas-2026-10-19.csv'])
+    nose.tools.eq_(len(os.listdir(cachedir)), 2)
+
+    # another process would not render them again
+    cache = Cache(cachedir)
+    nose.tools.eq_(cache.attachments(make_data()), attachments)
+    nose.tools.eq_(cache.rendered, 0)
+  finally:
+    shutil.rmtree(cachedir)
+
+def test_default_cache():
+
+  from . import report
+
+  tmpdir = tempfile.mkdtemp()
+  dbfile = os.path.join(tmpdir, 'test.sql3')
+  environment = os.environ.pop('THECOOK_REPORT_CACHE', None)
+  try:
+    report._cache = None
+    attachments = report.get_cache(dbfile).attachments(make_data())
+    nose.tools.eq_(len(os.listdir(dbfile + '.reports')), 2)
+
+    # another run of manage report
+    report._cache = None
+    cache = report.get_cache(dbfile)
+    nose.tools.eq_(cache.attachments(make_data()), attachments)
+    nose.tools.eq_(cache.rendered, 0)
+
+  finally:
+    report._cache = None
+    if environment is not None:
+      os.environ['THECOOK_REPORT_CACHE'] = environment
+    shutil.rmtree(tmpdir)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sun 18 Oct 2026 12:41:09 CEST
+
+import datetime
+import tempfile
+import nose.tools
+
+from . import scheduler
+from .scheduler import Schedule, Scheduler
+from .models import connect, JobRun
+
+monday = datetime.datetime(2026, 10, 19, 11, 40) #a monday
+
+calls = []
+
+def setup_jobs():
+
+  del calls[:]
+  scheduler.JOBS['test'] = lambda session, **kwargs: calls.append(kwargs)
+  def fail(session, **kwargs): raise RuntimeError('no lunch today')
+  scheduler.JOBS['fail'] = fail
+
+def teardown_jobs():
+
+  del scheduler.JOBS['test']
+  del scheduler.JOBS['fail']
+
+def test_schedule():
+
+  schedule = Schedule('mon-fri 11:30')
+  nose.tools.eq_(schedule.previous(monday), datetime.datetime(2026, 10, 19, 11, 30))
+  nose.tools.eq_(schedule.next(monday), datetime.datetime(2026, 10, 20, 11, 30))
+
+  # week-ends are skipped
+  friday = datetime.datetime(2026, 10, 23, 12, 0)
+  nose.tools.eq_(schedule.next(friday), datetime.datetime(2026, 10, 26, 11, 30))
+
+  schedule = Schedule('thu 10:00')
+  nose.tools.eq_(schedule.previous(monday), datetime.datetime(2026, 10, 15, 10, 0))
+  nose.tools.eq_(schedule.next(monday), datetime.datetime(2026, 10, 22, 10, 0))
+
+  schedule = Schedule('18:05')
+  nose.tools.eq_(schedule.next(monday), datetime.datetime(2026, 10, 19, 18, 5))
+
+@nose.tools.raises(ValueError)
+def test_schedule_invalid():
+
+  Schedule('someday 11:30')
+
+@nose.tools.with_setup(setup_jobs, teardown_jobs)
+def test_exactly_once():
+
+  config = {'jobs': {'test': {'at': 'mon-fri 11:30', 'to': ['a@example.com']}}}
+  tmpfile = tempfile.NamedTemporaryFile(suffix='.sql3')
+
+  session = connect(tmpfile.name)
+  runs = Scheduler(session, config).run_pending(monday)
+  nose.tools.eq_(len(runs), 1)
+  nose.tools.eq_(runs[0].status, JobRun.DONE)
+  assert runs[0].duration() >= 0
+  nose.tools.eq_(calls, [{'to': ['a@example.com']}])
+
+  # after a restart, the job does not run again for the same slot
+  session = connect(tmpfile.name)
+  nose.tools.eq_(Scheduler(session, config).run_pending(monday), [])
+  nose.tools.eq_(len(calls), 1)
+
+  # but does on the next day
+  tuesday = monday + datetime.timedelta(days=1)
+  nose.tools.eq_(len(Scheduler(session, config).run_pending(tuesday)), 1)
+  nose.tools.eq_(len(calls), 2)
+
+@nose.tools.with_setup(setup_jobs, teardown_jobs)
+def test_grace():
+
+  config = {'grace': 300, 'jobs': {'test': {'at': '11:30'}}}
+  session = connect(None)
+
+  # too late for today's run
+  nose.tools.eq_(Scheduler(session, config).run_pending(monday), [])
+  nose.tools.eq_(calls, [])
+
+  late = datetime.datetime(2026, 10, 19, 11, 35)
+  nose.tools.eq_(len(Scheduler(session, config).run_pending(late)), 1)
+
+@nose.tools.with_setup(setup_jobs, teardown_jobs)
+def test_failure():
+
+  config = {'jobs': {'fail': {'at': '11:30'}, 'test': {'at': '11:30'}}}
+  session = connect(None)
+  runs = Scheduler(session, config).run_pending(monday)
+  nose.tools.eq_([(k.job, k.status) for k in runs],
+      [('fail', JobRun.FAILED), ('test', JobRun.DONE)])
+  assert 'no lunch today' in runs[0].error
+
+  nose.tools.eq_([k.job for k in scheduler.runs(session, 'fail')], ['fail'])
+
+@nose.tools.raises(ValueError)
+def test_unknown_job():
+
+  Scheduler(connect(None), {'jobs': {'dance': {'at': '11:30'}}})
+
+@nose.tools.raises(ValueError)
+def test_unknown_option():
+
+  Scheduler(connect(None), {'jobs': {'remind': {'at': '11:30', 'qeue': True}}})
+
+@nose.tools.raises(ValueError)
+def test_missing_schedule():
+
+  Scheduler(connect(None), {'jobs': {'remind': {'queue': True}}})
+
+def test_load_config():
+
+  tmpfile = tempfile.NamedTemporaryFile(suffix='.json', mode='wt')
+  tmpfile.write('{"jobs": {"report": {"at": "18:05", "to": ["a@b.c"], ' \
+      '"forced": true}}}')
+  tmpfile.flush()
+  nose.tools.assert_raises(ValueError, scheduler.load_config, tmpfile.name)
+
+  scheduler.check_config({'jobs': {'remind': {'at': '11:30', 'queue': True,
+    'personal': True, 'concurrency': 8}}})
+  scheduler.check_config(scheduler.DEFAULT_CONFIG)
+
+def test_no_jobs():
+
+  nose.tools.eq_(Scheduler(connect(None), {'jobs': {}}).next(monday), None)
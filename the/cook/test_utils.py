@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sun 18 Oct 2026 10:02:18 CEST
+
+import datetime
+import nose.tools
+import six
+
+from .utils import format_date, format_datetime, month_name
+
+def test_format_date():
+
+  date = datetime.date(2026, 10, 19)
+  nose.tools.eq_(format_date(date), 'Monday, 19/10/2026')
+  nose.tools.eq_(format_date(date, 'fr'), six.u('lundi, 19/10/2026'))
+  nose.tools.eq_(format_date('tomorrow'), 'tomorrow')
+
+def test_format_datetime():
+
+  date = datetime.datetime(2026, 8, 2, 9, 5)
+  nose.tools.eq_(format_datetime(date), 'Sunday, 02/08/2026 at 09:05')
+  nose.tools.eq_(format_datetime(date, 'fr'),
+      six.u('dimanche, 02/08/2026 à 09:05'))
+  nose.tools.eq_(month_name(date, 'fr'), six.u('août'))
+
+def test_concurrent():
+
+  from concurrent.futures import ThreadPoolExecutor
+
+  dates = [datetime.date(2026, 1, 1) + datetime.timedelta(days=k) \
+      for k in range(365)]
+  languages = ['en', 'fr'] * (len(dates) // 2) + ['en']
+
+  with ThreadPoolExecutor(8) as executor:
+    formatted = list(executor.map(format_date, dates, languages))
+
+  for date, language, text in zip(dates, languages, formatted):
+    nose.tools.eq_(text, format_date(date, language))
+    if language == 'en': nose.tools.eq_(text, date.strftime('%A, %d/%m/%Y'))
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Andre Anjos <andre.anjos@idiap.ch>
+# Sat 17 Oct 2026 23:41:07 CEST
+
+"""Text and date formatting helpers
+
+This module is imported by the command line parsing code, so it must stay
+light: do not import SQLAlchemy or other heavy modules here.
+"""
+
+import six
+
+DAYS = {
+    'en': ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday',
+      'Saturday', 'Sunday'),
+    'fr': (six.u('lundi'), six.u('mardi'), six.u('mercredi'), six.u('jeudi'),
+      six.u('vendredi'), six.u('samedi'), six.u('dimanche')),
+    }
+
+MONTHS = {
+    'en': ('January', 'February', 'March', 'April', 'May', 'June', 'July',
+      'August', 'September', 'October', 'November', 'December'),
+    'fr': (six.u('janvier'), six.u('f\u00e9vrier'), six.u('mars'),
+      six.u('avril'), six.u('mai'), six.u('juin'), six.u('juillet'),
+      six.u('ao\u00fbt'), six.u('septembre'), six.u('octobre'),
+      six.u('novembre'), six.u('d\u00e9cembre')),
+    }
+
+AT = {'en': 'at', 'fr': six.u('\u00e0')}
+
+def day_name(date, language='en'):
+  """Returns the name of the week day, in the given language
+
+  Names come from the tables in this module and not from the C library, so
+  the result does not depend on the process locale.
+  """
+
+  return DAYS[language][date.weekday()]
+
+def month_name(date, language='en'):
+  """Returns the name of the month, in the given language"""
+
+  return MONTHS[language][date.month-1]
+
+def format_date(date, language='en'):
+  """Standard date formatting"""
+  if isinstance(date, six.string_types): return date
+  return '%s, %02d/%02d/%04d' % (day_name(date, language), date.day,
+      date.month, date.year)
+
+def format_datetime(date, language='en'):
+  """Standard date formatting"""
+  if isinstance(date, six.string_types): return date
+  return '%s %s %02d:%02d' % (format_date(date, language), AT[language],
+      date.hour, date.minute)
+
+def as_unicode(s):
+  if not six.PY3 and isinstance(s, str): return s.decode('utf-8')
+  return s
+
+def as_str(s):
+  if not six.PY3 and not isinstance(s, str): return s.encode('utf-8')
+  return s
+
+def name_and_email(name, fullname=None, email=None):
+  """Formats a user as ``Full Name <email>``, with fallbacks for missing
+  information"""
+
+  return '%s <%s>' % (fullname or name, email or name + '@idiap.ch')